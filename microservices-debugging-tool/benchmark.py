@@ -0,0 +1,421 @@
+# pylint: disable=dangerous-default-value
+import asyncio
+import gzip
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from functools import cmp_to_key
+from typing import Callable, List
+import numpy as np
+from pika.spec import Basic
+
+from sfldebug.aggregator import EntityAggregator
+from sfldebug.analytics import SPECTRA_KEYS, get_parent_key, weight_service_entities
+from sfldebug.entity import EntityType, MethodEntity, build_entity, get_entity_key
+import sfldebug.messages.parse_message as pm
+from sfldebug.messages.consumer import AsyncBatchConsumer, DEFAULT_PREFETCH_COUNT
+from sfldebug.messages.decoder import JsonDecoder, decode_log_message
+from sfldebug.schema import entity_extractor
+from sfldebug.sfl import DEFAULT_TOP_K, select_top_rankings
+from sfldebug.tools.object import cmp_entities
+from sfldebug.tools.ranking_merge import RankMergeOperator
+from sfldebug.tools.ranking_metrics import RankingMetrics, get_spectra_array, \
+    normalize_rankings, normalize_rankings_batch, rank_spectra
+from sfldebug.tools.reader import open_log_file, zstandard
+
+DEFAULT_LOGS_DIR = 'test_logs'
+
+
+def get_log_files(logs_paths: List[str]) -> List[str]:
+    """Collect the log files to be benchmarked. Directories are expanded into the files inside.
+
+    Args:
+        logs_paths (List[str]): paths of log files or directories with log files
+
+    Returns:
+        List[str]: paths of the log files
+    """
+    log_files = []
+    for logs_path in logs_paths:
+        if os.path.isdir(logs_path):
+            log_files.extend(sorted(os.path.join(logs_path, filename)
+                                    for filename in os.listdir(logs_path)))
+        else:
+            log_files.append(logs_path)
+    return log_files
+
+
+def time_function(function: Callable, repeat: int = 3) -> float:
+    """Run the function a number of times and return the best wall time.
+
+    Args:
+        function (Callable): function to be timed, without arguments
+        repeat (int, optional): number of times the function is run. Defaults to 3.
+
+    Returns:
+        float: the best wall time, in seconds
+    """
+    best_time = float('inf')
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        function()
+        best_time = min(best_time, time.perf_counter() - start_time)
+    return best_time
+
+
+def benchmark_decoding(log_file: str) -> None:
+    """Compare the decoding of log messages with the full json.loads path against the decoder
+    layer, using each available json backend. Prints the messages per second for decoding only
+    and for decoding plus entity building.
+
+    Args:
+        log_file (str): path of the log file, with a json message per line
+    """
+    with open(log_file, 'rb') as file:
+        messages = [line for line in file if line.strip()]
+
+    paths = {'json.loads (full)': json.loads}
+    for decoder in JsonDecoder:
+        if decoder.is_available():
+            paths['decoder {}'.format(decoder.value)] = \
+                lambda message, decoder=decoder: decode_log_message(message, decoder)
+
+    print('{} ({} messages)'.format(log_file, len(messages)))
+    for name, decode in paths.items():
+        decode_time = time_function(lambda decode=decode: [decode(message)
+                                                           for message in messages])
+        build_time = time_function(lambda decode=decode: [build_entity(decode(message))
+                                                          for message in messages])
+        print('  {:<24} decode: {:>10.0f} msg/s  decode+build: {:>10.0f} msg/s'.format(
+            name, len(messages) / decode_time, len(messages) / build_time))
+
+
+def benchmark_extraction(log_file: str) -> None:
+    """Compare building the entities of decoded log messages with build_entity against the
+    extractor compiled from the entity schema. Prints the messages per second of each.
+
+    Args:
+        log_file (str): path of the log file, with a json message per line
+    """
+    with open(log_file, 'rb') as file:
+        logs = [decode_log_message(line) for line in file if line.strip()]
+
+    print('{} ({} messages)'.format(log_file, len(logs)))
+    for name, extract in {'build_entity': build_entity,
+                          'compiled extractor': entity_extractor}.items():
+        extract_time = time_function(lambda extract=extract: [extract(log_data)
+                                                              for log_data in logs])
+        print('  {:<24} build: {:>10.0f} msg/s'.format(name, len(logs) / extract_time))
+
+
+class InProcessChannel:
+    """In-process stand-in for a MQ channel. Counts the acknowledgements instead of sending them to
+    a broker."""
+
+    def __init__(self) -> None:
+        self.acks = 0
+
+    def basic_ack(self, delivery_tag: int = 0, multiple: bool = False) -> None:
+        """Count an acknowledgement."""
+        del delivery_tag, multiple
+        self.acks += 1
+
+
+def benchmark_consumer(
+    log_file: str,
+    batch_sizes: List[int] = [1, 100, 1000, 10000]
+) -> None:
+    """Measure the receive rate of the batched consumer, delivering the messages of a log file
+    in-process (no broker), with manual acks. Batch size 1 corresponds to a message per ack.
+
+    Args:
+        log_file (str): path of the log file, with a json message per line
+        batch_sizes (List[int], optional): batch sizes to be measured.
+        Defaults to [1, 100, 1000, 10000].
+    """
+    with open(log_file, 'rb') as file:
+        messages = [line for line in file if line.strip()]
+    deliveries = [Basic.Deliver(delivery_tag=tag) for tag in range(1, len(messages) + 1)]
+
+    print('{} ({} messages)'.format(log_file, len(messages)))
+    for batch_size in batch_sizes:
+        channel = InProcessChannel()
+        consumer = AsyncBatchConsumer('benchmark', 'benchmark', pm.parse_mq_batch,
+                                      prefetch_count=max(batch_size, DEFAULT_PREFETCH_COUNT),
+                                      batch_size=batch_size)
+        consumer.channel = channel  # type: ignore
+
+        async def deliver_messages(consumer=consumer, channel=channel) -> None:
+            for delivery, message in zip(deliveries, messages):
+                consumer.on_message(channel, delivery, None, message)  # type: ignore
+            consumer.flush()
+
+        start_time = time.perf_counter()
+        asyncio.run(deliver_messages())
+        elapsed_time = time.perf_counter() - start_time
+        pm.clear_entities()
+        print('  batch size {:>6}  {:>10.0f} msg/s  acks: {}'.format(
+            batch_size, len(messages) / elapsed_time, channel.acks))
+
+
+def benchmark_compression(log_file: str) -> None:
+    """Compare reading a log file uncompressed against reading gzip and zstd (if installed)
+    compressed copies of it, streamed through open_log_file. Prints the read throughput in
+    uncompressed MB per second, and the messages per second including parsing.
+
+    Args:
+        log_file (str): path of the uncompressed log file, with a json message per line
+    """
+    with tempfile.TemporaryDirectory() as compressed_dir:
+        copies = {'plain': log_file}
+        gzip_path = os.path.join(compressed_dir, os.path.basename(log_file) + '.gz')
+        with open(log_file, 'rb') as source, gzip.open(gzip_path, 'wb') as target:
+            shutil.copyfileobj(source, target)
+        copies['gzip'] = gzip_path
+        if zstandard is not None:
+            zstd_path = os.path.join(compressed_dir, os.path.basename(log_file) + '.zst')
+            with open(log_file, 'rb') as source, open(zstd_path, 'wb') as target:
+                zstandard.ZstdCompressor().copy_stream(source, target)
+            copies['zstd'] = zstd_path
+
+        size_mb = os.path.getsize(log_file) / (1 << 20)
+        print('{} ({:.1f} MB)'.format(log_file, size_mb))
+        for name, path in copies.items():
+            def read_lines(path=path) -> int:
+                with open_log_file(path) as file:
+                    return sum(1 for _ in file)
+
+            def parse_lines(path=path) -> None:
+                with open_log_file(path) as file:
+                    for line in file:
+                        pm.parse_json_entity(line)
+                pm.clear_entities()
+
+            n_messages = read_lines()
+            read_time = time_function(read_lines)
+            parse_time = time_function(parse_lines, repeat=1)
+            print('  {:<6} {:>6.1f} MB on disk  read: {:>8.1f} MB/s  read+parse: {:>10.0f} msg/s'
+                  .format(name, os.path.getsize(path) / (1 << 20), size_mb / read_time,
+                          n_messages / parse_time))
+
+
+def benchmark_memory(log_file: str) -> None:
+    """Measure the memory used by the references of the entities parsed from a log file, with the
+    compact reference records against the same references as plain dicts, and as lazy references
+    to the lines. Prints the bytes per log line, measured with tracemalloc.
+
+    Args:
+        log_file (str): path of the log file, with a json message per line
+    """
+    with open_log_file(log_file) as file:
+        lines = [line for line in file if line.strip()]
+
+    def parse_references() -> List:
+        references = []
+        for line in lines:
+            for entity in pm.parse_json_entity(line, aggregator=EntityAggregator()):
+                references.extend(next(iter(entity.references.values())))
+        return references
+
+    def parse_lazy_references() -> List:
+        # the lines are not read back, the offsets only need the right size
+        references = []
+        offset = 0
+        for line in lines:
+            for entity in pm.parse_json_entity_lazy(line, log_file, offset, EntityAggregator()):
+                references.extend(next(iter(entity.references.values())))
+            offset += len(line)
+        return references
+
+    def measure(build: Callable) -> int:
+        tracemalloc.start()
+        kept = build()
+        used = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del kept
+        return used
+
+    compact_used = measure(parse_references)
+    dict_used = measure(lambda: [reference.to_dict() for reference in parse_references()])
+    lazy_used = measure(parse_lazy_references)
+    print('{} ({} lines)'.format(log_file, len(lines)))
+    print('  records: {:>8.0f} B/line  dicts: {:>8.0f} B/line  lazy: {:>8.0f} B/line'.format(
+        compact_used / len(lines), dict_used / len(lines), lazy_used / len(lines)))
+
+
+def benchmark_reference_merging(n_references: int = 20000) -> None:
+    """Compare merging the references of a hot entity, logged many times in the same request,
+    appending in place against copying the lists on each merge (old_list + new_list).
+    Prints the time taken by each, which is linear in place and quadratic when copying.
+
+    Args:
+        n_references (int, optional): number of times the entity is logged. Defaults to 20000.
+    """
+    invocation = {'fileName': 'Hot.java', 'className': 'Hot', 'methodName': 'hot'}
+
+    def build_hot_entity() -> MethodEntity:
+        return MethodEntity('hot', 'request', None, 'INFO', 'message', invocation)
+
+    def merge_in_place() -> None:
+        aggregator = EntityAggregator()
+        for _ in range(n_references):
+            aggregator.add(build_hot_entity())
+
+    def merge_copying() -> None:
+        stored_references: dict = {}
+        for _ in range(n_references):
+            for request_id, references in build_hot_entity().references.items():
+                stored_references[request_id] = references + stored_references.get(request_id, [])
+
+    print('Merging {} references of a hot entity'.format(n_references))
+    print('  in place: {:>8.3f} s  copying: {:>8.3f} s'.format(
+        time_function(merge_in_place), time_function(merge_copying)))
+
+
+def benchmark_service_weighting(n_services: int = 10, n_methods: int = 5000) -> None:
+    """Compare weighting services with thousands of methods each, as a grouped reduction over the
+    parent index against looking up the key of each child name of each service.
+    Prints the time taken by each.
+
+    Args:
+        n_services (int, optional): number of services. Defaults to 10.
+        n_methods (int, optional): number of methods of each service. Defaults to 5000.
+    """
+    def build_entities_analyzed() -> dict:
+        entities_analyzed: dict = {}
+        for service in range(n_services):
+            service_name = 'service-{}'.format(service)
+            children_names = {'method-{}'.format(method) for method in range(n_methods)}
+            entities_analyzed[get_entity_key(service_name, EntityType.SERVICE, '')] = dict(
+                zip(SPECTRA_KEYS, (n_methods, 0, n_methods, 0)),
+                properties={'name': service_name, 'parent_name': '',
+                            'children_names': children_names, 'entity_type': EntityType.SERVICE})
+            for method_name in children_names:
+                entities_analyzed[get_entity_key(method_name, EntityType.METHOD, service_name)] = \
+                    dict(zip(SPECTRA_KEYS, (1, 2, 3, 4)),
+                         properties={'name': method_name, 'parent_name': service_name,
+                                     'children_names': set(), 'entity_type': EntityType.METHOD})
+        return entities_analyzed
+
+    entities_analyzed = build_entities_analyzed()
+    parent_keys = {key: get_parent_key(entity['properties']['entity_type'],
+                                       entity['properties']['parent_name'])
+                   for key, entity in entities_analyzed.items()}
+
+    def weight_looking_up_children() -> None:
+        for service_entity in entities_analyzed.values():
+            properties = service_entity['properties']
+            if properties['entity_type'] != EntityType.SERVICE:
+                continue
+            sums = [0] * len(SPECTRA_KEYS)
+            for child_name in properties['children_names']:
+                method_key = get_entity_key(child_name, EntityType.METHOD, properties['name'])
+                if method_key in entities_analyzed:
+                    for index, counter in enumerate(SPECTRA_KEYS):
+                        sums[index] += entities_analyzed[method_key][counter]
+            for index, counter in enumerate(SPECTRA_KEYS):
+                service_entity[counter] = sums[index] / len(properties['children_names'])
+
+    print('Weighting {} services of {} methods'.format(n_services, n_methods))
+    print('  grouped: {:>8.3f} s  lookups: {:>8.3f} s'.format(
+        time_function(lambda: weight_service_entities(entities_analyzed, parent_keys)),
+        time_function(weight_looking_up_children)))
+
+
+def benchmark_ranking(n_entities: int = 50000) -> None:
+    """Compare ranking entities with all the metrics, over the spectra array against calling each
+    metric on each entity. The per-entity metrics log each call, so logging is disabled to time
+    the computations only. Prints the time taken by each.
+
+    Args:
+        n_entities (int, optional): number of entities ranked. Defaults to 50000.
+    """
+    entities_analytics = [dict(zip(SPECTRA_KEYS, (index % 97, 1000 - index % 97,
+                                                  index % 89 + 1, 1000 - index % 89)),
+                               properties={'name': 'method-{}'.format(index), 'parent_name': ''})
+                          for index in range(n_entities)]
+    ranking_metrics = list(RankingMetrics)
+
+    def rank_per_entity() -> None:
+        metrics_rankings = [normalize_rankings([metric(entity) for entity in entities_analytics],
+                                               metric)
+                            for metric in ranking_metrics]
+        for index in range(n_entities):
+            RankMergeOperator.AVG([rankings[index] for rankings in metrics_rankings])
+
+    def rank_batch() -> None:
+        rank_spectra(get_spectra_array(entities_analytics), ranking_metrics,
+                     RankMergeOperator.AVG)
+
+    logging.disable(logging.INFO)
+    print('Ranking {} entities with {} metrics'.format(n_entities, len(ranking_metrics)))
+    print('  batch: {:>8.3f} s  per entity: {:>8.3f} s'.format(
+        time_function(rank_batch), time_function(rank_per_entity, repeat=1)))
+    logging.disable(logging.NOTSET)
+
+
+def benchmark_spectra_memoization(n_entities: int = 200000, n_unique: int = 500) -> None:
+    """Compare ranking a spectra array reduced to its unique rows against ranking every row, with
+    all the metrics. Prints the time taken by each.
+
+    Args:
+        n_entities (int, optional): number of entities ranked. Defaults to 200000.
+        n_unique (int, optional): number of distinct spectra among the entities. Defaults to 500.
+    """
+    unique_rows = np.arange(n_entities) % n_unique
+    spectra = np.stack([unique_rows % 23, 1000 - unique_rows % 23, unique_rows % 29 + 1,
+                        1000 - unique_rows % 29], axis=1).astype(np.float64)
+    ranking_metrics = list(RankingMetrics)
+
+    def rank_every_row() -> None:
+        RankMergeOperator.AVG.batch(np.stack([
+            normalize_rankings_batch(metric.batch(spectra), metric)
+            for metric in ranking_metrics]))
+
+    print('Ranking {} entities with {} distinct spectra and {} metrics'.format(
+        n_entities, n_unique, len(ranking_metrics)))
+    print('  unique spectra: {:>8.3f} s  every entity: {:>8.3f} s'.format(
+        time_function(lambda: rank_spectra(spectra, ranking_metrics, RankMergeOperator.AVG)),
+        time_function(rank_every_row)))
+
+
+def benchmark_top_k(n_entities: int = 200000, top_k: int = DEFAULT_TOP_K) -> None:
+    """Compare selecting the top-k rankings against sorting all the rankings with the entities
+    comparator, and against the full ranking. Prints the time taken by each.
+
+    Args:
+        n_entities (int, optional): number of entities ranked. Defaults to 200000.
+        top_k (int, optional): number of entities selected. Defaults to DEFAULT_TOP_K.
+    """
+    # few distinct rankings, so there are many ties
+    entities_ranks = np.arange(n_entities, dtype=np.float64) % 1009 / 1009
+    entities_keys = np.arange(n_entities, dtype=np.uint64)
+
+    def sort_comparator() -> None:
+        entities_ranking = [{'entity_rank': entity_rank} for entity_rank in entities_ranks.tolist()]
+        entities_ranking.sort(key=cmp_to_key(cmp_entities))
+
+    print('Ranking order of {} entities'.format(n_entities))
+    print('  top-{}: {:>8.3f} s  full: {:>8.3f} s  comparator sort: {:>8.3f} s'.format(
+        top_k, time_function(lambda: select_top_rankings(entities_ranks, entities_keys, top_k)),
+        time_function(lambda: select_top_rankings(entities_ranks, entities_keys)),
+        time_function(sort_comparator, repeat=1)))
+
+
+if __name__ == '__main__':
+    benchmark_reference_merging()
+    benchmark_service_weighting()
+    benchmark_ranking()
+    benchmark_spectra_memoization()
+    benchmark_top_k()
+    for filepath in get_log_files(sys.argv[1:] or [DEFAULT_LOGS_DIR]):
+        benchmark_decoding(filepath)
+        benchmark_extraction(filepath)
+        benchmark_consumer(filepath)
+        benchmark_compression(filepath)
+        benchmark_memory(filepath)
@@ -1,9 +1,10 @@
 from enum import Enum
+from itertools import product
 from math import ceil
 import os
 from multiprocessing import Pool
 import time
-from functools import cmp_to_key
+from functools import cmp_to_key, partial
 from uuid import uuid4
 from typing import List, Optional
 import logging
@@ -11,10 +12,16 @@ import json
 import pika
 
 from main import run
-from sfldebug.messages.receive import receive_file, receive_mq
+from sfldebug.analytics import analyze_entities
+from sfldebug.baseline import BaselineCache
+from sfldebug.messages.parse_message import clear_entities
+from sfldebug.messages.receive import receive_file, receive_file_baseline, receive_mq
+from sfldebug.sfl import rank_configurations
+import sfldebug.tools.logger as sfl_logger
 from sfldebug.tools.ranking_metrics import RankingMetrics
 from sfldebug.tools.ranking_merge import RankMergeOperator
 from sfldebug.tools.object import cmp_deltas, extract_filename
+from sfldebug.tools.reader import open_log_file
 from sfldebug.tools.writer import write_results_to_file
 
 GOOD_LOGS_PATH = 'good_logs_path'
@@ -46,6 +53,7 @@ def get_scenario(sc_filepath: str) -> dict:
     Each file should contain 3 attributes/keys. One for the good logs file path.
     Another for the bad logs file path. And a third for the list of faulty entities expected to be
     found during the execution of the scenario.
+    The scenario file, as well as the log files, can be gzip or zstd compressed.
 
     Args:
         sc_filepath (str): the file path with the scenario contents
@@ -56,7 +64,7 @@ def get_scenario(sc_filepath: str) -> dict:
     Returns:
         dict: return the read scenario in a python object
     """
-    with open(sc_filepath, 'r', encoding='utf-8') as scenario_file:
+    with open_log_file(sc_filepath) as scenario_file:
         scenario: dict = json.load(scenario_file)
 
         # check if any of the required attributes is None
@@ -89,14 +97,14 @@ def launch_scenario(scenario: dict) -> None:
     channel = connection.channel()
 
     channel.exchange_declare(exchange=good_logs_exchange, durable=True)
-    with open(os.path.abspath(good_logs_path), 'r', encoding='utf-8') as log_file:
+    with open_log_file(os.path.abspath(good_logs_path)) as log_file:
 
         for log in log_file:
             channel.basic_publish(
                 exchange=good_logs_exchange, routing_key=good_logs_exchange, body=log)
 
     channel.exchange_declare(exchange=faulty_logs_exchange, durable=True)
-    with open(os.path.abspath(faulty_logs_path), 'r', encoding='utf-8') as log_file:
+    with open_log_file(os.path.abspath(faulty_logs_path)) as log_file:
 
         for log in log_file:
             channel.basic_publish(exchange=faulty_logs_exchange,
@@ -351,8 +359,10 @@ def run_evaluator_mq(
             with Pool(1) as pool:
                 pool.apply_async(
                     launch_scenario, kwds={'scenario': current_scenario})
+                # the evaluation needs the position of every entity, the full ranking is requested
                 entities_rankings = run(execution_id, good_entities_id, faulty_entities_id,
-                                        receive_mq, ranking_metrics, ranking_merge_operator)
+                                        receive_mq, ranking_metrics, ranking_merge_operator,
+                                        top_k=None)
                 evaluation_results = evaluate_scenario(
                     entities_rankings, current_scenario, tiebreaker)
                 write_results_to_file(evaluation_results,
@@ -368,12 +378,15 @@ def run_evaluator_mq(
 
 def run_evaluator_file(
     scenarios_dir_name: str,
-    tiebreaker: TieBreaker = TieBreaker.AS_IS
+    tiebreaker: TieBreaker = TieBreaker.AS_IS,
+    baseline_cache: Optional[BaselineCache] = None
 ) -> None:
     """Version of the evaluator that sends the logs path and the debugging tool reads to extract
     the entities.
     Run the tool evaluator by setting up and execution the scenarios saved inside the folder passed
     as argument.
+    With a baseline cache, the good logs shared by the scenarios are parsed once and loaded from
+    the cache in the next scenarios.
     For each file inside the folder, reads the contents and sets up the scenario.
     Once the debugging tool returns the results, they are evaluated according to the method
     specified in evaluate_scenario.
@@ -383,8 +396,12 @@ def run_evaluator_file(
         scenarios_dir_name (str): name of the folder where the scenarios are stored.
         tiebreaker (TieBreaker, optional): tiebreaker strategy for entities with same value in the
         ranking. Defaults to TieBreaker.AS_IS.
+        baseline_cache (Optional[BaselineCache], optional): cache of the good logs summaries.
+        Defaults to None, the good logs are parsed in each scenario.
     """
 
+    receiver_method = receive_file if baseline_cache is None else \
+        partial(receive_file_baseline, baseline_cache=baseline_cache)
     ranking_metrics = [RankingMetrics.OCHIAI, RankingMetrics.JACCARD]
     ranking_merge_operator = RankMergeOperator.AVG
     scenarios_dir = os.path.join(os.getcwd(), scenarios_dir_name)
@@ -397,8 +414,8 @@ def run_evaluator_file(
             # track execution
             start_time = time.time()
             entities_rankings = run(execution_id, current_scenario[GOOD_LOGS_PATH],
-                                    current_scenario[FAULTY_LOGS_PATH], receive_file,
-                                    ranking_metrics, ranking_merge_operator)
+                                    current_scenario[FAULTY_LOGS_PATH], receiver_method,
+                                    ranking_metrics, ranking_merge_operator, top_k=None)
             # stop execution
             execution_time = time.time() - start_time
             evaluation_results = evaluate_scenario(
@@ -416,6 +433,94 @@ def run_evaluator_file(
             logging.exception(err)
 
 
+def run_evaluator_sweep(
+    scenarios_dir_name: str,
+    metrics_grid: List[List[RankingMetrics]],
+    merge_operators: Optional[List[RankMergeOperator]] = None,
+    tiebreakers: Optional[List[TieBreaker]] = None,
+    baseline_cache: Optional[BaselineCache] = None
+) -> List[dict]:
+    """Version of the evaluator that compares configurations of the debugging tool: every
+    combination of the ranking metrics subsets, ranking merge operators and tiebreakers.
+    For each file inside the folder, reads the contents and sets up the scenario. The logs of the
+    scenario are read and analyzed once, and every configuration is ranked from the same analytics
+    (see sfldebug.sfl.rank_configurations) and evaluated with every tiebreaker, according to the
+    method specified in evaluate_scenario.
+    The evaluations of all the scenarios and configurations are saved to a single results table.
+
+    Args:
+        scenarios_dir_name (str): name of the folder where the scenarios are stored.
+        metrics_grid (List[List[RankingMetrics]]): subsets of ranking metrics to be compared.
+        merge_operators (Optional[List[RankMergeOperator]], optional): ranking merge operators to
+        be compared. Defaults to None, every operator is compared.
+        tiebreakers (Optional[List[TieBreaker]], optional): tiebreaker strategies to be compared.
+        Defaults to None, every strategy is compared.
+        baseline_cache (Optional[BaselineCache], optional): cache of the good logs summaries.
+        Defaults to None, the good logs are parsed in each scenario.
+
+    Returns:
+        List[dict]: the results table, with the evaluation of each scenario and configuration
+    """
+    if merge_operators is None:
+        merge_operators = list(RankMergeOperator)
+    if tiebreakers is None:
+        tiebreakers = list(TieBreaker)
+    receiver_method = receive_file if baseline_cache is None else \
+        partial(receive_file_baseline, baseline_cache=baseline_cache)
+    configurations = list(product(metrics_grid, merge_operators))
+    sweep_id = 'sweep-' + str(uuid4())
+    results_table: List[dict] = []
+    scenarios_dir = os.path.join(os.getcwd(), scenarios_dir_name)
+    for filename in os.listdir(scenarios_dir):
+        try:
+            current_scenario = get_scenario(
+                os.path.join(scenarios_dir, filename))
+            execution_id = extract_filename(filename)
+            sfl_logger.config_logger(execution_id)
+            clear_entities()
+
+            # receive and analyze the logs once for all the configurations
+            start_time = time.time()
+            entities = receiver_method(current_scenario[GOOD_LOGS_PATH],
+                                       current_scenario[FAULTY_LOGS_PATH], execution_id)
+            entities_analytics = analyze_entities(entities[current_scenario[GOOD_LOGS_PATH]],
+                                                  entities[current_scenario[FAULTY_LOGS_PATH]])
+            analysis_time = time.time() - start_time
+
+            # the evaluation needs the position of every entity, the full ranking is requested
+            configurations_rankings = rank_configurations(entities_analytics, configurations)
+            for (ranking_metrics, ranking_merge_operator), entities_rankings in zip(
+                    configurations, configurations_rankings):
+                for tiebreaker in tiebreakers:
+                    sfl_logger.logger.info(
+                        'Evaluating configuration: metrics %s, merge operator %s, tiebreaker %s.',
+                        [metric.value for metric in ranking_metrics], ranking_merge_operator.value,
+                        tiebreaker.value)
+                    evaluation_results = evaluate_scenario(
+                        entities_rankings, current_scenario, tiebreaker)
+                    evaluation_results.update(
+                        scenario=filename,
+                        ranking_metrics=[metric.value for metric in ranking_metrics],
+                        ranking_merge_operator=ranking_merge_operator.value,
+                        analysis_time='{:.5f}'.format(analysis_time))
+                    results_table.append(evaluation_results)
+        except AttributeError as err:
+            logging.exception(err)
+        except RuntimeError:
+            logging.exception(RuntimeError(
+                'Failed run in scenario of "{}"'.format(filename)))
+        except (OSError, ValueError) as err:
+            logging.exception(err)
+        finally:
+            sfl_logger.clean_handlers()
+
+    write_results_to_file(results_table, 'sweep-evaluation', sweep_id)
+    return results_table
+
+
 if __name__ == '__main__':
     # run_evaluator_mq('test_scenarios')
-    run_evaluator_file('test_scenarios', TieBreaker.AS_IS)
+    # run_evaluator_sweep('test_scenarios',
+    #                     [[RankingMetrics.OCHIAI], [RankingMetrics.OCHIAI, RankingMetrics.JACCARD]],
+    #                     baseline_cache=BaselineCache())
+    run_evaluator_file('test_scenarios', TieBreaker.AS_IS, BaselineCache())
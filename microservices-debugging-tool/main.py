@@ -3,9 +3,13 @@ from typing import Callable, List, Optional
 from uuid import uuid4
 
 import sfldebug.tools.logger as sfl_logger
+from sfldebug.messages.parse_message import clear_entities
 from sfldebug.messages.receive import receive_mq
 from sfldebug.analytics import analyze_entities
-from sfldebug.sfl import rank
+from sfldebug.lazy import materialize_references
+from sfldebug.sfl import DEFAULT_TOP_K, rank
+from sfldebug.spectra import load_stored_references
+from sfldebug.tools.instrumentation import metrics, start_metrics_server, stop_metrics_server
 from sfldebug.tools.ranking_metrics import RankingMetrics
 from sfldebug.tools.ranking_merge import RankMergeOperator
 from sfldebug.tools.writer import write_results_to_file
@@ -18,7 +22,9 @@ def run(
     faulty_entities_id: str,
     receiver_method: Callable[[str, str, str], dict],
     rankings_metrics: List[RankingMetrics] = [RankingMetrics.OCHIAI],
-    ranking_merge_operator: RankMergeOperator = RankMergeOperator.AVG
+    ranking_merge_operator: RankMergeOperator = RankMergeOperator.AVG,
+    metrics_port: Optional[int] = None,
+    top_k: Optional[int] = DEFAULT_TOP_K
 ) -> Optional[List[dict]]:
     """Runs the microservices debugging tool.
 
@@ -32,12 +38,16 @@ def run(
 
     The ranking is obtained applying the specified metrics to each entity' analytics. The ranking
     are normalized if need be, and then merged into a final ranking. The list of ranked entities
-    is sorted by highest ranking and returned.
+    is sorted by highest ranking and returned. Only the top-k most suspicious entities are returned
+    and written, unless the full ranking is requested.
 
     Each entity ranking contains identification of the entity and also its properties and
     references. Its possible to check in each ranked entity the occurrences and the log
     information that are associated to it.
 
+    The time of each stage (receiving, analysis, ranking and writing), the number of messages,
+    entities and references received and the peak memory used are written to **metrics.json**.
+
     Args:
         execution_id (str): a unique id to be used while logging and storing results.
         good_entities_id (str): the name of the exchange to receive logs from good executions.
@@ -46,11 +56,17 @@ def run(
         entities. Must receive three arguments, two strings for good and faulty entities ids, and a
         third for the execution id. The return value must be a dict with two pairs key-value. The
         keys for the object must be the good and faulty entities id, and the values must be the
-        sets of parsed entities, objects of class sfldebug.entity.Entity.
+        sets of parsed entities, objects of class sfldebug.entity.Entity, or their summaries,
+        objects of class sfldebug.spectra.EntitySpectra (e.g. a cached baseline).
         rankings_metrics (List[RankingMetrics], optional): the list of metrics used to rank the
         entities processed from the logs. Defaults to [RankingMetrics.OCHIAI].
         ranking_merge_operator (RankMergeOperator, optional): the operator used to merge the
         rankings from different metrics. Defaults to RankMergeOperator.AVG.
+        metrics_port (Optional[int], optional): port of a local endpoint exposing the metrics of
+        the stages in Prometheus format while running, e.g. during long MQ runs. Defaults to None,
+        no endpoint.
+        top_k (Optional[int], optional): number of most suspicious entities to be returned and
+        written. Defaults to DEFAULT_TOP_K. If None, all the entities are returned and written.
 
     Returns:
         Optional[List[dict]]: the list of ranked entities with their properties and references.
@@ -58,9 +74,15 @@ def run(
     """
     successful_run = False
     entities_ranked: Optional[List[dict]] = None
+    metrics_server = None
     try:
         # configure logging for the execution
         sfl_logger.config_logger(execution_id)
+        metrics.clear()
+        # release the entities, symbols and method invocations of the previous executions
+        clear_entities()
+        if metrics_port is not None:
+            metrics_server = start_metrics_server(metrics_port)
 
         # receive logs and parse into entities
         entities = receiver_method(
@@ -72,9 +94,19 @@ def run(
 
         # rank each entity according to the selected metrics
         entities_ranked = rank(
-            entities_analytics, rankings_metrics, ranking_merge_operator)
+            entities_analytics, rankings_metrics, ranking_merge_operator, top_k)
 
         # write entity references separately for further inspection, if needed
+        # the references of summarized entities are loaded from their stores, requests whose
+        # references were all dropped by a retention policy are left out, and lazy references
+        # are read from their source files
+        load_stored_references(entity['properties'] for entity in entities_ranked)
+        for entity in entities_ranked:
+            references = entity['properties']['references']
+            materialize_references(references)
+            entity['properties']['references'] = {request_id: request_references
+                                                  for request_id, request_references
+                                                  in references.items() if request_references}
         entities_with_references = [entity['properties']
                                     for entity in entities_ranked]
         write_results_to_file(entities_with_references,
@@ -86,10 +118,13 @@ def run(
 
         write_results_to_file(
             entities_ranked, 'entities-ranking', execution_id)
+
+        write_results_to_file(metrics.to_dict(), 'metrics', execution_id)
         successful_run = True
     except Exception as err:
         logger.exception(err)
     finally:
+        stop_metrics_server(metrics_server)
         if successful_run:
             logger.info('Succesfully executed, terminating.')
         else:
@@ -0,0 +1,99 @@
+from typing import Iterable, Optional, Set, Tuple
+
+from sfldebug.entity import Entity, EntityType, merge_entity
+from sfldebug.retention import ReferenceRetention
+
+
+class EntityAggregator:
+    """Incremental aggregator of parsed entities.
+    Each entity is folded into the state of its unique entity as soon as it is added, so the memory
+    used is bounded by the number of unique entities (and their references), instead of the number
+    of parsed logs.
+    Two entities are the same unique entity if they share name, entity type and parent name.
+    With a reference retention, each unique entity keeps a bounded number of references, without
+    changing its executions.
+
+    Params:
+        unique_entities (dict[Tuple[str, EntityType, str], Entity]): unique entities collected,
+        indexed by their aggregation key
+        entities_added (int): number of entities added to the aggregator
+        messages_added (int): number of messages (sets of entities) added to the aggregator
+        retention (Optional[ReferenceRetention]): retention of the references of each unique
+        entity, all references are kept if None
+    """
+
+    def __init__(self, retention: Optional[ReferenceRetention] = None) -> None:
+        self.unique_entities: dict[Tuple[str, EntityType, str], Entity] = {}
+        self.entities_added: int = 0
+        self.messages_added: int = 0
+        self.retention = retention
+
+    def __len__(self) -> int:
+        return len(self.unique_entities)
+
+    @classmethod
+    def aggregation_key(cls, entity: Entity) -> Tuple[str, EntityType, str]:
+        """Get the key that identifies the unique entity the entity belongs to.
+
+        Args:
+            entity (Entity): entity to get the key from
+
+        Returns:
+            Tuple[str, EntityType, str]: the name, entity type and parent name of the entity
+        """
+        return entity.name, entity.entity_type, entity.parent_name
+
+    def add(self, entity: Entity) -> None:
+        """Fold an entity into the aggregator.
+        If the unique entity is not present yet, the entity is stored as is. Otherwise, its
+        references and children names are merged into the stored entity.
+
+        Args:
+            entity (Entity): entity to be added
+        """
+        self.entities_added += 1
+        key = self.aggregation_key(entity)
+        stored_entity = self.unique_entities.get(key)
+        if stored_entity is None:
+            if self.retention is not None:
+                self.retention.retain(entity)
+            self.unique_entities[key] = entity
+        elif self.retention is not None:
+            self.retention.merge(stored_entity, entity)
+        else:
+            merge_entity(stored_entity, entity)
+
+    def update(self, entities: Iterable[Entity]) -> None:
+        """Fold each entity of an iterable, e.g. the entities of a message, into the aggregator.
+
+        Args:
+            entities (Iterable[Entity]): entities to be added
+        """
+        self.messages_added += 1
+        for entity in entities:
+            self.add(entity)
+
+    def merge(self, other: 'EntityAggregator') -> None:
+        """Merge the unique entities of another aggregator into this one.
+
+        Args:
+            other (EntityAggregator): aggregator to be merged
+        """
+        self.update(other.unique_entities.values())
+        # the entities and messages of the other aggregator were already counted once
+        self.entities_added += other.entities_added - len(other)
+        self.messages_added += other.messages_added - 1
+
+    def get_entities(self) -> Set[Entity]:
+        """Get the set of unique entities collected.
+
+        Returns:
+            Set[Entity]: set of unique entities, each containing all of its references
+        """
+        return set(self.unique_entities.values())
+
+    def clear(self) -> None:
+        """Clear the aggregated entities. Useful when running multiple scenarios in a row."""
+        self.unique_entities.clear()
+        self.entities_added = 0
+        self.messages_added = 0
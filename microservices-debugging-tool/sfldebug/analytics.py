@@ -1,9 +1,19 @@
 # pylint: disable=global-statement
-from typing import Any, Set
+from typing import Any, Iterable, List, Optional, Set
 
-from sfldebug.entity import Entity, EntityType
+import numpy as np
+
+from sfldebug.entity import Entity, EntityType, get_entity_key
+from sfldebug.spectra import EntitySpectra
+from sfldebug.symbols import symbols
+from sfldebug.tools.instrumentation import instrumented
 import sfldebug.tools.logger as sfl_logger
 
+EXECUTION_KEYS = ['good_executed', 'faulty_executed']
+
+# counters of the analytics of each entity, in the order of the spectra arrays
+SPECTRA_KEYS = ['good_executed', 'good_passed', 'faulty_executed', 'faulty_passed']
+
 default_analysis_format = {
     'good_executed': 0,
     'good_passed': 0,
@@ -12,45 +22,203 @@ default_analysis_format = {
 }
 
 
+class CoverageMatrix:
+    """Sparse hit spectra of the analyzed entities: a boolean matrix of entities (rows) by unique
+    executions (columns), stored in CSR format, with a pass/fail vector of the executions.
+    The executions of each side are separate columns, each request id of a side being one unique
+    execution. Executions without request id are unique each, so they are only counted per
+    entity, in the detached executions.
+    The hits are collected as arrays of request symbols, and compiled into the matrix at once.
+
+    Params:
+        row_keys (List[int]): key of the entity of each row
+        indptr (np.ndarray): start of the hits of each row in indices, CSR format
+        indices (np.ndarray): column of each hit, sorted by row and column
+        column_failed (np.ndarray): True for the columns of the faulty executions
+        detached_executions (np.ndarray): executions without request id of each row, per side
+        service_rows (np.ndarray): True for the rows of the service entities
+        parent_rows (np.ndarray): row of the service weighted by each row, -1 if none. Indexes the
+        children rows of each service
+    """
+
+    def __init__(self) -> None:
+        self.row_keys: List[int] = []
+        self.row_index: dict[int, int] = {}
+        self.row_services: List[bool] = []
+        self.row_detached: List[List[int]] = []
+        self.row_parent_keys: List[Optional[int]] = []
+        # request symbols hit by each added entity, with its row and side
+        self.hits: List[np.ndarray] = []
+        self.hits_rows: List[int] = []
+        self.hits_sides: List[int] = []
+        self.compiled = False
+
+        self.indptr = np.zeros(1, dtype=np.int64)
+        self.indices = np.zeros(0, dtype=np.int64)
+        self.column_failed = np.zeros(0, dtype=bool)
+        self.detached_executions = np.zeros((0, len(EXECUTION_KEYS)), dtype=np.int64)
+        self.service_rows = np.zeros(0, dtype=bool)
+        self.parent_rows = np.zeros(0, dtype=np.int64)
+
+    def __len__(self) -> int:
+        return len(self.row_keys)
+
+    def add(
+        self,
+        key: int,
+        entity_type: EntityType,
+        execution_key: str,
+        request_ids: Iterable[str],
+        detached_executions: int,
+        parent_name: str = ''
+    ) -> None:
+        """Add the executions of an entity to the row of its unique entity.
+        The first time an entity is added, its parent service is indexed if it weights it.
+
+        Args:
+            key (int): key of the entity
+            entity_type (EntityType): type of the entity
+            execution_key (str): side of the executions, 'good_executed' or 'faulty_executed'
+            request_ids (Iterable[str]): request ids the entity was executed in, except 'default'
+            detached_executions (int): number of executions without request id
+            parent_name (str, optional): name of the parent of the entity. Defaults to ''.
+        """
+        row = self.row_index.get(key)
+        if row is None:
+            row = len(self.row_keys)
+            self.row_index[key] = row
+            self.row_keys.append(key)
+            self.row_services.append(entity_type == EntityType.SERVICE)
+            self.row_detached.append([0] * len(EXECUTION_KEYS))
+            self.row_parent_keys.append(get_parent_key(entity_type, parent_name))
+        side = EXECUTION_KEYS.index(execution_key)
+        self.row_detached[row][side] += detached_executions
+        self.hits.append(np.fromiter(map(symbols.intern, request_ids), dtype=np.int64))
+        self.hits_rows.append(row)
+        self.hits_sides.append(side)
+        self.compiled = False
+
+    def compile(self) -> None:
+        """Build the CSR matrix and the pass/fail vector from the hits added."""
+        if self.compiled:
+            return
+        n_rows = len(self.row_keys)
+        hits_lengths = np.fromiter((len(hits) for hits in self.hits), dtype=np.int64,
+                                   count=len(self.hits))
+        hits = np.concatenate(self.hits) if len(self.hits) > 0 else np.zeros(0, dtype=np.int64)
+        rows = np.repeat(np.asarray(self.hits_rows, dtype=np.int64), hits_lengths)
+        sides = np.repeat(np.asarray(self.hits_sides, dtype=np.int64), hits_lengths)
+
+        # each request of each side is a column
+        columns_codes, columns = np.unique(hits * len(EXECUTION_KEYS) + sides,
+                                           return_inverse=True)
+        self.column_failed = columns_codes % len(EXECUTION_KEYS) == \
+            EXECUTION_KEYS.index('faulty_executed')
+        # an entity hits each column once, sorted by row and column
+        cells = np.unique(rows * len(columns_codes) + columns.reshape(-1))
+        cells_rows = cells // max(len(columns_codes), 1)
+        self.indices = cells % max(len(columns_codes), 1)
+        self.indptr = np.concatenate(([0], np.cumsum(np.bincount(cells_rows, minlength=n_rows))))
+        self.detached_executions = np.asarray(self.row_detached, dtype=np.int64).reshape(
+            n_rows, len(EXECUTION_KEYS))
+        self.service_rows = np.asarray(self.row_services, dtype=bool)
+        self.parent_rows = np.fromiter(
+            (-1 if parent_key is None else self.row_index.get(parent_key, -1)
+             for parent_key in self.row_parent_keys), dtype=np.int64, count=n_rows)
+        self.compiled = True
+
+    def get_rows(self) -> np.ndarray:
+        """Get the row of each hit of the matrix, in the order of indices."""
+        return np.repeat(np.arange(len(self.row_keys)), np.diff(self.indptr))
+
+    def get_executed(self, execution_key: str) -> np.ndarray:
+        """Get the number of executions of each entity in a side: the sum of the columns of the
+        side hit by each row, plus the executions without request id.
+
+        Args:
+            execution_key (str): side of the executions, 'good_executed' or 'faulty_executed'
+
+        Returns:
+            np.ndarray: number of executions of each row
+        """
+        self.compile()
+        side = EXECUTION_KEYS.index(execution_key)
+        side_columns = self.column_failed if execution_key == 'faulty_executed' \
+            else ~self.column_failed
+        executed = np.bincount(self.get_rows(), weights=side_columns[self.indices],
+                               minlength=len(self.row_keys))
+        return executed.astype(np.int64) + self.detached_executions[:, side]
+
+    def get_number_unique_exec(self, execution_key: str) -> int:
+        """Get the number of unique executions of a side: the columns of the side hit by a service
+        entity, plus the executions without request id of the service entities.
+
+        Args:
+            execution_key (str): side of the executions, 'good_executed' or 'faulty_executed'
+
+        Returns:
+            int: number of unique executions
+        """
+        self.compile()
+        side = EXECUTION_KEYS.index(execution_key)
+        service_columns = np.unique(self.indices[self.service_rows[self.get_rows()]])
+        side_columns = self.column_failed[service_columns] == (execution_key == 'faulty_executed')
+        return int(np.count_nonzero(side_columns)) + \
+            int(self.detached_executions[self.service_rows, side].sum())
+
+
+def get_parent_key(entity_type: EntityType, parent_name: str) -> Optional[int]:
+    """Get the key of the service entity weighted by an entity: the parent of a method entity.
+
+    Args:
+        entity_type (EntityType): type of the entity
+        parent_name (str): name of the parent of the entity
+
+    Returns:
+        Optional[int]: key of the parent service entity, None if the entity weights no service
+    """
+    if entity_type != EntityType.METHOD:
+        return None
+    return get_entity_key(parent_name, EntityType.SERVICE, '')
+
+
 def increment_execution(
     entities_analyzed: dict,
     entities: Set[Entity],
-    execution_key: str
+    execution_key: str,
+    coverage: Optional[CoverageMatrix] = None
 ) -> int:
-    """Increment the number of 'execution_key' in 'entities_analyzed' for each elem of 'entities'.
-    If the element is not in 'entities_analyzed', it is created and added with the increment.
+    """Add the executions of each elem of 'entities' to the coverage matrix, in 'execution_key'.
+    If the element is not in 'entities_analyzed', it is created and added.
     Modifies the dict in 'entities_analyzed'.
-    It also updates the references and children names of the analyzed entities.
+    It also updates the references and children names of the analyzed entities. The executed
+    counts of the analyzed entities are then set from the coverage matrix.
     Returns the count of unique executions discovered in the analyzed entities.
 
     Args:
         entities_analyzed (dict): dict to be modified with each entity analytics
         entities (Set[Entity]): set of entities to be analyzed
         execution_key (str): key to increment in
+        coverage (Optional[CoverageMatrix], optional): coverage matrix to add the executions to.
+        Defaults to None, a new matrix.
 
     Returns:
         int: the count of unique executions
     """
-    # number of entity executions without a request/correlation id associated
-    total_detached_executions: int = 0
-    # each unique execution has a unique request/correlation id
-    unique_executions: Set[str] = set()
+    if coverage is None:
+        coverage = CoverageMatrix()
     for entity in entities:
-        key = '{}'.format(entity.__hash__())
-
-        if entity.get_properties()['entity_type'] == EntityType.SERVICE:
-            entity_detached_execs = len(entity.references.get('default', []))
-            total_detached_executions += entity_detached_execs
-            entity_requests = entity.references.keys()
-            unique_executions.update(entity_requests)
+        key = entity.get_key()
+        coverage.add(key, entity.entity_type, execution_key,
+                     (request_id for request_id in entity.references if request_id != 'default'),
+                     entity.get_detached_executions(), entity.parent_name)
 
-        times_executed = entity.get_number_unique_exec()
         if key in entities_analyzed:
             stored_entity = entities_analyzed[key]
-            stored_entity[execution_key] += times_executed
 
             analyzed_entity_refs = stored_entity['properties']['references']
             entity_refs = entity.references
+            stored_entity['properties']['ref_count'] += entity.get_ref_count()
             Entity.merge_references(analyzed_entity_refs, entity_refs)
 
             # add missing children names to the stored entity
@@ -60,18 +228,118 @@ def increment_execution(
             # if not analyzed before, create a new entry with the first references
             new_entity_analysis: dict[str,
                                       Any] = default_analysis_format.copy()
-            new_entity_analysis[execution_key] += times_executed
             new_entity_analysis['properties'] = entity.get_properties()
+            new_entity_analysis['properties']['ref_count'] = entity.get_ref_count()
             # and add it to the analyzed entities set
             entities_analyzed[key] = new_entity_analysis
 
-    n_unique_executions = len(unique_executions) + total_detached_executions
-    if 'default' in unique_executions:
-        n_unique_executions -= 1
-    return n_unique_executions
+    set_executed_counts(entities_analyzed, coverage)
+    return coverage.get_number_unique_exec(execution_key)
+
+
+def increment_spectra_execution(
+    entities_analyzed: dict,
+    spectra: EntitySpectra,
+    execution_key: str,
+    coverage: Optional[CoverageMatrix] = None
+) -> int:
+    """Add the executions of each entity summarized in 'spectra' to the coverage matrix, in
+    'execution_key'. Works as increment_execution, but from the compact summary of the entities.
+    The references are not loaded: the paths of the summary reference stores are kept in the
+    'references_paths' property of the entities, to load the references of the entities written
+    in the results only (see sfldebug.spectra.load_stored_references).
+    Returns the count of unique executions discovered in the analyzed entities.
+
+    Args:
+        entities_analyzed (dict): dict to be modified with each entity analytics
+        spectra (EntitySpectra): summary of the entities to be analyzed
+        execution_key (str): key to increment in
+        coverage (Optional[CoverageMatrix], optional): coverage matrix to add the executions to.
+        Defaults to None, a new matrix.
+
+    Returns:
+        int: the count of unique executions
+    """
+    if coverage is None:
+        coverage = CoverageMatrix()
+    references_paths = list(spectra.references_paths)
+
+    for summary in spectra.entities.values():
+        key = get_entity_key(summary['name'], summary['entity_type'], summary['parent_name'])
+        coverage.add(key, summary['entity_type'], execution_key, summary['request_ids'],
+                     summary['detached_executions'], summary['parent_name'])
+
+        if key in entities_analyzed:
+            stored_entity = entities_analyzed[key]
+
+            stored_entity['properties']['ref_count'] += summary['ref_count']
+            if references_paths:
+                stored_entity['properties'].setdefault('references_paths', []).extend(
+                    references_paths)
+            stored_entity['properties']['children_names'].update(summary['children_names'])
+        else:
+            new_entity_analysis: dict[str,
+                                      Any] = default_analysis_format.copy()
+            new_entity_analysis['properties'] = {
+                'name': summary['name'], 'parent_name': summary['parent_name'],
+                'children_names': set(summary['children_names']),
+                'entity_type': summary['entity_type'], 'references': {},
+                'ref_count': summary['ref_count']}
+            if references_paths:
+                new_entity_analysis['properties']['references_paths'] = list(references_paths)
+            entities_analyzed[key] = new_entity_analysis
+
+    set_executed_counts(entities_analyzed, coverage)
+    return coverage.get_number_unique_exec(execution_key)
 
 
-def weight_service_entities(entities_analyzed: dict[str, dict[str, Any]]) -> None:
+def set_executed_counts(
+    entities_analyzed: dict,
+    coverage: CoverageMatrix
+) -> None:
+    """Set the executed counts of each analyzed entity, from the column sums of its row in the
+    coverage matrix. Modifies the dict in 'entities_analyzed'.
+
+    Args:
+        entities_analyzed (dict): analytics of each entity, indexed by the entity key
+        coverage (CoverageMatrix): coverage matrix of the analyzed entities
+    """
+    for execution_key in EXECUTION_KEYS:
+        for key, executed in zip(coverage.row_keys, coverage.get_executed(execution_key).tolist()):
+            entities_analyzed[key][execution_key] = executed
+
+
+def weight_service_counts(
+    spectra: np.ndarray,
+    parent_rows: np.ndarray,
+    n_children: np.ndarray
+) -> np.ndarray:
+    """Weight the service entities by their children, over the spectra arrays of the entities.
+    The counters of the children rows are summed into the row of their parent in a single grouped
+    reduction, and divided by the number of children of each service.
+
+    Args:
+        spectra (np.ndarray): counters of each row, in the order of SPECTRA_KEYS
+        parent_rows (np.ndarray): row of the service weighted by each row, -1 if none
+        n_children (np.ndarray): number of children names of each service row, 0 for other rows
+
+    Returns:
+        np.ndarray: averaged counters of each row, only meaningful for the rows with children
+    """
+    n_rows = len(parent_rows)
+    children = parent_rows >= 0
+    parents = parent_rows[children]
+    # single bincount over the flattened (parent, counter) cells
+    cells = (parents[:, None] * spectra.shape[1] + np.arange(spectra.shape[1])).reshape(-1)
+    sums = np.bincount(cells, weights=spectra[children].reshape(-1),
+                       minlength=n_rows * spectra.shape[1]).reshape(n_rows, spectra.shape[1])
+    return sums / np.maximum(n_children, 1)[:, None]
+
+
+def weight_service_entities(
+    entities_analyzed: dict[int, dict[str, Any]],
+    parent_keys: Optional[dict[int, Optional[int]]] = None
+) -> None:
     """Reduces the value of the service entity analytics when there are method entities available.
     For each service entity, calculate for each metric the average of its children (method entity).
     In essence, the weight results in dividing the count of each metric of the service entity, by
@@ -79,53 +347,67 @@ def weight_service_entities(entities_analyzed: dict[str, dict[str, Any]]) -> Non
     If the entity does not have children, it is left intact.
 
     Args:
-        entities_analyzed (dict[str, dict[str, Any]]): the set of analyzed entities
+        entities_analyzed (dict[int, dict[str, Any]]): the set of analyzed entities
+        parent_keys (Optional[dict[int, Optional[int]]], optional): key of the service weighted by
+        each entity, as indexed during ingestion. Defaults to None, computed from the properties.
+    """
+    keys = list(entities_analyzed.keys())
+    row_index = {key: row for row, key in enumerate(keys)}
+    if parent_keys is None:
+        parent_keys = {key: get_parent_key(entity['properties']['entity_type'],
+                                           entity['properties']['parent_name'])
+                       for key, entity in entities_analyzed.items()}
+    parent_rows = np.fromiter(
+        (-1 if parent_keys.get(key) is None else row_index.get(parent_keys[key], -1)  # type: ignore
+         for key in keys), dtype=np.int64, count=len(keys))
+    spectra = np.array([[entity[counter] for counter in SPECTRA_KEYS]
+                        for entity in entities_analyzed.values()],
+                       dtype=np.float64).reshape(len(keys), len(SPECTRA_KEYS))
+    set_weighted_counts(entities_analyzed, keys, spectra, parent_rows)
+
+
+def set_weighted_counts(
+    entities_analyzed: dict[int, dict[str, Any]],
+    keys: List[int],
+    spectra: np.ndarray,
+    parent_rows: np.ndarray
+) -> None:
+    """Set the averaged counters of the service entities with children, from the spectra arrays of
+    the analyzed entities. Modifies the dict in 'entities_analyzed'.
+
+    Args:
+        entities_analyzed (dict[int, dict[str, Any]]): the set of analyzed entities
+        keys (List[int]): key of the entity of each row
+        spectra (np.ndarray): counters of each row, in the order of SPECTRA_KEYS
+        parent_rows (np.ndarray): row of the service weighted by each row, -1 if none
     """
-    for service_entity in entities_analyzed.values():
-        service_entity_properties = service_entity['properties']
-        if service_entity_properties['entity_type'] != EntityType.SERVICE:
-            continue
-        children_names = service_entity_properties['children_names']
-        len_children = len(children_names)
-        if len_children == 0:
-            continue
-
-        avg_good_executed_executions = 0
-        avg_good_passed_executions = 0
-        avg_faulty_executed_executions = 0
-        avg_faulty_passed_executions = 0
-        for child_name in children_names:
-            method_hash = '{}'.format(
-                hash(child_name + EntityType.METHOD + service_entity_properties['name']))
-
-            if method_hash in entities_analyzed:
-                child_entity = entities_analyzed[method_hash]
-                avg_good_executed_executions += child_entity['good_executed']
-                avg_good_passed_executions += child_entity['good_passed']
-                avg_faulty_executed_executions += child_entity['faulty_executed']
-                avg_faulty_passed_executions += child_entity['faulty_passed']
-        avg_good_executed_executions /= len_children
-        avg_good_passed_executions /= len_children
-        avg_faulty_executed_executions /= len_children
-        avg_faulty_passed_executions /= len_children
-
-        service_entity['good_executed'] = avg_good_executed_executions
-        service_entity['good_passed'] = avg_good_passed_executions
-        service_entity['faulty_executed'] = avg_faulty_executed_executions
-        service_entity['faulty_passed'] = avg_faulty_passed_executions
+    n_children = np.fromiter(
+        (len(entity['properties']['children_names'])
+         if entity['properties']['entity_type'] == EntityType.SERVICE else 0
+         for entity in map(entities_analyzed.__getitem__, keys)),
+        dtype=np.int64, count=len(keys))
+    weighted_rows = np.flatnonzero(n_children)
+    weighted = weight_service_counts(spectra, parent_rows, n_children)[weighted_rows]
+    for row, counters in zip(weighted_rows.tolist(), weighted.tolist()):
+        entities_analyzed[keys[row]].update(zip(SPECTRA_KEYS, counters))
 
 
+@instrumented('analyze')
 def analyze_entities(
-    good_entities: Set[Entity],
-    faulty_entities: Set[Entity]
-) -> dict[str, dict[str, Any]]:
+    good_entities: Set[Entity] | EntitySpectra,
+    faulty_entities: Set[Entity] | EntitySpectra,
+    coverage: Optional[CoverageMatrix] = None
+) -> dict[int, dict[str, Any]]:
     """Analyzes executions of entities. Returns a dict with analytics for each entity.
     Each element contains the number of times each entity is executed or pass in a good or faulty
-    execution.
+    execution, computed from the coverage matrix of the entities by the unique executions.
+    The entities can be given as sets of entities or as their compact summary.
 
     Args:
-        good_entities (Set[Entity]): entities present in a good execution
-        faulty_entities (Set[Entity]): entities present in a faulty execution
+        good_entities (Set[Entity] | EntitySpectra): entities present in a good execution
+        faulty_entities (Set[Entity] | EntitySpectra): entities present in a faulty execution
+        coverage (Optional[CoverageMatrix], optional): coverage matrix to be filled, kept by the
+        caller for request level analyses. Defaults to None, a new matrix.
 
     Returns:
         dict: contains for each entity the execution analytics in good and faulty settings
@@ -134,29 +416,43 @@ def analyze_entities(
         raise RuntimeError(
             'Good and faulty entities are empty, aborting execution.')
 
-    entities_analyzed: dict[str, dict[str, Any]] = {}
+    entities_analyzed: dict[int, dict[str, Any]] = {}
+    if coverage is None:
+        coverage = CoverageMatrix()
 
-    n_unique_faulty_executions = increment_execution(entities_analyzed, faulty_entities,
-                                                     'faulty_executed')
+    if isinstance(faulty_entities, EntitySpectra):
+        n_unique_faulty_executions = increment_spectra_execution(
+            entities_analyzed, faulty_entities, 'faulty_executed', coverage)
+    else:
+        n_unique_faulty_executions = increment_execution(entities_analyzed, faulty_entities,
+                                                         'faulty_executed', coverage)
     sfl_logger.logger.info('Analyzed execution of faulty entities.')
 
-    n_unique_good_executions = increment_execution(
-        entities_analyzed, good_entities, 'good_executed')
+    if isinstance(good_entities, EntitySpectra):
+        n_unique_good_executions = increment_spectra_execution(
+            entities_analyzed, good_entities, 'good_executed', coverage)
+    else:
+        n_unique_good_executions = increment_execution(
+            entities_analyzed, good_entities, 'good_executed', coverage)
     sfl_logger.logger.info('Analyzed execution of good entities.')
 
-    for entity in entities_analyzed.values():
-        entity['good_passed'] = n_unique_good_executions - \
-            entity['good_executed']
-        entity['faulty_passed'] = n_unique_faulty_executions - \
-            entity['faulty_executed']
-        entity['properties']['ref_count'] = Entity.count_references(
-            entity['properties']['references'])
+    # spectra arrays of the rows of the coverage matrix
+    good_executed = coverage.get_executed('good_executed')
+    faulty_executed = coverage.get_executed('faulty_executed')
+    good_passed = n_unique_good_executions - good_executed
+    faulty_passed = n_unique_faulty_executions - faulty_executed
+    for key, good_passed_count, faulty_passed_count in zip(
+            coverage.row_keys, good_passed.tolist(), faulty_passed.tolist()):
+        entities_analyzed[key]['good_passed'] = good_passed_count
+        entities_analyzed[key]['faulty_passed'] = faulty_passed_count
     sfl_logger.logger.info((
         'Finished analyzing all entities. '
         'Number of unique faulty executions: %d. '
         'Number of unique good executions: %d'), n_unique_faulty_executions,
         n_unique_good_executions)
 
-    weight_service_entities(entities_analyzed)
+    spectra = np.stack([good_executed, good_passed, faulty_executed, faulty_passed],
+                       axis=1).astype(np.float64)
+    set_weighted_counts(entities_analyzed, coverage.row_keys, spectra, coverage.parent_rows)
 
     return entities_analyzed
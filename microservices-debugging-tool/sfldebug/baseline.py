@@ -0,0 +1,156 @@
+import hashlib
+import json
+import os
+import shutil
+from typing import Any, Optional, Tuple
+
+from sfldebug.retention import ReferenceRetention
+import sfldebug.schema as sfl_schema
+from sfldebug.spectra import EntitySpectra
+import sfldebug.tools.logger as sfl_logger
+
+# version of the parsing of the logs into entities, part of the key of the cached baselines.
+# Must be increased when the entities or the references built from the logs change
+PARSER_VERSION = 1
+
+# directory of the cached baselines, relative to the working directory
+DEFAULT_CACHE_DIR = 'baselines'
+
+# size of the blocks read from the log files to hash their contents
+HASH_BLOCK_SIZE = 1 << 20
+
+
+def hash_file(filepath: str) -> str:
+    """Hash the contents of a file, as stored (compressed files are not decompressed).
+
+    Args:
+        filepath (str): path of the file
+
+    Returns:
+        str: hex digest of the contents of the file
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    with open(filepath, 'rb') as file:
+        for block in iter(lambda: file.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def get_baseline_key(
+    logs_path: str,
+    schema: dict[str, Any],
+    retention: Optional[ReferenceRetention] = None
+) -> str:
+    """Get the key of the baseline of a log file: the hash of its contents, the parser version, the
+    entity schema and the retention of the references, everything the parsed entities depend on.
+
+    Args:
+        logs_path (str): path of the log file
+        schema (dict[str, Any]): entity schema the entities are extracted with
+        retention (Optional[ReferenceRetention], optional): retention of the references of the
+        entities. Defaults to None, all references are kept.
+
+    Returns:
+        str: hex digest identifying the baseline
+    """
+    retention_key = None if retention is None else [retention.policy.value,
+                                                    retention.max_references]
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(json.dumps([hash_file(logs_path), PARSER_VERSION, schema, retention_key],
+                             sort_keys=True).encode('utf-8'))
+    return digest.hexdigest()
+
+
+class BaselineCache:
+    """On disk cache of the summaries of baseline (good) executions, so a stable baseline is parsed
+    once and compared against many faulty executions.
+    Each baseline is kept as the summary of its entities (EntitySpectra), with their executions and
+    request ids, and a copy of its entities records as the reference store. The baselines are keyed
+    by the contents of the log file, the parser version, the entity schema and the retention of the
+    references, so a baseline is parsed again when any of them changes.
+
+    Args:
+        cache_dir (str): directory of the cached baselines (default DEFAULT_CACHE_DIR)
+    """
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR) -> None:
+        self.cache_dir = os.path.abspath(cache_dir)
+
+    def get_paths(self, key: str) -> Tuple[str, str]:
+        """Get the paths of the summary and of the reference store of a baseline.
+
+        Args:
+            key (str): key of the baseline
+
+        Returns:
+            Tuple[str, str]: path of the summary file and path of the entities records file
+        """
+        return (os.path.join(self.cache_dir, key + '.spectra.json'),
+                os.path.join(self.cache_dir, key + '.records.json'))
+
+    def get_key(self, logs_path: str, retention: Optional[ReferenceRetention] = None) -> str:
+        """Get the key of the baseline of a log file, with the entity schema of the parser.
+
+        Args:
+            logs_path (str): path of the log file
+            retention (Optional[ReferenceRetention], optional): retention of the references of the
+            entities. Defaults to None, all references are kept.
+
+        Returns:
+            str: key of the baseline
+        """
+        return get_baseline_key(logs_path, sfl_schema.entity_extractor.schema, retention)
+
+    def load(self, key: str) -> Optional[EntitySpectra]:
+        """Load a cached baseline.
+
+        Args:
+            key (str): key of the baseline, from get_key
+
+        Returns:
+            Optional[EntitySpectra]: summary of the entities of the baseline, or None if it is not
+            cached
+        """
+        spectra_path, _ = self.get_paths(key)
+        if not os.path.isfile(spectra_path):
+            return None
+        with open(spectra_path, 'r', encoding='utf-8') as spectra_file:
+            spectra = EntitySpectra.from_dict(json.load(spectra_file))
+        sfl_logger.logger.info('Loaded cached baseline: %s.', spectra_path)
+        return spectra
+
+    def store(self, key: str, spectra: EntitySpectra) -> EntitySpectra:
+        """Cache a baseline. Its reference stores are copied into a single entities records file
+        of the cache.
+
+        Args:
+            key (str): key of the baseline, from get_key
+            spectra (EntitySpectra): summary of the entities of the baseline
+
+        Returns:
+            EntitySpectra: the cached summary, pointing to the reference store of the cache
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        spectra_path, records_path = self.get_paths(key)
+
+        cached_spectra = EntitySpectra()
+        cached_spectra.entities = spectra.entities
+        if len(spectra.references_paths) == 1:
+            shutil.copyfile(spectra.references_paths[0], records_path)
+            cached_spectra.references_paths.append(records_path)
+        elif len(spectra.references_paths) > 1:
+            records: dict = {'entities': []}
+            for references_path in spectra.references_paths:
+                with open(references_path, 'r', encoding='utf-8') as references_file:
+                    records['entities'].extend(json.load(references_file)['entities'])
+            with open(records_path, 'w', encoding='utf-8') as records_file:
+                json.dump(records, records_file)
+            cached_spectra.references_paths.append(records_path)
+
+        # written aside and moved, so a baseline is never read half written
+        temporary_path = spectra_path + '.tmp'
+        with open(temporary_path, 'w', encoding='utf-8') as spectra_file:
+            json.dump(cached_spectra.to_dict(), spectra_file)
+        os.replace(temporary_path, spectra_path)
+        sfl_logger.logger.info('Cached baseline: %s.', spectra_path)
+        return cached_spectra
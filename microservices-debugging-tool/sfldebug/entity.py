@@ -1,14 +1,172 @@
 from enum import Enum
-from typing import Any, List, Optional, Set
+import hashlib
+from typing import Any, Iterator, List, Optional, Set, Tuple
 
-from sfldebug.tools.object import extract_field, merge_into_list
+from sfldebug.tools.object import extract_field, extend_into_list, make_list
+from sfldebug.symbols import symbols
 import sfldebug.tools.logger as sfl_logger
 
+# method invocations already seen, shared by the references of the same invocation
+method_invocations: dict[Tuple, dict] = {}
+
 
 class EntityType(str, Enum):
-    """Enum for the entity type."""
+    """Enum for the entity type.
+    Services and methods are always extracted, endpoints and instances only if declared in the
+    entity schema (see sfldebug.schema)."""
     SERVICE = 'SERVICE'
     METHOD = 'METHOD'
+    ENDPOINT = 'ENDPOINT'
+    INSTANCE = 'INSTANCE'
+
+
+def intern_method_invocation(method_invocation: dict) -> dict:
+    """Get the shared object of a method invocation, so the references of the same invocation do
+    not keep a dict each. The invocation must not be modified after.
+
+    Args:
+        method_invocation (dict): invocation of a method, with the file, class and method names
+
+    Returns:
+        dict: the shared method invocation, equal to the one given
+    """
+    try:
+        key = tuple(method_invocation.items())
+        return method_invocations.setdefault(key, method_invocation)
+    except TypeError:  # unhashable values, cannot be shared
+        return method_invocation
+
+
+def get_entity_key(name: str, entity_type: str, parent_name: str) -> int:
+    """Get the key of an entity, a 64-bit integer from a blake2b digest of its name, type and
+    parent name. Unlike hash(), it is the same in every process and machine, so it can be saved,
+    and used to merge the analytics computed in different processes or hosts.
+
+    Args:
+        name (str): name of the entity
+        entity_type (str): type of the entity
+        parent_name (str): name of the parent entity
+
+    Returns:
+        int: the key of the entity
+    """
+    fields = '\x00'.join((name, entity_type, parent_name)).encode('utf-8')
+    return int.from_bytes(hashlib.blake2b(fields, digest_size=8).digest(), 'big')
+
+
+class Reference:
+    """Compact reference to an entity in a log. Base class of the references of each entity type.
+    Each reference is a record with a fixed set of fields (__slots__) instead of a dict, to reduce
+    the memory used per log. Repeated strings (__symbols__) are kept as their ids in the shared
+    symbol table. It can be read as a dict of its fields, with the strings resolved, and it is
+    written to json and pickled as one, since the ids are only valid in the current process.
+    """
+    __slots__: Tuple[str, ...] = ()
+    __symbols__: Tuple[str, ...] = ()
+
+    def __getitem__(self, field: str) -> Any:
+        if field not in self.__slots__:
+            raise KeyError(field)
+        return self.get_field(field)
+
+    def __contains__(self, field: object) -> bool:
+        return field in self.__slots__
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.__slots__)
+
+    def __len__(self) -> int:
+        return len(self.__slots__)
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, (Reference, dict)):
+            return self.to_dict() == dict(other.items())
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return '{}({})'.format(type(self).__name__, self.to_dict())
+
+    def __reduce__(self) -> Tuple[type, Tuple]:
+        # the fields are given in the same order as the constructor arguments
+        return (type(self), tuple(self.get_field(field) for field in self.__slots__))
+
+    def get_field(self, field: str) -> Any:
+        """Get the value of a field, resolving the strings kept as symbols."""
+        value = getattr(self, field)
+        if field in self.__symbols__:
+            return symbols.lookup(value)
+        return value
+
+    def get(self, field: str, default: Any = None) -> Any:
+        """Get the value of a field, or the default if the reference does not have the field."""
+        if field not in self.__slots__:
+            return default
+        return self.get_field(field)
+
+    def keys(self) -> Tuple[str, ...]:
+        """Get the names of the fields of the reference."""
+        return self.__slots__
+
+    def items(self) -> List[Tuple[str, Any]]:
+        """Get the pairs of field name and value of the reference."""
+        return [(field, self.get_field(field)) for field in self.__slots__]
+
+    def to_dict(self) -> dict:
+        """Convert the reference into a dict of its fields.
+
+        Returns:
+            dict: the fields of the reference and their values
+        """
+        return dict(self.items())
+
+
+class ServiceReference(Reference):
+    """Reference to a service entity in a log. The request id, endpoint, instance IP and user are
+    kept as symbols."""
+    __slots__ = ('request_id', 'endpoint', 'instance_ip', 'span_id', 'parent_span_id',
+                 'http_code', 'user', 'timestamp')
+    __symbols__ = ('request_id', 'endpoint', 'instance_ip', 'user')
+
+    def __init__(
+        self,
+        request_id: str,
+        endpoint: Optional[str],
+        instance_ip: Optional[str],
+        span_id: Optional[str],
+        parent_span_id: Optional[str],
+        http_code: Optional[int],
+        user: Optional[str],
+        timestamp: Optional[str]
+    ) -> None:
+        self.request_id = symbols.intern(request_id)
+        self.endpoint = symbols.intern(endpoint)
+        self.instance_ip = symbols.intern(instance_ip)
+        self.span_id = span_id
+        self.parent_span_id = parent_span_id
+        self.http_code = http_code
+        self.user = symbols.intern(user)
+        self.timestamp = timestamp
+
+
+class MethodReference(Reference):
+    """Reference to a method entity in a log. The request id and log level are kept as symbols,
+    and the method invocations are shared."""
+    __slots__ = ('request_id', 'timestamp', 'log_level', 'message', 'method_invocation')
+    __symbols__ = ('request_id', 'log_level')
+
+    def __init__(
+        self,
+        request_id: str,
+        timestamp: Optional[str],
+        log_level: Optional[str],
+        message: Optional[str],
+        method_invocation: dict
+    ) -> None:
+        self.request_id = symbols.intern(request_id)
+        self.timestamp = timestamp
+        self.log_level = symbols.intern(log_level)
+        self.message = message
+        self.method_invocation = intern_method_invocation(method_invocation)
 
 
 class Entity:
@@ -20,6 +178,13 @@ class Entity:
         entity_type (EntityType): enum member of EntityType (defaults to EntityType.SERVICE)
         parent_name (str): parent entity name
         children_names (Set[str]): set of children entities names
+        key (Optional[int]): stable key of the entity, computed once from its name, type and
+        parent name (see get_key)
+        dropped_references (int): number of references dropped by a retention policy
+        dropped_detached_executions (int): number of references without request id dropped by a
+        retention policy, each still an execution of the entity
+        retained_references (Optional[List[Tuple[str, Any]]]): request id and reference of the
+        references kept by a retention policy, in the order they were kept (None if all kept)
     """
 
     def __init__(
@@ -29,11 +194,15 @@ class Entity:
         entity_type: EntityType = EntityType.SERVICE
     ) -> None:
 
-        self.name = name
+        self.name = symbols.canonical(name)
         self.references = references
         self.entity_type = entity_type
         self.parent_name: str = ''
         self.children_names: Set[str] = set()
+        self.key: Optional[int] = None
+        self.dropped_references: int = 0
+        self.dropped_detached_executions: int = 0
+        self.retained_references: Optional[List[Tuple[str, Any]]] = None
 
     def get_properties(self) -> dict:
         """Returns dict with Entity properties.
@@ -46,7 +215,18 @@ class Entity:
                 'references': self.references}
 
     def __hash__(self) -> int:
-        return hash(self.name + self.entity_type + self.parent_name)
+        return self.get_key()
+
+    def get_key(self) -> int:
+        """Get the stable key of the entity, computed on the first call and cached.
+        The name, type and parent name of the entity must be set before.
+
+        Returns:
+            int: the key of the entity
+        """
+        if self.key is None:
+            self.key = get_entity_key(self.name, self.entity_type, self.parent_name)
+        return self.key
 
     def get_number_unique_exec(self) -> int:
         """Get the number of unique executions present in the entity
@@ -56,9 +236,26 @@ class Entity:
         """
         if 'default' in self.references:
             # Sum the number of references w/o request, plus the number of request minus 'default'
-            return len(self.references['default']) + len(self.references.keys()) - 1
+            return self.get_detached_executions() + len(self.references.keys()) - 1
         return len(self.references.keys())
 
+    def get_detached_executions(self) -> int:
+        """Get the number of executions of the entity without a request id, including the ones
+        whose references were dropped.
+
+        Returns:
+            int: number of executions without request id
+        """
+        return len(self.references.get('default', [])) + self.dropped_detached_executions
+
+    def get_ref_count(self) -> int:
+        """Get the total number of references of the entity, including the dropped ones.
+
+        Returns:
+            int: the count of references in total
+        """
+        return Entity.count_references(self.references) + self.dropped_references
+
     @classmethod
     def count_references(
             cls,
@@ -81,27 +278,24 @@ class Entity:
         old_references: dict[str, List]
     ) -> None:
         """Merge two sets of references.
-        First collected the missing references by fetching the keys present in the old set of
-        references and not in the new.
-        Then collect the merged references, which are references for the same request_id, that need
-        to be merged into a single list.
-        Finally update the new set with the references collected.
-
+        The references of requests missing in the new set are moved into it, and the references of
+        requests present in both are appended in place to the list of the new set, so merging the
+        references of an entity logged many times in the same request is linear.
+        The lists of the old set are taken over by the new set, so the old set must not be used
+        after.
 
         Args:
             new_references (dict[str, List]): The references to be updated
             old_references (dict[str,List]): The references to be merged into the new set
         """
-        # references of the same entity that are related to different requests
-        missing_references = {k: old_references.get(
-            k) for k in old_references.keys() - new_references.keys()}
-
-        # references of the same entity that are related to the same request
-        merged_references = {k: merge_into_list(new_references.get(k), old_references.get(
-            k)) for k in new_references.keys() & old_references.keys()}
-        # add missing references to the stored entity
-        new_references.update(missing_references)  # type: ignore
-        new_references.update(merged_references)
+        for request_id, references in old_references.items():
+            stored_references = new_references.get(request_id)
+            if stored_references is None:
+                # references of the same entity that are related to different requests
+                new_references[request_id] = make_list(references)
+            else:
+                # references of the same entity that are related to the same request
+                extend_into_list(stored_references, references)
 
 
 class ServiceEntity(Entity):
@@ -117,6 +311,7 @@ class ServiceEntity(Entity):
         invoked the current service
         http_code (Optional[int]): HTTP code relative to the request
         user (Optional[str]): username or id to identify the client who started the request
+        timestamp (Optional[str]): timestamp string of the logged entity, formatted in ISO8601
     """
 
     def __init__(
@@ -128,21 +323,16 @@ class ServiceEntity(Entity):
         span_id: Optional[str],
         parent_span_id: Optional[str],
         http_code: Optional[int],
-        user: Optional[str]
+        user: Optional[str],
+        timestamp: Optional[str] = None
     ) -> None:
 
         references: dict[str, List] = {}
         if request_id is None:
             request_id = 'default'
-        references[request_id] = [{
-            'request_id': request_id,
-            'endpoint': endpoint,
-            'instance_ip': instance_ip,
-            'span_id': span_id,
-            'parent_span_id': parent_span_id,
-            'http_code': http_code,
-            'user': user
-        }]
+        reference = ServiceReference(request_id, endpoint, instance_ip, span_id,
+                                     parent_span_id, http_code, user, timestamp)
+        references[reference['request_id']] = [reference]
         Entity.__init__(self, name, references, EntityType.SERVICE)
 
 
@@ -172,13 +362,9 @@ class MethodEntity(Entity):
         references: dict[str, List] = {}
         if request_id is None:
             request_id = 'default'
-        references[request_id] = [{
-            'request_id': request_id,
-            'timestamp': timestamp,
-            'log_level': log_level,
-            'message': message,
-            'method_invocation': method_invocation,
-        }]
+        reference = MethodReference(request_id, timestamp, log_level, message,
+                                    method_invocation)
+        references[reference['request_id']] = [reference]
         Entity.__init__(self, name, references, EntityType.METHOD)
 
 
@@ -191,6 +377,8 @@ def build_entity(log_data: Any) -> Set[Entity]:
 
     Ex.: if the log points to a method, generate method and service entities.
     If the log points to a service, generate only a service entity.
+    The parser uses the extractor compiled from the entity schema instead (see sfldebug.schema),
+    which builds the same entities with the default schema.
 
     Args:
         log_data (Any): log content formatted in an object
@@ -214,8 +402,9 @@ def build_entity(log_data: Any) -> Set[Entity]:
     parent_span_id = extract_field('parentSpanID', log_data)
     http_code = extract_field('httpCode', log_data)
     user = extract_field('user', log_data)
-    service_entity = ServiceEntity(microservice_name, correlation_id,
-                                   endpoint, instance_ip, span_id, parent_span_id, http_code, user)
+    timestamp = extract_field('timestamp', log_data)
+    service_entity = ServiceEntity(microservice_name, correlation_id, endpoint, instance_ip,
+                                   span_id, parent_span_id, http_code, user, timestamp)
     sfl_logger.logger.debug('Created Service Entity for microservice "%s" in request "%s".',
                             microservice_name, correlation_id)
 
@@ -227,7 +416,6 @@ def build_entity(log_data: Any) -> Set[Entity]:
     if method_invocation is not None:
         method_name: Optional[str] = extract_field(
             'methodName', method_invocation)
-        timestamp = extract_field('timestamp', log_data)
         log_level = extract_field('logLevel', log_data)
         message = extract_field('message', log_data)
         try:
@@ -271,8 +459,8 @@ def parse_unique_entities(entities: Set[Entity]) -> Set[Entity]:
         entity_present = unique_hash in unique_entities
         if entity_present:
 
-            updated_entity = merge_entity(entity, unique_entities[unique_hash])
-            unique_entities[unique_hash] = updated_entity
+            # accumulate into the stored entity, so its references are extended in place
+            merge_entity(unique_entities[unique_hash], entity)
 
         else:
             unique_entities[unique_hash] = entity
@@ -298,5 +486,7 @@ def merge_entity(
     """
     Entity.merge_references(new_entity.references, old_entity.references)
     new_entity.children_names.update(old_entity.children_names)
+    new_entity.dropped_references += old_entity.dropped_references
+    new_entity.dropped_detached_executions += old_entity.dropped_detached_executions
 
     return new_entity
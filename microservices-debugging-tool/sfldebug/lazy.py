@@ -0,0 +1,123 @@
+from typing import Any, BinaryIO, Iterator, List, Tuple
+
+from sfldebug.entity import EntityType, Reference
+from sfldebug.messages.decoder import decode_log_message
+
+
+def read_reference(
+    source_file: BinaryIO,
+    offset: int,
+    length: int,
+    entity_type: EntityType
+) -> Reference:
+    """Read the log line of a reference from an open source file and build the reference.
+
+    Args:
+        source_file (BinaryIO): source file of the log line, open in binary mode
+        offset (int): offset of the log line in the source file
+        length (int): length of the log line, in bytes
+        entity_type (EntityType): type of the entity referenced
+
+    Raises:
+        ValueError: if the log line does not contain an entity of the type
+
+    Returns:
+        Reference: the reference to the entity in the log line
+    """
+    # the schema builds lazy references, so it is imported when the first reference is read
+    import sfldebug.schema as sfl_schema  # pylint: disable=import-outside-toplevel
+
+    source_file.seek(offset)
+    log_data = decode_log_message(source_file.read(length))
+    return sfl_schema.reference_from_entities(sfl_schema.entity_extractor(log_data), entity_type)
+
+
+class LazyReference(Reference):
+    """Reference to an entity kept as the location of its log line in the source file: the path
+    of the file, the offset of the line and its length. The fields of the reference are read from
+    the file when accessed (materialized), so the references take little memory until they are
+    written. Can only point to uncompressed files, which can be read at an offset.
+    Whether the log is an error log is kept from parsing, so the retention policies can check it
+    without reading the file.
+    """
+    __slots__ = ('source', 'offset', 'length', 'entity_type', 'error')
+
+    def __init__(
+        self,
+        source: str,
+        offset: int,
+        length: int,
+        entity_type: EntityType,
+        error: bool = False
+    ) -> None:
+        self.source = source
+        self.offset = offset
+        self.length = length
+        self.entity_type = entity_type
+        self.error = error
+
+    def __getitem__(self, field: str) -> Any:
+        return self.materialize()[field]
+
+    def __contains__(self, field: object) -> bool:
+        return field in self.materialize()
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.materialize())
+
+    def __len__(self) -> int:
+        return len(self.materialize())
+
+    def __repr__(self) -> str:
+        return 'LazyReference({}, {}, {})'.format(self.source, self.offset, self.length)
+
+    def __reduce__(self) -> Tuple[type, Tuple]:
+        return (type(self), (self.source, self.offset, self.length, self.entity_type,
+                             self.error))
+
+    def get_field(self, field: str) -> Any:
+        return self.materialize().get_field(field)
+
+    def get(self, field: str, default: Any = None) -> Any:
+        return self.materialize().get(field, default)
+
+    def keys(self) -> Tuple[str, ...]:
+        return self.materialize().keys()
+
+    def items(self) -> List[Tuple[str, Any]]:
+        return self.materialize().items()
+
+    def to_dict(self) -> dict:
+        return self.materialize().to_dict()
+
+    def materialize(self) -> Reference:
+        """Read the reference from its source file.
+
+        Returns:
+            Reference: the reference with all of its fields
+        """
+        with open(self.source, 'rb') as source_file:
+            return read_reference(source_file, self.offset, self.length, self.entity_type)
+
+
+def materialize_references(references: dict[str, List]) -> None:
+    """Replace the lazy references of an entity by the references read from their source files.
+    The references of each source file are read in offset order, opening each file once.
+    Modifies the references in place.
+
+    Args:
+        references (dict[str, List]): references of an entity, indexed by request id
+    """
+    lazy_references: dict[str, List[Tuple[int, str, int]]] = {}
+    for request_id, request_references in references.items():
+        for index, reference in enumerate(request_references):
+            if isinstance(reference, LazyReference):
+                lazy_references.setdefault(reference.source, []).append(
+                    (reference.offset, request_id, index))
+
+    for source, locations in lazy_references.items():
+        with open(source, 'rb') as source_file:
+            for _, request_id, index in sorted(locations):
+                reference = references[request_id][index]
+                references[request_id][index] = read_reference(
+                    source_file, reference.offset, reference.length, reference.entity_type)
@@ -0,0 +1,300 @@
+import asyncio
+from functools import partial
+from typing import Any, Callable, List, Optional, Tuple
+from pika import ConnectionParameters
+from pika.adapters.asyncio_connection import AsyncioConnection
+from pika.channel import Channel
+from pika.spec import BasicProperties, Basic
+
+import sfldebug.tools.logger as sfl_logger
+
+# maximum number of unacknowledged messages the broker sends to the consumer
+DEFAULT_PREFETCH_COUNT = 10000
+# number of messages handed to the parser at once
+DEFAULT_BATCH_SIZE = 1000
+# seconds to wait for a batch to fill before handing the partial batch to the parser
+DEFAULT_BATCH_TIMEOUT = 0.5
+
+
+class AsyncBatchConsumer:
+    """Asynchronous MQ consumer that hands messages to a callback in batches.
+    Runs on an asyncio event loop, with a configurable prefetch window, so the broker keeps sending
+    messages while the previous ones are being parsed.
+    When auto_ack is off, each batch is acknowledged with a single multiple ack after the callback
+    processes it.
+    The consumer stops when a message is received through the 'channel-stop' exchange.
+
+    Args:
+        exchange (str): name of the mq exchange to consume messages from
+        routing_key (str): name of the routing key for the mq exchange
+        on_batch (Callable[[List[bytes]], Any]): function to be called with each batch of message
+        bodies (required)
+        host (str): target host to setup connection (default 'localhost')
+        prefetch_count (int): size of the prefetch window (default DEFAULT_PREFETCH_COUNT)
+        batch_size (int): maximum number of messages in a batch (default DEFAULT_BATCH_SIZE)
+        batch_timeout (float): seconds before a partial batch is processed
+        (default DEFAULT_BATCH_TIMEOUT)
+        auto_ack (bool): if True, messages are acknowledged by the broker on delivery
+        (default False)
+
+    Raises:
+        ValueError: if auto_ack is off and the batch does not fit in the prefetch window
+    """
+
+    def __init__(
+        self,
+        exchange: str,
+        routing_key: str,
+        on_batch: Callable[[List[bytes]], Any],
+        host: str = 'localhost',
+        prefetch_count: int = DEFAULT_PREFETCH_COUNT,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        batch_timeout: float = DEFAULT_BATCH_TIMEOUT,
+        auto_ack: bool = False
+    ) -> None:
+        if not auto_ack and batch_size > prefetch_count:
+            raise ValueError('Batch size ({}) must not exceed the prefetch count ({}).'.format(
+                batch_size, prefetch_count))
+
+        self.exchange = exchange
+        self.routing_key = routing_key
+        self.on_batch = on_batch
+        self.host = host
+        self.prefetch_count = prefetch_count
+        self.batch_size = batch_size
+        self.batch_timeout = batch_timeout
+        self.auto_ack = auto_ack
+
+        self.batch: List[bytes] = []
+        self.last_delivery_tag: int = 0
+        self.messages_received: int = 0
+        self.channel: Optional[Channel] = None
+        self.connection: Optional[AsyncioConnection] = None
+        self.closed: Optional[asyncio.Future] = None
+        self.batch_timer: Optional[asyncio.TimerHandle] = None
+
+    async def consume(self) -> None:
+        """Open the connection and consume messages until the consumer is stopped.
+
+        Raises:
+            AMQPConnectionError: if the connection to the host fails
+        """
+        loop = asyncio.get_running_loop()
+        self.closed = loop.create_future()
+        self.connection = AsyncioConnection(
+            ConnectionParameters(host=self.host),
+            on_open_callback=self.on_connection_open,
+            on_open_error_callback=self.on_connection_closed,
+            on_close_callback=self.on_connection_closed,
+            custom_ioloop=loop)
+        await self.closed
+
+    def on_connection_open(self, connection: AsyncioConnection) -> None:
+        """Callback to open a channel once the connection is open."""
+        connection.channel(on_open_callback=self.on_channel_open)
+
+    def on_connection_closed(self, connection: AsyncioConnection, reason: Any) -> None:
+        """Callback to finish consuming when the connection is closed or fails to open."""
+        del connection
+        if self.closed is None or self.closed.done():
+            return
+        if isinstance(reason, Exception) and self.channel is None:
+            self.closed.set_exception(reason)
+        else:
+            self.closed.set_result(None)
+
+    def on_channel_open(self, channel: Channel) -> None:
+        """Callback to set up the exchange queue and the stop queue, once the channel is open."""
+        self.channel = channel
+        self.declare_exchange_queue(channel, self.exchange, self.routing_key, self.on_message)
+        self.declare_stop_queue(channel)
+
+    def declare_exchange_queue(
+        self,
+        channel: Channel,
+        exchange: str,
+        routing_key: str,
+        on_message: Callable
+    ) -> None:
+        """Declare the exchange and a queue bound to it, and start consuming the queue.
+        By default logstash creates durable exchanges.
+
+        Args:
+            channel (Channel): open channel to declare the exchange and queue in
+            exchange (str): name of the mq exchange
+            routing_key (str): name of the routing key for the mq exchange
+            on_message (Callable): function to be called when a message is received
+        """
+        def on_queue_declared(frame: Any) -> None:
+            queue_name = frame.method.queue
+            start_consuming = partial(channel.basic_consume, queue_name,
+                                      on_message, auto_ack=self.auto_ack)
+            channel.queue_bind(
+                queue=queue_name, exchange=exchange, routing_key=routing_key,
+                callback=lambda _: channel.basic_qos(
+                    prefetch_count=self.prefetch_count, callback=lambda _: start_consuming()))
+            sfl_logger.logger.debug(
+                'Channel set up for exchange "%s", routing key "%s", host "%s" and prefetch %d.',
+                exchange, routing_key, self.host, self.prefetch_count)
+
+        channel.exchange_declare(
+            exchange=exchange, durable=True,
+            callback=lambda _: channel.queue_declare(
+                queue='', durable=True, callback=on_queue_declared))
+
+    def declare_stop_queue(self, channel: Channel) -> None:
+        """Define the action to stop consuming when a message through 'channel-stop' is received.
+
+        Args:
+            channel (Channel): open channel to declare the stop exchange and queue in
+        """
+        channel.exchange_declare(
+            exchange='channel-stop', durable=True,
+            callback=lambda _: channel.queue_declare(
+                queue='channel-stop', durable=True,
+                callback=lambda _: channel.queue_bind(
+                    queue='channel-stop', exchange='channel-stop', routing_key='',
+                    callback=lambda _: channel.basic_consume(
+                        'channel-stop', self.on_stop_message, auto_ack=True))))
+
+    def on_message(
+        self,
+        channel: Channel,
+        method: Basic.Deliver,
+        properties: BasicProperties,
+        body: bytes
+    ) -> None:
+        """Callback to collect the messages into the batch. Processes the batch when it is full,
+        otherwise schedules the processing of the partial batch.
+
+        Args:
+            channel (pika.channel.Channel): message queue channel (ignored)
+            method (pika.spec.Basic.Deliver): AMQP specification, to keep the delivery tag
+            properties (pika.spec.BasicProperties): AMQP specification (ignored)
+            body (bytes): contents of the message
+        """
+        del channel, properties
+        self.batch.append(body)
+        self.last_delivery_tag = method.delivery_tag
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+        elif self.batch_timer is None:
+            self.batch_timer = asyncio.get_running_loop().call_later(
+                self.batch_timeout, self.flush)
+
+    def on_stop_message(
+        self,
+        channel: Channel,
+        method: Basic.Deliver,
+        properties: BasicProperties,
+        body: bytes
+    ) -> None:
+        """Callback to stop consuming when a message through 'channel-stop' is received."""
+        del channel, method, properties, body
+        self.stop()
+
+    def flush(self, ack: bool = True) -> None:
+        """Hand the collected batch to the callback and acknowledge it with a single multiple ack.
+
+        Args:
+            ack (bool, optional): if False, the batch is not acknowledged, e.g. when the connection
+            is already closed. Defaults to True.
+        """
+        if self.batch_timer is not None:
+            self.batch_timer.cancel()
+            self.batch_timer = None
+        if len(self.batch) == 0:
+            return
+
+        batch = self.batch
+        self.batch = []
+        self.on_batch(batch)
+        self.messages_received += len(batch)
+        if ack and not self.auto_ack and self.channel is not None:
+            self.channel.basic_ack(delivery_tag=self.last_delivery_tag, multiple=True)
+
+    def stop(self) -> None:
+        """Process the remaining batch and close the connection."""
+        self.flush()
+        sfl_logger.logger.info('"%s" - Stopped consuming after %d messages.',
+                               self.exchange, self.messages_received)
+        if self.connection is not None and not self.connection.is_closed:
+            self.connection.close()
+
+
+class MultiplexedBatchConsumer(AsyncBatchConsumer):
+    """Asynchronous MQ consumer of several exchanges over a single connection and channel.
+    The messages of all the exchanges are collected into the same batch, in delivery order, each
+    tagged with the exchange it came from, so a single multiple ack covers the whole batch.
+    The consumer stops once a message through the 'channel-stop' exchange is received for each of
+    the exchanges consumed.
+
+    Args:
+        exchanges (List[str]): names of the mq exchanges to consume messages from, each also used
+        as its routing key
+        on_batch (Callable[[List[Tuple[str, bytes]]], Any]): function to be called with each batch
+        of messages, as pairs of exchange name and message body (required)
+        host (str): target host to setup connection (default 'localhost')
+        prefetch_count (int): size of the prefetch window (default DEFAULT_PREFETCH_COUNT)
+        batch_size (int): maximum number of messages in a batch (default DEFAULT_BATCH_SIZE)
+        batch_timeout (float): seconds before a partial batch is processed
+        (default DEFAULT_BATCH_TIMEOUT)
+        auto_ack (bool): if True, messages are acknowledged by the broker on delivery
+        (default False)
+    """
+
+    def __init__(
+        self,
+        exchanges: List[str],
+        on_batch: Callable[[List[Tuple[str, bytes]]], Any],
+        host: str = 'localhost',
+        prefetch_count: int = DEFAULT_PREFETCH_COUNT,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        batch_timeout: float = DEFAULT_BATCH_TIMEOUT,
+        auto_ack: bool = False
+    ) -> None:
+        AsyncBatchConsumer.__init__(self, ', '.join(exchanges), '', on_batch, host,
+                                    prefetch_count, batch_size, batch_timeout, auto_ack)
+        self.exchanges = exchanges
+        self.stop_messages_received: int = 0
+
+    def on_channel_open(self, channel: Channel) -> None:
+        """Callback to set up a queue for each exchange and the stop queue, once the channel is
+        open."""
+        self.channel = channel
+        for exchange in self.exchanges:
+            self.declare_exchange_queue(channel, exchange, exchange,
+                                        partial(self.on_exchange_message, exchange))
+        self.declare_stop_queue(channel)
+
+    def on_exchange_message(
+        self,
+        exchange: str,
+        channel: Channel,
+        method: Basic.Deliver,
+        properties: BasicProperties,
+        body: bytes
+    ) -> None:
+        """Callback to collect the messages of an exchange into the batch, tagged by the exchange.
+
+        Args:
+            exchange (str): name of the exchange the message came from
+            channel (pika.channel.Channel): message queue channel (ignored)
+            method (pika.spec.Basic.Deliver): AMQP specification, to keep the delivery tag
+            properties (pika.spec.BasicProperties): AMQP specification (ignored)
+            body (bytes): contents of the message
+        """
+        self.on_message(channel, method, properties, (exchange, body))  # type: ignore
+
+    def on_stop_message(
+        self,
+        channel: Channel,
+        method: Basic.Deliver,
+        properties: BasicProperties,
+        body: bytes
+    ) -> None:
+        """Callback to stop consuming once a stop message is received for each exchange."""
+        del channel, method, properties, body
+        self.stop_messages_received += 1
+        if self.stop_messages_received >= len(self.exchanges):
+            self.stop()
@@ -0,0 +1,163 @@
+from enum import Enum
+import json
+import os
+from typing import Any, Optional
+
+try:
+    import orjson
+except ImportError:  # optional faster backend, fallback to the standard library
+    orjson = None
+
+# log template of the logs processed, kept in the sibling log processor project. Only read to
+# check LOG_TEMPLATE_FIELDS, which may not be available next to the debugging tool.
+LOG_TEMPLATE_PATH = os.path.normpath(os.path.join(
+    os.path.dirname(__file__), '..', '..', '..', 'microservices-log-processor',
+    'log-template.json'))
+
+
+def stdlib_loads(message: bytes | bytearray | memoryview | str) -> Any:
+    """Decode a json message with the standard library json module.
+
+    Args:
+        message (bytes | bytearray | memoryview | str): the message to be decoded
+
+    Returns:
+        Any: the decoded message
+    """
+    if isinstance(message, memoryview):
+        message = message.tobytes()
+    return json.loads(message)
+
+
+def orjson_loads(message: bytes | bytearray | memoryview | str) -> Any:
+    """Decode a json message with orjson. Works directly on bytes and memoryview.
+
+    Args:
+        message (bytes | bytearray | memoryview | str): the message to be decoded
+
+    Returns:
+        Any: the decoded message
+    """
+    return orjson.loads(message)  # type: ignore
+
+
+class JsonDecoder(str, Enum):
+    """Enum for the json decoding backends of the log messages.
+
+    Decoders:
+        STDLIB: standard library json module, always available
+        ORJSON: orjson, faster and decodes bytes directly, available if installed
+    """
+    STDLIB = 'STDLIB'
+    ORJSON = 'ORJSON'
+
+    __DECODERS__ = {
+        'STDLIB': stdlib_loads,
+        'ORJSON': orjson_loads
+    }
+
+    def is_available(self) -> bool:
+        """Check if the backend of the decoder is installed.
+
+        Returns:
+            bool: True if the decoder can be used, False otherwise
+        """
+        return self != JsonDecoder.ORJSON or orjson is not None
+
+    def __call__(self, *args):
+        return self.__DECODERS__[self.value](*args)
+
+
+DEFAULT_JSON_DECODER = JsonDecoder.ORJSON if JsonDecoder.ORJSON.is_available() \
+    else JsonDecoder.STDLIB
+
+
+def load_log_template_fields(template_path: str) -> dict[str, Optional[dict]]:
+    """Read a log template file and return its fields.
+
+    Args:
+        template_path (str): path of the log template file, in json format
+
+    Returns:
+        dict[str, Optional[dict]]: the fields of the template, nested objects map to their fields
+    """
+    def template_fields(template: dict) -> dict[str, Optional[dict]]:
+        return {field: template_fields(value) if isinstance(value, dict) else None
+                for field, value in template.items()}
+
+    with open(template_path, 'r', encoding='utf-8') as template_file:
+        return template_fields(json.load(template_file))
+
+
+# fields of the log template (see LOG_TEMPLATE_PATH). Nested objects map to their own fields, leaf
+# fields map to None.
+LOG_TEMPLATE_FIELDS: dict[str, Optional[dict]] = {
+    'correlationID': None,
+    'durationProcessing': None,
+    'spanID': None,
+    'endpoint': None,
+    'httpCode': None,
+    'instanceIP': None,
+    'methodInvocation': {
+        'fileName': None,
+        'className': None,
+        'line': None,
+        'methodName': None
+    },
+    'logLevel': None,
+    'message': None,
+    'microserviceName': None,
+    'parentSpanID': None,
+    'timestamp': None,
+    'user': None
+}
+
+
+def project_fields(
+    obj: dict,
+    fields: dict[str, Optional[dict]]
+) -> dict:
+    """Keep only the fields of an object that are present in the template fields.
+    Nested objects are projected with their own template fields.
+
+    Args:
+        obj (dict): the object to be projected
+        fields (dict[str, Optional[dict]]): the template fields to keep
+
+    Returns:
+        dict: a new object with only the template fields present in the original object
+    """
+    projected = {}
+    for field, nested_fields in fields.items():
+        if field in obj:
+            value = obj[field]
+            if nested_fields is not None and isinstance(value, dict):
+                value = project_fields(value, nested_fields)
+            projected[field] = value
+    return projected
+
+
+def decode_log_message(
+    message: bytes | bytearray | memoryview | str,
+    decoder: JsonDecoder = DEFAULT_JSON_DECODER,
+    fields: Optional[dict[str, Optional[dict]]] = None
+) -> dict:
+    """Decode a log message in json format.
+    Messages received from MQ (bytes) or files can be decoded without converting them first.
+    The extractor of the entities reads only the fields it needs from the decoded message, so it
+    is not projected, unless the fields are given (e.g. to keep a reduced copy of the message).
+
+    Args:
+        message (bytes | bytearray | memoryview | str): the log message to be decoded
+        decoder (JsonDecoder, optional): json backend used to decode the message. Defaults to
+        DEFAULT_JSON_DECODER, the fastest available.
+        fields (Optional[dict[str, Optional[dict]]], optional): template fields to keep, e.g.
+        LOG_TEMPLATE_FIELDS. Defaults to None, all fields are kept.
+
+    Returns:
+        dict: the decoded log message
+    """
+    message_json = decoder(message)
+    if fields is None:
+        return message_json
+    return project_fields(message_json, fields)
@@ -1,13 +1,45 @@
-import json
-from typing import Set
+from typing import Any, List, Optional, Set
 from pika.channel import Channel
 from pika.adapters.blocking_connection import BlockingChannel
 from pika.spec import BasicProperties, Basic
 
-from sfldebug.entity import build_entity, parse_unique_entities, Entity
+from sfldebug.aggregator import EntityAggregator
+from sfldebug.entity import Entity, method_invocations
+from sfldebug.messages.decoder import decode_log_message
+from sfldebug.retention import ReferenceRetention
+import sfldebug.schema as sfl_schema
+from sfldebug.spectra import EntitySpectra
+from sfldebug.symbols import symbols
+from sfldebug.tools.instrumentation import instrumented, metrics
+import sfldebug.tools.logger as sfl_logger
 from sfldebug.tools.writer import write_results_to_file
 
-entities = set()
+entities = EntityAggregator()
+
+
+def set_reference_retention(retention: Optional[ReferenceRetention]) -> None:
+    """Set the retention of the references of the entities collected, bounding the references kept
+    per entity. The receivers use it for all of their aggregators.
+
+    Args:
+        retention (Optional[ReferenceRetention]): retention of the references, all references are
+        kept if None
+    """
+    entities.retention = retention
+
+
+def set_entity_schema(schema: dict[str, Any]) -> None:
+    """Set the entity schema the entities are extracted with, e.g. to extract extra entity levels.
+    The schema is compiled into the extractor used by the parser.
+
+    Args:
+        schema (dict[str, Any]): entity schema, in the format of sfldebug.schema.ENTITY_SCHEMA
+
+    Raises:
+        ValueError: if the schema is not valid
+    """
+    sfl_schema.entity_extractor = sfl_schema.EntityExtractor(schema)
+    sfl_schema.lazy_entity_extractor = sfl_schema.EntityExtractor(schema, lazy=True)
 
 
 def channel_stop(
@@ -28,6 +60,7 @@ def channel_stop(
     channel.stop_consuming()
 
 
+@instrumented('parse')
 def parse_mq_message(
     channel: Channel,
     method: Basic.Deliver,
@@ -46,49 +79,157 @@ def parse_mq_message(
     parse_json_entity(body)
 
 
-def parse_json_entity(message: str):
-    """Parse a message into json and build the entity from the structured data. Update the entities
-    set.
+def parse_json_entity(
+    message: bytes | str,
+    aggregator: EntityAggregator = entities
+) -> Set[Entity]:
+    """Parse a message into json and build the entity from the structured data. Fold the entities
+    into the entities aggregator.
+    Only the fields of the log template are kept from the message.
 
     Args:
-        message (str): The message in json line format to be parsed
+        message (bytes | str): The message in json line format to be parsed
+        aggregator (EntityAggregator, optional): aggregator to fold the entities into. Defaults to
+        the module entities aggregator.
+
+    Returns:
+        Set[Entity]: the entities built from the message
+    """
+    message_json = decode_log_message(message)
+    log_entities = sfl_schema.entity_extractor(message_json)
+    aggregator.update(log_entities)
+    return log_entities
+
+
+def parse_json_entity_lazy(
+    message: bytes,
+    source: str,
+    offset: int,
+    aggregator: EntityAggregator = entities
+) -> Set[Entity]:
+    """Parse a line of a log file into entities with lazy references, pointing to the line in the
+    file instead of keeping its fields. Only the names, the request id and the fields telling
+    whether the log is an error log are read. Fold the entities into the entities aggregator.
+
+    Args:
+        message (bytes): The line of the log file, in json line format
+        source (str): path of the log file, uncompressed
+        offset (int): offset of the line in the log file
+        aggregator (EntityAggregator, optional): aggregator to fold the entities into. Defaults to
+        the module entities aggregator.
+
+    Returns:
+        Set[Entity]: the entities built from the message
     """
-    message_json = json.loads(message)
-    log_entities = build_entity(message_json)
-    entities.update(log_entities)
+    message_json = decode_log_message(message)
+    log_entities = sfl_schema.lazy_entity_extractor(message_json, source, offset, len(message))
+    aggregator.update(log_entities)
+    return log_entities
+
+
+@instrumented('parse')
+def parse_mq_batch(
+    messages: List[bytes],
+    aggregator: EntityAggregator = entities
+) -> None:
+    """Callback to parse a batch of messages coming from MQ channel.
+
+    Args:
+        messages (List[bytes]): contents of the messages in the batch
+        aggregator (EntityAggregator, optional): aggregator to fold the entities into. Defaults to
+        the module entities aggregator.
+    """
+    for message in messages:
+        parse_json_entity(message, aggregator)
 
 
 def clear_entities():
-    """Clear the entities set. Useful when running multiple scenarios in a row."""
+    """Clear the entities aggregator, the symbol table and the shared method invocations. Useful
+    when running multiple scenarios in a row. The references of the entities parsed before can no
+    longer be read.
+    """
     entities.clear()
+    symbols.clear()
+    method_invocations.clear()
 
 
 def flush_mq_messages(
     file_id: str = 'default',
     exec_id: str = 'default',
-    write_to_file: bool = True
+    write_to_file: bool = True,
+    aggregator: EntityAggregator = entities
 ) -> Set[Entity]:
-    """Once the connection is finished, parse collected entities and write to file
+    """Once the connection is finished, collect the aggregated entities and write to file
 
     Args:
         file_id (str): id of entities to record in a unique file
         exec_id (str): id of the execution to sort results
         write_to_file (bool, optional): if True, writes the parsed contents to a file. Defaults to
         True.
+        aggregator (EntityAggregator, optional): aggregator to collect the entities from. Defaults
+        to the module entities aggregator.
 
     Returns:
         Set[Entity]: set of parsed entities from the messages received
     """
-    parsed_entities = parse_unique_entities(entities)
+    parsed_entities = aggregator.get_entities()
+    sfl_logger.logger.info(('Collected aggregated entities. Number of entities parsed: %d. '
+                            'Number of unique entities: %d.'),
+                           aggregator.entities_added, len(parsed_entities))
+    metrics.count('receive', 'messages', aggregator.messages_added)
+    metrics.count('receive', 'entities', aggregator.entities_added)
+    metrics.count('receive', 'unique_entities', len(parsed_entities))
+    metrics.count('receive', 'references',
+                  sum(entity.get_ref_count() for entity in parsed_entities))
 
     if write_to_file:
-        json_entities = {"entities": []}
-        for entity in parsed_entities:
-            entity_dict = entity.__dict__
-            entity_dict['ref_count'] = Entity.count_references(
-                entity_dict['references'])
-            json_entities['entities'].append(entity_dict)
-
-        filename = 'entities-records-' + file_id
-        write_results_to_file(json_entities, filename, exec_id)
+        write_entities_records(parsed_entities, file_id, exec_id)
     return parsed_entities
+
+
+def flush_mq_spectra(
+    file_id: str = 'default',
+    exec_id: str = 'default',
+    aggregator: EntityAggregator = entities
+) -> EntitySpectra:
+    """Once the connection is finished, collect the aggregated entities, write them to file and
+    return their compact summary. The written file is kept as the reference store of the summary.
+
+    Args:
+        file_id (str): id of entities to record in a unique file
+        exec_id (str): id of the execution to sort results
+        aggregator (EntityAggregator, optional): aggregator to collect the entities from. Defaults
+        to the module entities aggregator.
+
+    Returns:
+        EntitySpectra: summary of the parsed entities from the messages received
+    """
+    parsed_entities = flush_mq_messages(file_id, exec_id, False, aggregator)
+    records_path = write_entities_records(parsed_entities, file_id, exec_id)
+    return EntitySpectra.from_entities(parsed_entities, records_path)
+
+
+def write_entities_records(
+    parsed_entities: Set[Entity],
+    file_id: str,
+    exec_id: str
+) -> str:
+    """Write the parsed entities and their references to file.
+
+    Args:
+        parsed_entities (Set[Entity]): set of parsed entities to be written
+        file_id (str): id of entities to record in a unique file
+        exec_id (str): id of the execution to sort results
+
+    Returns:
+        str: the path of the written file
+    """
+    json_entities = {"entities": []}
+    for entity in parsed_entities:
+        entity_dict = entity.get_properties()
+        entity_dict['key'] = entity.get_key()
+        entity_dict['ref_count'] = entity.get_ref_count()
+        json_entities['entities'].append(entity_dict)
+
+    filename = 'entities-records-' + file_id
+    return write_results_to_file(json_entities, filename, exec_id)
@@ -1,14 +1,32 @@
 #import signal
+import asyncio
 import multiprocessing as mp
 import logging
-from typing import Callable, Set
+import os
+from typing import Any, BinaryIO, Callable, List, Optional, Set, Tuple
 from pika import BlockingConnection, ConnectionParameters
 from pika.adapters.blocking_connection import BlockingChannel
 
 import sfldebug.tools.logger as sfl_logger
 import sfldebug.messages.parse_message as pm
 import sfldebug.tools.object as sfl_obj
+from sfldebug.tools.reader import detect_compression, open_log_file
+from sfldebug.aggregator import EntityAggregator
+from sfldebug.baseline import BaselineCache
+from sfldebug.messages.consumer import AsyncBatchConsumer, MultiplexedBatchConsumer, \
+    DEFAULT_PREFETCH_COUNT, DEFAULT_BATCH_SIZE
 from sfldebug.entity import Entity
+from sfldebug.online import OnlineRanking
+from sfldebug.retention import ReferenceRetention
+from sfldebug.spectra import EntitySpectra
+from sfldebug.symbols import symbols
+from sfldebug.tools.instrumentation import call_recording_metrics, instrumented, metrics
+from sfldebug.windows import WindowedSpectra
+
+# minimum size of a file chunk parsed by a single worker, smaller files are not split
+FILE_CHUNK_MIN_SIZE = 1 << 20
+# number of chunks assigned to each worker, to balance the load when chunks parse unevenly
+FILE_CHUNKS_PER_WORKER = 4
 
 
 def setup_mq_channel(
@@ -68,8 +86,9 @@ def receive_mq_messages(
     callback: Callable,
     host: str = 'localhost',
     exchange: str = 'logstash-output',
-    routing_key: str = 'logstash-output'
-) -> Set[Entity]:
+    routing_key: str = 'logstash-output',
+    flush: Callable[[str, str], Any] = pm.flush_mq_messages
+) -> Any:
     """Start consuming messages from the channel, keeping it open until there is an interruption.
 
     Args:
@@ -79,6 +98,8 @@ def receive_mq_messages(
         host (str): target to host to setup connection (default 'localhost')
         exchange (str): name of the mq exchange to setup connection (default 'logstash-output')
         routing_key (str): name of the routing key for the mq exchange (default 'logstash-output')
+        flush (callable): function to collect the parsed entities, receives the exchange and the
+        execution id (default pm.flush_mq_messages, returns the set of entities)
     """
     sfl_logger.config_logger(
         execution_id)  # necessary when using multiprocessesing
@@ -94,17 +115,64 @@ def receive_mq_messages(
     sfl_logger.logger.info(
         '"%s" - Terminating connection... Flushing collected messages!', exchange)
     channel.close()
-    return pm.flush_mq_messages(exchange, execution_id)
+    return flush(exchange, execution_id)
 
 
-def receive_mq(
+def receive_mq_messages_async(
+    execution_id: str,
+    host: str = 'localhost',
+    exchange: str = 'logstash-output',
+    routing_key: str = 'logstash-output',
+    prefetch_count: int = DEFAULT_PREFETCH_COUNT,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    auto_ack: bool = False,
+    flush: Callable[[str, str], Any] = pm.flush_mq_messages
+) -> Any:
+    """Start consuming messages asynchronously, parsing them in batches, until there is an
+    interruption or a stop message.
+
+    Args:
+        execution_id (str): id of the current execution
+        host (str): target to host to setup connection (default 'localhost')
+        exchange (str): name of the mq exchange to setup connection (default 'logstash-output')
+        routing_key (str): name of the routing key for the mq exchange (default 'logstash-output')
+        prefetch_count (int): size of the prefetch window (default DEFAULT_PREFETCH_COUNT)
+        batch_size (int): maximum number of messages parsed at once (default DEFAULT_BATCH_SIZE)
+        auto_ack (bool): if True, messages are acknowledged by the broker on delivery, otherwise
+        each batch is acknowledged once parsed (default False)
+        flush (callable): function to collect the parsed entities, receives the exchange and the
+        execution id (default pm.flush_mq_messages, returns the set of entities)
+    """
+    sfl_logger.config_logger(
+        execution_id)  # necessary when using multiprocessesing
+
+    consumer = AsyncBatchConsumer(exchange, routing_key, pm.parse_mq_batch, host,
+                                  prefetch_count, batch_size, auto_ack=auto_ack)
+    sfl_logger.logger.info(
+        '"%s" - Waiting for logs. Press CTRL+C to terminate.', exchange)
+    try:
+        asyncio.run(consumer.consume())
+    except KeyboardInterrupt:
+        sfl_logger.logger.debug(
+            '"%s" - Terminating connection from keyboard interruption.', exchange)
+        # the connection is gone, parse the messages left without acknowledging them
+        consumer.flush(ack=False)
+    sfl_logger.logger.info(
+        '"%s" - Terminating connection... Flushing collected messages!', exchange)
+    return flush(exchange, execution_id)
+
+
+def receive_mq_processes(
     good_entities_id: str,
     faulty_entities_id: str,
-    execution_id: str
+    execution_id: str,
+    receiver: Callable[..., Set[Entity] | EntitySpectra],
+    receiver_kwds: dict
 ) -> dict:
-    """Receives log data through MQ channels.
-    Each channel receives the messages and sends the data to a parser.
-    The channels are set up in different processes for concurrent receival of messages.
+    """Receives log data through MQ channels, with a receiver for each channel.
+    The channels are set up in different processes for concurrent receival of messages. The
+    metrics recorded by each receiver, e.g. the messages received, are merged into the metrics of
+    this process.
     Returns a set with the parsed data for the 'good' and 'faulty' entities.
 
     Args:
@@ -113,6 +181,10 @@ def receive_mq(
         faulty_entities_id (str): name of the exchange where the faulty entities' log data will
         originate from
         execution_id (str): id of the current execution
+        receiver (Callable[..., Set[Entity] | EntitySpectra]): function to receive the messages of
+        a channel. Must receive the execution id and the keywords 'exchange' and 'routing_key',
+        and return the set of parsed entities or their summary.
+        receiver_kwds (dict): other keyword arguments passed to the receiver
 
     Returns:
         dict: set with the parsed data for the 'good' and 'faulty' entities
@@ -126,37 +198,252 @@ def receive_mq(
                                good_entities_id, faulty_entities_id)
 
         good_entities_process = pool.apply_async(
-            receive_mq_messages,
-            args=(execution_id, pm.parse_mq_message),
-            kwds={'exchange': good_entities_id, 'routing_key': good_entities_id})
+            call_recording_metrics,
+            args=(receiver, execution_id),
+            kwds={'exchange': good_entities_id, 'routing_key': good_entities_id,
+                  **receiver_kwds})
         faulty_entities_process = pool.apply_async(
-            receive_mq_messages,
-            args=(execution_id, pm.parse_mq_message),
-            kwds={'exchange': faulty_entities_id, 'routing_key': faulty_entities_id})
+            call_recording_metrics,
+            args=(receiver, execution_id),
+            kwds={'exchange': faulty_entities_id, 'routing_key': faulty_entities_id,
+                  **receiver_kwds})
 
-        good_entities: Set[Entity] = set()
-        faulty_entities: Set[Entity] = set()
         try:
             good_entities_process.wait()
             faulty_entities_process.wait()
         except KeyboardInterrupt:
             sfl_logger.logger.debug('Keyboard Interruption on MQ receivers.')
-        good_entities = good_entities_process.get()
-        faulty_entities = faulty_entities_process.get()
+        good_entities, good_stages = good_entities_process.get()
+        faulty_entities, faulty_stages = faulty_entities_process.get()
+        metrics.merge(good_stages)
+        metrics.merge(faulty_stages)
 
         sfl_logger.logger.info('Message receiving complete.')
         return {good_entities_id: good_entities, faulty_entities_id: faulty_entities}
 
 
+@instrumented('receive')
+def receive_mq(
+    good_entities_id: str,
+    faulty_entities_id: str,
+    execution_id: str,
+    spectra: bool = False
+) -> dict:
+    """Receives log data through MQ channels.
+    Each channel receives the messages and sends the data to a parser.
+    The channels are set up in different processes for concurrent receival of messages.
+    Returns a set with the parsed data for the 'good' and 'faulty' entities.
+
+    Args:
+        good_entities_id (str): name of the exchange where the good entities' log data will
+        originate from
+        faulty_entities_id (str): name of the exchange where the faulty entities' log data will
+        originate from
+        execution_id (str): id of the current execution
+        spectra (bool, optional): if True, each process returns the compact summary of its
+        entities, with the references kept in the written entities records, instead of the set of
+        entities. Defaults to False.
+
+    Returns:
+        dict: set with the parsed data for the 'good' and 'faulty' entities
+    """
+    receiver_kwds: dict[str, Any] = {'callback': pm.parse_mq_message}
+    if spectra:
+        receiver_kwds['flush'] = pm.flush_mq_spectra
+    return receive_mq_processes(good_entities_id, faulty_entities_id, execution_id,
+                                receive_mq_messages, receiver_kwds)
+
+
+@instrumented('receive')
+def receive_mq_async(
+    good_entities_id: str,
+    faulty_entities_id: str,
+    execution_id: str,
+    prefetch_count: int = DEFAULT_PREFETCH_COUNT,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    auto_ack: bool = False,
+    spectra: bool = False
+) -> dict:
+    """Receives log data through MQ channels, with asynchronous consumers.
+    Each channel receives the messages with a large prefetch window and sends them to the parser in
+    batches, acknowledging each batch at once.
+    The channels are set up in different processes for concurrent receival of messages.
+    Returns a set with the parsed data for the 'good' and 'faulty' entities.
+
+    Args:
+        good_entities_id (str): name of the exchange where the good entities' log data will
+        originate from
+        faulty_entities_id (str): name of the exchange where the faulty entities' log data will
+        originate from
+        execution_id (str): id of the current execution
+        prefetch_count (int, optional): size of the prefetch window. Defaults to
+        DEFAULT_PREFETCH_COUNT.
+        batch_size (int, optional): maximum number of messages parsed at once. Defaults to
+        DEFAULT_BATCH_SIZE.
+        auto_ack (bool, optional): if True, messages are acknowledged by the broker on delivery.
+        Defaults to False.
+        spectra (bool, optional): if True, each process returns the compact summary of its
+        entities, with the references kept in the written entities records, instead of the set of
+        entities. Defaults to False.
+
+    Returns:
+        dict: set with the parsed data for the 'good' and 'faulty' entities
+    """
+    receiver_kwds: dict[str, Any] = {'prefetch_count': prefetch_count, 'batch_size': batch_size,
+                                     'auto_ack': auto_ack}
+    if spectra:
+        receiver_kwds['flush'] = pm.flush_mq_spectra
+    return receive_mq_processes(good_entities_id, faulty_entities_id, execution_id,
+                                receive_mq_messages_async, receiver_kwds)
+
+
+@instrumented('receive')
+def receive_mq_multiplexed(
+    good_entities_id: str,
+    faulty_entities_id: str,
+    execution_id: str,
+    prefetch_count: int = DEFAULT_PREFETCH_COUNT,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    auto_ack: bool = False,
+    online_ranking: Optional[OnlineRanking] = None
+) -> dict:
+    """Receives log data through MQ channels, in a single process.
+    Both exchanges are consumed over one connection and one event loop. Each message is tagged by
+    the exchange it came from, and parsed into the entities of that exchange.
+    If an online ranking is given, it is updated with the entities of each message and its top-k
+    is published at its interval while the messages are still arriving.
+    Receiving stops with a keyboard interruption or with a stop message for each exchange.
+    Returns a set with the parsed data for the 'good' and 'faulty' entities.
+
+    Args:
+        good_entities_id (str): name of the exchange where the good entities' log data will
+        originate from
+        faulty_entities_id (str): name of the exchange where the faulty entities' log data will
+        originate from
+        execution_id (str): id of the current execution
+        prefetch_count (int, optional): size of the prefetch window. Defaults to
+        DEFAULT_PREFETCH_COUNT.
+        batch_size (int, optional): maximum number of messages parsed at once. Defaults to
+        DEFAULT_BATCH_SIZE.
+        auto_ack (bool, optional): if True, messages are acknowledged by the broker on delivery.
+        Defaults to False.
+        online_ranking (Optional[OnlineRanking], optional): online ranking to update while
+        receiving. Defaults to None.
+
+    Returns:
+        dict: set with the parsed data for the 'good' and 'faulty' entities
+    """
+    aggregators = {good_entities_id: EntityAggregator(pm.entities.retention),
+                   faulty_entities_id: EntityAggregator(pm.entities.retention)}
+    execution_keys = {good_entities_id: 'good_executed',
+                      faulty_entities_id: 'faulty_executed'}
+
+    def parse_tagged_batch(messages: List[Tuple[str, bytes]]) -> None:
+        with metrics.stage('parse'):
+            for exchange, message in messages:
+                log_entities = pm.parse_json_entity(message, aggregators[exchange])
+                if online_ranking is not None:
+                    online_ranking.add_entities(log_entities, execution_keys[exchange])
+        if online_ranking is not None:
+            online_ranking.publish_if_due(execution_id)
+
+    consumer = MultiplexedBatchConsumer([good_entities_id, faulty_entities_id],
+                                        parse_tagged_batch, prefetch_count=prefetch_count,
+                                        batch_size=batch_size, auto_ack=auto_ack)
+    sfl_logger.logger.info('Opening channels: "%s" and "%s". Press CTRL+C to terminate.',
+                           good_entities_id, faulty_entities_id)
+    try:
+        asyncio.run(consumer.consume())
+    except KeyboardInterrupt:
+        sfl_logger.logger.debug('Terminating connection from keyboard interruption.')
+        # the connection is gone, parse the messages left without acknowledging them
+        consumer.flush(ack=False)
+
+    good_entities = pm.flush_mq_messages(good_entities_id, execution_id,
+                                         aggregator=aggregators[good_entities_id])
+    faulty_entities = pm.flush_mq_messages(faulty_entities_id, execution_id,
+                                           aggregator=aggregators[faulty_entities_id])
+
+    sfl_logger.logger.info('Message receiving complete.')
+    return {good_entities_id: good_entities, faulty_entities_id: faulty_entities}
+
+
+@instrumented('receive')
+def receive_mq_windowed(
+    good_entities_id: str,
+    faulty_entities_id: str,
+    windowed_spectra: WindowedSpectra,
+    prefetch_count: int = DEFAULT_PREFETCH_COUNT,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    auto_ack: bool = False
+) -> WindowedSpectra:
+    """Receives log data through MQ channels, in a single process, into tumbling time windows.
+    Meant for always-on log streams: instead of collecting all the entities, each is assigned to
+    the window of its timestamp, and only the most recent windows are kept in memory.
+    Receiving stops with a keyboard interruption or with a stop message for each exchange.
+
+    Args:
+        good_entities_id (str): name of the exchange where the good entities' log data will
+        originate from
+        faulty_entities_id (str): name of the exchange where the faulty entities' log data will
+        originate from
+        windowed_spectra (WindowedSpectra): windows to assign the parsed entities to
+        prefetch_count (int, optional): size of the prefetch window. Defaults to
+        DEFAULT_PREFETCH_COUNT.
+        batch_size (int, optional): maximum number of messages parsed at once. Defaults to
+        DEFAULT_BATCH_SIZE.
+        auto_ack (bool, optional): if True, messages are acknowledged by the broker on delivery.
+        Defaults to False.
+
+    Returns:
+        WindowedSpectra: the windows, with the spectra of the most recent windows received
+    """
+    execution_keys = {good_entities_id: 'good_executed',
+                      faulty_entities_id: 'faulty_executed'}
+
+    def parse_tagged_batch(messages: List[Tuple[str, bytes]]) -> None:
+        # the windows keep the strings, the symbols interned by the batch are released after it,
+        # and the symbols interned before remain valid
+        with symbols.scope(), metrics.stage('parse'):
+            batch_entities: dict[str, List[Entity]] = {key: [] for key in execution_keys.values()}
+            for exchange, message in messages:
+                # the entities are not kept in an aggregator, only in the windows
+                log_entities = pm.parse_json_entity(message, EntityAggregator())
+                batch_entities[execution_keys[exchange]].extend(log_entities)
+            for execution_key, entities in batch_entities.items():
+                windowed_spectra.add_entities(entities, execution_key)
+
+    consumer = MultiplexedBatchConsumer([good_entities_id, faulty_entities_id],
+                                        parse_tagged_batch, prefetch_count=prefetch_count,
+                                        batch_size=batch_size, auto_ack=auto_ack)
+    sfl_logger.logger.info('Opening channels: "%s" and "%s". Press CTRL+C to terminate.',
+                           good_entities_id, faulty_entities_id)
+    try:
+        asyncio.run(consumer.consume())
+    except KeyboardInterrupt:
+        sfl_logger.logger.debug('Terminating connection from keyboard interruption.')
+        consumer.flush(ack=False)
+
+    sfl_logger.logger.info('Message receiving complete. Windows kept: %d. Entities dropped: %d.',
+                           len(windowed_spectra.windows), windowed_spectra.dropped_entities)
+    return windowed_spectra
+
+
+@instrumented('receive')
 def receive_file(
     good_entities_file: str,
     faulty_entities_file: str,
-    execution_id: str
+    execution_id: str,
+    lazy_references: bool = False
 ) -> dict:
     """Receives log data through files.
     Open each file and extract the entities contained in each line.
-    Each line must be in a stringified json format.
+    Each line must be in a stringified json format. Files can be gzip or zstd compressed, in which
+    case they are decompressed in a stream while read.
     Then for each file the entities set is collected and then returned in a dict, to be analyzed.
+    With lazy references, the references only keep the location of their line in the file, and are
+    read from it when written. The entities records are not written, since they would read all the
+    references. Compressed files cannot be read at an offset, their references are kept in full.
 
     Args:
         good_entities_file (str): path of the file where the good entities' log structured data is
@@ -164,6 +451,8 @@ def receive_file(
         faulty_entities_file (str): path of the file where the faulty entities' log structured data
         is stored
         execution_id (str): id of the current execution
+        lazy_references (bool, optional): if True, the references are read from the files only
+        when needed. Defaults to False.
 
     Returns:
         dict: set with the parsed data for the 'good' and 'faulty' entities
@@ -172,28 +461,256 @@ def receive_file(
     sfl_logger.logger.info('Reading files: "%s" and "%s".',
                            good_entities_file, faulty_entities_file)
     good_entities: Set[Entity] = set()
-    with open(good_entities_file, 'r', encoding='utf-8') as entities_file:
+    with open_log_file(good_entities_file) as entities_file:
 
-        for entity_line in entities_file:
-            pm.parse_json_entity(entity_line)
+        parse_file_lines(entities_file, good_entities_file, lazy_references)
 
         good_entities_filename = sfl_obj.extract_filename(
             good_entities_file)
         good_entities = pm.flush_mq_messages(
-            good_entities_filename, execution_id)
-        pm.clear_entities()
+            good_entities_filename, execution_id, write_to_file=not lazy_references)
+        pm.entities.clear()
 
     faulty_entities: Set[Entity] = set()
-    with open(faulty_entities_file, 'r', encoding='utf-8') as entities_file:
+    with open_log_file(faulty_entities_file) as entities_file:
 
-        for entity_line in entities_file:
-            pm.parse_json_entity(entity_line)
+        parse_file_lines(entities_file, faulty_entities_file, lazy_references)
 
         faulty_entities_filename = sfl_obj.extract_filename(
             faulty_entities_file)
         faulty_entities = pm.flush_mq_messages(
-            faulty_entities_filename, execution_id)
-        pm.clear_entities()
+            faulty_entities_filename, execution_id, write_to_file=not lazy_references)
+        pm.entities.clear()
+
+    sfl_logger.logger.info('Files reading complete.')
+    return {good_entities_file: good_entities, faulty_entities_file: faulty_entities}
+
+
+@instrumented('receive')
+def receive_file_baseline(
+    good_entities_file: str,
+    faulty_entities_file: str,
+    execution_id: str,
+    baseline_cache: Optional[BaselineCache] = None
+) -> dict:
+    """Receives log data through files, with the good entities file as a cached baseline.
+    The good entities file is parsed once into the summary of its entities, which is cached and
+    loaded by the next executions with the same file. Only the faulty entities file is parsed.
+    Works as receive_file, except the good entities are returned as their summary, which can be
+    analyzed as well.
+
+    Args:
+        good_entities_file (str): path of the file where the good entities' log structured data is
+        stored
+        faulty_entities_file (str): path of the file where the faulty entities' log structured data
+        is stored
+        execution_id (str): id of the current execution
+        baseline_cache (Optional[BaselineCache], optional): cache of the baselines. Defaults to
+        None, the cache in the default directory.
+
+    Returns:
+        dict: summary of the 'good' entities and set with the parsed data for the 'faulty' entities
+    """
+    if baseline_cache is None:
+        baseline_cache = BaselineCache()
+    baseline_key = baseline_cache.get_key(good_entities_file, pm.entities.retention)
+    good_spectra = baseline_cache.load(baseline_key)
+    if good_spectra is None:
+        sfl_logger.logger.info('Reading baseline file: "%s".', good_entities_file)
+        with open_log_file(good_entities_file) as entities_file:
+            parse_file_lines(entities_file, good_entities_file)
+            good_spectra = pm.flush_mq_spectra(
+                sfl_obj.extract_filename(good_entities_file), execution_id)
+            pm.entities.clear()
+        good_spectra = baseline_cache.store(baseline_key, good_spectra)
+
+    sfl_logger.logger.info('Reading file: "%s".', faulty_entities_file)
+    with open_log_file(faulty_entities_file) as entities_file:
+        parse_file_lines(entities_file, faulty_entities_file)
+        faulty_entities = pm.flush_mq_messages(
+            sfl_obj.extract_filename(faulty_entities_file), execution_id)
+        pm.entities.clear()
+
+    sfl_logger.logger.info('Files reading complete.')
+    return {good_entities_file: good_spectra, faulty_entities_file: faulty_entities}
+
+
+@instrumented('parse')
+def parse_file_lines(
+    entities_file: BinaryIO,
+    filepath: str,
+    lazy_references: bool = False
+) -> None:
+    """Parse each line of an open log file into the module entities aggregator.
+
+    Args:
+        entities_file (BinaryIO): log file, open with open_log_file
+        filepath (str): path of the log file
+        lazy_references (bool, optional): if True, and the file is not compressed, the references
+        keep only the location of their line in the file. Defaults to False.
+    """
+    if lazy_references and detect_compression(filepath) is not None:
+        sfl_logger.logger.warning('Compressed file "%s" cannot be read at an offset. '
+                                  'Keeping its references in full.', filepath)
+        lazy_references = False
+    if not lazy_references:
+        for entity_line in entities_file:
+            pm.parse_json_entity(entity_line)
+        return
+
+    # the same path object is shared by all the references to the file
+    source = os.path.abspath(filepath)
+    offset = 0
+    for entity_line in entities_file:
+        pm.parse_json_entity_lazy(entity_line, source, offset)
+        offset += len(entity_line)
+
+
+def split_file_chunks(
+    filepath: str,
+    n_chunks: int,
+    min_chunk_size: int = FILE_CHUNK_MIN_SIZE
+) -> List[Tuple[int, int]]:
+    """Split a file into byte ranges aligned with the end of the lines.
+    Each range starts at the beginning of a line and ends right after a newline (or at the end of
+    the file), so every line belongs to exactly one range.
+    Compressed files cannot be split, so they are returned as a single range.
+
+    Args:
+        filepath (str): path of the file to be split
+        n_chunks (int): number of chunks to split the file into, at most
+        min_chunk_size (int, optional): minimum size of each chunk, in bytes. Defaults to
+        FILE_CHUNK_MIN_SIZE.
+
+    Returns:
+        List[Tuple[int, int]]: list of the start (inclusive) and end (exclusive) offsets of each
+        chunk
+    """
+    file_size = os.path.getsize(filepath)
+    if detect_compression(filepath) is not None:
+        return [(0, file_size)]
+    chunk_size = max(file_size // max(n_chunks, 1), min_chunk_size, 1)
+
+    chunks: List[Tuple[int, int]] = []
+    with open(filepath, 'rb') as entities_file:
+        start = 0
+        while start < file_size:
+            end = start + chunk_size
+            if end >= file_size:
+                end = file_size
+            else:
+                # move the end of the chunk to the end of the line
+                entities_file.seek(end)
+                entities_file.readline()
+                end = entities_file.tell()
+            chunks.append((start, end))
+            start = end
+    return chunks
+
+
+@instrumented('parse')
+def parse_file_chunk(
+    filepath: str,
+    start: int,
+    end: int,
+    retention: Optional[ReferenceRetention] = None
+) -> EntityAggregator:
+    """Parse the lines of a file contained in a byte range into a partial entities aggregator.
+    Blank lines are ignored. Compressed files are parsed whole, their range is ignored.
+
+    Args:
+        filepath (str): path of the file with the log structured data
+        start (int): offset of the first byte of the range, must be the beginning of a line
+        end (int): offset after the last byte of the range, must be the end of a line
+        retention (Optional[ReferenceRetention], optional): retention of the references of the
+        entities. Defaults to None, all references are kept.
+
+    Returns:
+        EntityAggregator: aggregator with the entities parsed from the range
+    """
+    aggregator = EntityAggregator(retention)
+    if detect_compression(filepath) is not None:
+        with open_log_file(filepath) as entities_file:
+            for entity_line in entities_file:
+                if entity_line.strip():
+                    pm.parse_json_entity(entity_line, aggregator)
+        return aggregator
+
+    with open(filepath, 'rb') as entities_file:
+        entities_file.seek(start)
+        position = start
+        while position < end:
+            entity_line = entities_file.readline()
+            if not entity_line:
+                break
+            position += len(entity_line)
+            if entity_line.strip():
+                pm.parse_json_entity(entity_line, aggregator)
+    return aggregator
+
+
+@instrumented('receive')
+def receive_file_parallel(
+    good_entities_file: str,
+    faulty_entities_file: str,
+    execution_id: str,
+    n_workers: Optional[int] = None
+) -> dict:
+    """Receives log data through files, parsing them in parallel.
+    Each file is split into chunks aligned with the lines, and the chunks of both files are parsed
+    concurrently in a process pool. Each worker returns a partial aggregate of the entities in its
+    chunk, which are merged in file order into the entities set of each file, and the metrics of
+    its parsing, merged into the metrics of this process.
+    Each line must be in a stringified json format.
+
+    Args:
+        good_entities_file (str): path of the file where the good entities' log structured data is
+        stored
+        faulty_entities_file (str): path of the file where the faulty entities' log structured data
+        is stored
+        execution_id (str): id of the current execution
+        n_workers (Optional[int], optional): number of worker processes. Defaults to None, the
+        number of CPUs available.
+
+    Returns:
+        dict: set with the parsed data for the 'good' and 'faulty' entities
+    """
+    n_workers = n_workers or os.cpu_count() or 1
+    sfl_logger.logger.info('Reading files in parallel with %d workers: "%s" and "%s".',
+                           n_workers, good_entities_file, faulty_entities_file)
+
+    n_chunks = n_workers * FILE_CHUNKS_PER_WORKER
+    good_chunks = split_file_chunks(good_entities_file, n_chunks)
+    faulty_chunks = split_file_chunks(faulty_entities_file, n_chunks)
+
+    retention = pm.entities.retention
+    with mp.Pool(n_workers) as pool:
+        # submit the chunks of both files before collecting, so they are parsed concurrently
+        good_partials = [pool.apply_async(call_recording_metrics,
+                                          (parse_file_chunk, good_entities_file, start, end,
+                                           retention))
+                         for start, end in good_chunks]
+        faulty_partials = [pool.apply_async(call_recording_metrics,
+                                            (parse_file_chunk, faulty_entities_file, start, end,
+                                             retention))
+                           for start, end in faulty_chunks]
+
+        good_aggregator = EntityAggregator(retention)
+        for partial in good_partials:
+            partial_aggregator, partial_stages = partial.get()
+            good_aggregator.merge(partial_aggregator)
+            metrics.merge(partial_stages)
+        faulty_aggregator = EntityAggregator(retention)
+        for partial in faulty_partials:
+            partial_aggregator, partial_stages = partial.get()
+            faulty_aggregator.merge(partial_aggregator)
+            metrics.merge(partial_stages)
+
+    good_entities = pm.flush_mq_messages(
+        sfl_obj.extract_filename(good_entities_file), execution_id, aggregator=good_aggregator)
+    faulty_entities = pm.flush_mq_messages(
+        sfl_obj.extract_filename(faulty_entities_file), execution_id,
+        aggregator=faulty_aggregator)
 
     sfl_logger.logger.info('Files reading complete.')
     return {good_entities_file: good_entities, faulty_entities_file: faulty_entities}
@@ -0,0 +1,232 @@
+import time
+from typing import Any, Iterable, List, Optional, Set
+
+import numpy as np
+
+from sfldebug.analytics import get_parent_key, weight_service_counts
+from sfldebug.entity import Entity, EntityType
+from sfldebug.sfl import select_top_rankings
+from sfldebug.symbols import symbols
+from sfldebug.tools.ranking_metrics import RankingMetrics, rank_spectra
+from sfldebug.tools.ranking_merge import RankMergeOperator
+import sfldebug.tools.logger as sfl_logger
+from sfldebug.tools.writer import write_results_to_file
+
+# number of most suspicious entities published online, see sfldebug.sfl.DEFAULT_TOP_K for the
+# written ranking
+DEFAULT_ONLINE_TOP_K = 20
+# seconds between publications of the ranking
+DEFAULT_PUBLISH_INTERVAL = 5.0
+
+EXECUTION_KEYS = ['good_executed', 'faulty_executed']
+
+
+class OnlineRanking:
+    """Online SFL ranking, kept up to date while messages are still arriving.
+    The executed counters of each entity, and the number of unique executions of each side, are
+    updated incrementally as the entities of each message are parsed. The passed counters are kept
+    implicit, the unique executions minus the executed counters, so a new execution does not touch
+    the counters of every entity. When ranking, the spectra arrays are built from the counters and
+    all the entities are ranked at once with the batch metrics. The ranking is only recomputed if
+    the counters changed since the last ranking.
+    The current top-k is published at a fixed interval.
+
+    Args:
+        ranking_metrics (List[RankingMetrics]): list of ranking metrics to rank the entities
+        ranking_merge_op (RankMergeOperator): operator to merge the rankings of each entity
+        (default RankMergeOperator.AVG)
+        top_k (int): number of most suspicious entities in the ranking
+        (default DEFAULT_ONLINE_TOP_K)
+        publish_interval (float): seconds between publications (default DEFAULT_PUBLISH_INTERVAL)
+    """
+
+    def __init__(
+        self,
+        ranking_metrics: List[RankingMetrics],
+        ranking_merge_op: RankMergeOperator = RankMergeOperator.AVG,
+        top_k: int = DEFAULT_ONLINE_TOP_K,
+        publish_interval: float = DEFAULT_PUBLISH_INTERVAL
+    ) -> None:
+        self.ranking_metrics = ranking_metrics
+        self.ranking_merge_op = ranking_merge_op
+        self.top_k = top_k
+        self.publish_interval = publish_interval
+
+        # row of each entity in the counters, indexed by the entity key
+        self.entity_rows: dict[int, int] = {}
+        # key, properties and key of the service weighted by the entity of each row
+        self.row_keys: List[int] = []
+        self.row_properties: List[dict[str, Any]] = []
+        self.row_parent_keys: List[Optional[int]] = []
+        # number of children names of each row, 0 for the rows of other entities than services
+        self.row_children: List[int] = []
+        # executed counters of each row, per side
+        self.executed: dict[str, List[int]] = {side: [] for side in EXECUTION_KEYS}
+        # symbols of the request ids each row was executed in, per side
+        self.row_requests: List[dict[str, Set[int]]] = []
+        # symbols of the request ids and executions without request of the service entities,
+        # per side
+        self.unique_executions: dict[str, Set[int]] = {side: set() for side in EXECUTION_KEYS}
+        self.detached_executions: dict[str, int] = {side: 0 for side in EXECUTION_KEYS}
+
+        # arrays of the rows, rebuilt when rows are added
+        self.keys_array = np.empty(0, dtype=np.uint64)
+        self.parent_rows = np.empty(0, dtype=np.int64)
+
+        self.changed: bool = False
+        self.rows_added: bool = False
+        self.last_ranking: List[dict] = []
+        self.last_publish_time = time.monotonic()
+
+    def add_row(self, entity: Entity) -> int:
+        """Add the row of a new entity, with empty counters.
+
+        Args:
+            entity (Entity): the new entity
+
+        Returns:
+            int: row of the entity
+        """
+        key = entity.get_key()
+        row = len(self.row_keys)
+        self.entity_rows[key] = row
+        self.row_keys.append(key)
+        self.row_properties.append({'name': entity.name, 'parent_name': entity.parent_name,
+                                    'children_names': set(), 'entity_type': entity.entity_type})
+        self.row_parent_keys.append(get_parent_key(entity.entity_type, entity.parent_name))
+        self.row_children.append(0)
+        for side in EXECUTION_KEYS:
+            self.executed[side].append(0)
+        self.row_requests.append({side: set() for side in EXECUTION_KEYS})
+        self.rows_added = True
+        return row
+
+    def add_entities(
+        self,
+        entities: Iterable[Entity],
+        execution_key: str
+    ) -> None:
+        """Update the counters with the entities parsed from a message.
+
+        Args:
+            entities (Iterable[Entity]): entities parsed from a message
+            execution_key (str): side the message came from, 'good_executed' or 'faulty_executed'
+        """
+        executed = self.executed[execution_key]
+        for entity in entities:
+            row = self.entity_rows.get(entity.get_key())
+            if row is None:
+                row = self.add_row(entity)
+            self.changed = True
+            is_service = entity.entity_type == EntityType.SERVICE
+            if entity.children_names:
+                children_names = self.row_properties[row]['children_names']
+                children_names.update(entity.children_names)
+                if is_service:
+                    self.row_children[row] = len(children_names)
+
+            entity_requests = self.row_requests[row][execution_key]
+            for request_id, references in entity.references.items():
+                if request_id == 'default':
+                    executed[row] += len(references)
+                    if is_service:
+                        self.detached_executions[execution_key] += len(references)
+                    continue
+                request_symbol = symbols.intern(request_id)
+                if request_symbol not in entity_requests:
+                    entity_requests.add(request_symbol)  # type: ignore
+                    executed[row] += 1
+                if is_service:
+                    self.unique_executions[execution_key].add(request_symbol)  # type: ignore
+
+    def get_number_unique_exec(self, execution_key: str) -> int:
+        """Get the number of unique executions of a side.
+
+        Args:
+            execution_key (str): side of the executions, 'good_executed' or 'faulty_executed'
+
+        Returns:
+            int: number of unique requests plus executions without request
+        """
+        return len(self.unique_executions[execution_key]) + \
+            self.detached_executions[execution_key]
+
+    def get_spectra(self) -> np.ndarray:
+        """Build the spectra arrays of all the entities from the current counters, with the passed
+        counters derived from the unique executions, and the service entities weighted by their
+        children, as in analyze_entities.
+
+        Returns:
+            np.ndarray: counters of each row, in the order of SPECTRA_KEYS
+        """
+        if self.rows_added:
+            self.keys_array = np.array(self.row_keys, dtype=np.uint64)
+            self.rows_added = False
+        # parents can be added after their children, so they are looked up again
+        self.parent_rows = np.fromiter(
+            (-1 if parent_key is None else self.entity_rows.get(parent_key, -1)
+             for parent_key in self.row_parent_keys), dtype=np.int64, count=len(self.row_keys))
+
+        spectra = np.empty((len(self.row_keys), 4), dtype=np.float64)
+        for column, execution_key in ((0, 'good_executed'), (2, 'faulty_executed')):
+            spectra[:, column] = self.executed[execution_key]
+            spectra[:, column + 1] = self.get_number_unique_exec(execution_key) - \
+                spectra[:, column]
+
+        n_children = np.array(self.row_children, dtype=np.int64)
+        weighted_rows = np.flatnonzero(n_children)
+        spectra[weighted_rows] = weight_service_counts(
+            spectra, self.parent_rows, n_children)[weighted_rows]
+        return spectra
+
+    def rank(self) -> List[dict]:
+        """Rank the entities with the current counters and return the top-k most suspicious, with
+        the ties ordered by the entity key. The ranking is recomputed only if the counters changed
+        since the last ranking. Metrics that cannot be computed yet (e.g. no faulty executions
+        received) rank the entity with 0.
+
+        Returns:
+            List[dict]: top-k entities rankings, in descending order, with their analytics
+        """
+        if not self.changed:
+            return self.last_ranking
+        self.changed = False
+        if len(self.row_keys) == 0:
+            self.last_ranking = []
+            return self.last_ranking
+
+        entities_ranks = rank_spectra(self.get_spectra(), self.ranking_metrics,
+                                      self.ranking_merge_op)
+        top_rows = select_top_rankings(entities_ranks, self.keys_array, self.top_k).tolist()
+        self.last_ranking = [{'entity_rank': entity_rank,
+                              'good_executed': self.executed['good_executed'][row],
+                              'faulty_executed': self.executed['faulty_executed'][row],
+                              'properties': self.row_properties[row]}
+                             for entity_rank, row in zip(entities_ranks[top_rows].tolist(),
+                                                         top_rows)]
+        sfl_logger.logger.debug('Online ranking updated for %d entities.', len(self.row_keys))
+        return self.last_ranking
+
+    def publish_if_due(self, execution_id: str) -> Optional[List[dict]]:
+        """Rank and publish the current top-k, if the publish interval has elapsed since the last
+        publication. The ranking is written to file and the top entity is logged.
+
+        Args:
+            execution_id (str): id of the current execution
+
+        Returns:
+            Optional[List[dict]]: the published ranking, or None if not due yet
+        """
+        now = time.monotonic()
+        if now - self.last_publish_time < self.publish_interval:
+            return None
+        self.last_publish_time = now
+
+        top_rankings = self.rank()
+        write_results_to_file(top_rankings, 'entities-ranking-online', execution_id)
+        if len(top_rankings) > 0:
+            top_properties = top_rankings[0]['properties']
+            sfl_logger.logger.info('Online ranking: most suspicious entity is %s-"%s" with %f.',
+                                   top_properties['parent_name'], top_properties['name'],
+                                   top_rankings[0]['entity_rank'])
+        return top_rankings
@@ -0,0 +1,265 @@
+from enum import Enum
+import random
+from typing import Any, List, Optional, Tuple
+
+from sfldebug.entity import Entity
+from sfldebug.lazy import LazyReference
+
+# maximum number of references kept per entity, with a bounded retention policy
+DEFAULT_MAX_REFERENCES = 100
+
+# log levels of the references kept preferentially by RetentionPolicy.ERROR
+ERROR_LOG_LEVELS = ('ERROR', 'FATAL')
+
+
+def is_error_log_level(log_level: Any) -> bool:
+    """Check if the log level of a method log is an error level.
+
+    Args:
+        log_level (Any): log level of the log
+
+    Returns:
+        bool: True if the log level is in ERROR_LOG_LEVELS
+    """
+    return isinstance(log_level, str) and log_level.upper() in ERROR_LOG_LEVELS
+
+
+def is_error_http_code(http_code: Any) -> bool:
+    """Check if the HTTP code of a service log is a server error.
+
+    Args:
+        http_code (Any): HTTP code of the log
+
+    Returns:
+        bool: True if the HTTP code is 500 or above
+    """
+    return isinstance(http_code, int) and http_code >= 500
+
+
+def is_error_reference(reference: Any) -> bool:
+    """Check if a reference comes from an error log: a method log with an error level, or a service
+    log with a server error HTTP code. Lazy references keep the check from when they were parsed.
+
+    Args:
+        reference (Any): reference to an entity
+
+    Returns:
+        bool: True if the reference comes from an error log
+    """
+    if isinstance(reference, LazyReference):
+        # checked when parsed, the log is not read again
+        return reference.error
+    return is_error_log_level(reference.get('log_level')) or \
+        is_error_http_code(reference.get('http_code'))
+
+
+class RetentionPolicy(str, Enum):
+    """Enum for the reference retention policies.
+    Each policy decides which references an entity keeps once it holds the maximum number of
+    references. The references dropped are still counted, so the executions of each entity are not
+    changed.
+
+    Policies:
+        ALL: keeps all the references
+        FIRST: keeps the first references
+        LAST: keeps the last references
+        RESERVOIR: keeps a uniform sample of the references (reservoir sampling)
+        ERROR: keeps the first references, replacing the non error references by error references
+    """
+    ALL = 'ALL'
+    FIRST = 'FIRST'
+    LAST = 'LAST'
+    RESERVOIR = 'RESERVOIR'
+    ERROR = 'ERROR'
+
+
+class ReferenceRetention:
+    """Bounded retention of the references of each entity.
+    The references are offered one by one to the entity, which keeps them until it holds the
+    maximum number of references. Then, the policy chooses whether the new reference replaces one
+    of the kept references or is dropped.
+    The request ids of the dropped references are kept, and the dropped references are counted on
+    the entity, so the number of unique executions and of references are not changed.
+
+    Args:
+        policy (RetentionPolicy): policy to choose the references kept (default
+        RetentionPolicy.RESERVOIR)
+        max_references (int): maximum number of references kept per entity (default
+        DEFAULT_MAX_REFERENCES)
+        seed (Optional[int]): seed of the random sampling of RetentionPolicy.RESERVOIR
+        (default None)
+    """
+
+    def __init__(
+        self,
+        policy: RetentionPolicy = RetentionPolicy.RESERVOIR,
+        max_references: int = DEFAULT_MAX_REFERENCES,
+        seed: Optional[int] = None
+    ) -> None:
+        self.policy = policy
+        self.max_references = max_references
+        self.random = random.Random(seed)
+
+    def retain(self, entity: Entity) -> None:
+        """Apply the retention to the references of an entity, usually a newly stored entity.
+
+        Args:
+            entity (Entity): entity to keep the references of
+        """
+        if self.policy == RetentionPolicy.ALL or entity.retained_references is not None:
+            return
+        references = entity.references
+        entity.references = {}
+        entity.retained_references = []
+        for request_id, request_references in references.items():
+            self.offer_references(entity, request_id, request_references)
+
+    def merge(self, stored_entity: Entity, entity: Entity) -> None:
+        """Merge the references of an entity into the stored entity of the same unique entity,
+        under the retention policy. The children names and dropped references are merged too.
+
+        Args:
+            stored_entity (Entity): entity to merge into, the stored entity
+            entity (Entity): entity to be merged
+        """
+        if self.policy == RetentionPolicy.ALL:
+            Entity.merge_references(stored_entity.references, entity.references)
+        elif self.policy == RetentionPolicy.RESERVOIR and entity.dropped_references > 0:
+            self.merge_reservoirs(stored_entity, entity)
+        else:
+            self.retain(stored_entity)
+            for request_id, request_references in entity.references.items():
+                self.offer_references(stored_entity, request_id, request_references)
+        stored_entity.children_names.update(entity.children_names)
+        stored_entity.dropped_references += entity.dropped_references
+        stored_entity.dropped_detached_executions += entity.dropped_detached_executions
+
+    def merge_reservoirs(self, stored_entity: Entity, entity: Entity) -> None:
+        """Merge the reservoir of an entity that dropped references, e.g. the entity of another
+        partial aggregation, into the reservoir of the stored entity.
+        Each kept reference of a reservoir stands for all the references it has seen, so the
+        references of the other entity cannot be offered one by one. The number of references
+        kept from each reservoir is drawn in proportion to the references they have seen, kept
+        plus dropped, and that number of kept references is sampled from each reservoir. The
+        merged reservoir is a uniform sample of the references seen by both.
+        The references not kept are counted as dropped on the stored entity.
+
+        Args:
+            stored_entity (Entity): entity to merge into, the stored entity
+            entity (Entity): entity to be merged, with its references already retained
+        """
+        self.retain(stored_entity)
+        stored_retained: List[Tuple[str, Any]] = stored_entity.retained_references  # type: ignore
+        retained = [(request_id, reference)
+                    for request_id, request_references in entity.references.items()
+                    for reference in request_references]
+        stored_seen = len(stored_retained) + stored_entity.dropped_references
+        seen = len(retained) + entity.dropped_references
+
+        # hypergeometric draw of the references kept from the stored reservoir
+        n_kept = min(self.max_references, stored_seen + seen)
+        n_stored_kept = 0
+        for _ in range(n_kept):
+            if self.random.randrange(stored_seen + seen) < stored_seen:
+                n_stored_kept += 1
+                stored_seen -= 1
+            else:
+                seen -= 1
+
+        stored_kept = set(self.random.sample(range(len(stored_retained)), n_stored_kept))
+        for index in reversed(range(len(stored_retained))):
+            if index not in stored_kept:
+                self.evict(stored_entity, index)
+        kept = set(self.random.sample(range(len(retained)), n_kept - n_stored_kept))
+        for request_id in entity.references:
+            # the request is kept even if all of its references are dropped
+            stored_entity.references.setdefault(request_id, [])
+        for index, (request_id, reference) in enumerate(retained):
+            if index in kept:
+                self.keep(stored_entity, request_id, reference)
+            else:
+                self.drop(stored_entity, request_id)
+
+    def offer_references(
+        self,
+        entity: Entity,
+        request_id: str,
+        references: List[Any]
+    ) -> None:
+        """Offer the references of a request to an entity, one by one.
+
+        Args:
+            entity (Entity): entity to keep the references in
+            request_id (str): request id of the references
+            references (List[Any]): references of the request
+        """
+        # the request is kept even if all of its references are dropped
+        entity.references.setdefault(request_id, [])
+        for reference in references:
+            self.offer(entity, request_id, reference)
+
+    def offer(
+        self,
+        entity: Entity,
+        request_id: str,
+        reference: Any
+    ) -> None:
+        """Offer a reference to an entity. The entity keeps it if it is not full. Otherwise, the
+        policy chooses the reference to be dropped, the new one or one of the kept ones.
+
+        Args:
+            entity (Entity): entity to keep the reference in
+            request_id (str): request id of the reference
+            reference (Any): reference to be kept
+        """
+        retained: List[Tuple[str, Any]] = entity.retained_references  # type: ignore
+        if len(retained) < self.max_references:
+            self.keep(entity, request_id, reference)
+            return
+
+        if self.policy == RetentionPolicy.LAST:
+            self.evict(entity, 0)
+            self.keep(entity, request_id, reference)
+        elif self.policy == RetentionPolicy.RESERVOIR:
+            # the new reference is kept with probability max_references / references seen
+            index = self.random.randrange(len(retained) + entity.dropped_references + 1)
+            if index < len(retained):
+                self.evict(entity, index)
+                self.keep(entity, request_id, reference)
+            else:
+                self.drop(entity, request_id)
+        elif self.policy == RetentionPolicy.ERROR and is_error_reference(reference):
+            index = next((index for index, (_, kept_reference) in enumerate(retained)
+                          if not is_error_reference(kept_reference)), None)
+            if index is None:
+                self.drop(entity, request_id)
+            else:
+                self.evict(entity, index)
+                self.keep(entity, request_id, reference)
+        else:
+            self.drop(entity, request_id)
+
+    @classmethod
+    def keep(cls, entity: Entity, request_id: str, reference: Any) -> None:
+        """Keep a reference in the entity, as the most recent reference kept."""
+        entity.references[request_id].append(reference)
+        entity.retained_references.append((request_id, reference))  # type: ignore
+
+    @classmethod
+    def evict(cls, entity: Entity, index: int) -> None:
+        """Drop one of the references kept in the entity, by its position in the kept references.
+        """
+        request_id, reference = entity.retained_references.pop(index)  # type: ignore
+        request_references = entity.references[request_id]
+        for position, kept_reference in enumerate(request_references):
+            if kept_reference is reference:
+                del request_references[position]
+                break
+        cls.drop(entity, request_id)
+
+    @classmethod
+    def drop(cls, entity: Entity, request_id: str) -> None:
+        """Count a reference of the entity as dropped."""
+        entity.dropped_references += 1
+        if request_id == 'default':
+            entity.dropped_detached_executions += 1
@@ -0,0 +1,322 @@
+import json
+from typing import Any, Callable, List, Optional, Set
+
+from sfldebug.entity import Entity, EntityType, MethodReference, Reference, ServiceReference
+from sfldebug.lazy import LazyReference
+from sfldebug.messages.decoder import LOG_TEMPLATE_FIELDS
+from sfldebug.retention import is_error_http_code, is_error_log_level
+from sfldebug.symbols import symbols
+import sfldebug.tools.logger as sfl_logger
+
+# reference records each entity level can build, by name
+REFERENCE_TYPES: dict[str, type] = {
+    'SERVICE': ServiceReference,
+    'METHOD': MethodReference
+}
+
+# entities built from each log, mapped onto the fields of the log template
+# (microservices-log-processor/log-template.json). Nested fields are separated by dots.
+# Each level builds an entity, named by the 'name' field, with a reference of the 'reference' type
+# filled from the 'fields'. Levels with a parent are built only with their parent, and 'child'
+# levels are added to the children of their parent, which is weighted by them in the analysis.
+ENTITY_SCHEMA: dict[str, Any] = {
+    'request_id': 'correlationID',
+    'levels': [
+        {
+            'entity_type': 'SERVICE',
+            'name': 'microserviceName',
+            'reference': 'SERVICE',
+            'fields': {
+                'endpoint': 'endpoint',
+                'instance_ip': 'instanceIP',
+                'span_id': 'spanID',
+                'parent_span_id': 'parentSpanID',
+                'http_code': 'httpCode',
+                'user': 'user',
+                'timestamp': 'timestamp'
+            }
+        },
+        {
+            'entity_type': 'METHOD',
+            'name': 'methodInvocation.methodName',
+            'parent': 'SERVICE',
+            'child': True,
+            'reference': 'METHOD',
+            'fields': {
+                'timestamp': 'timestamp',
+                'log_level': 'logLevel',
+                'message': 'message',
+                'method_invocation': 'methodInvocation'
+            }
+        }
+    ]
+}
+
+# extra entity levels, ranked on their own next to the services and methods
+ENDPOINT_LEVEL: dict[str, Any] = {
+    'entity_type': 'ENDPOINT',
+    'name': 'endpoint',
+    'parent': 'SERVICE',
+    'reference': 'SERVICE',
+    'fields': ENTITY_SCHEMA['levels'][0]['fields']
+}
+INSTANCE_LEVEL: dict[str, Any] = {
+    'entity_type': 'INSTANCE',
+    'name': 'instanceIP',
+    'parent': 'SERVICE',
+    'reference': 'SERVICE',
+    'fields': ENTITY_SCHEMA['levels'][0]['fields']
+}
+
+
+def load_entity_schema(schema_path: str) -> dict[str, Any]:
+    """Read an entity schema file, in the format of ENTITY_SCHEMA.
+
+    Args:
+        schema_path (str): path of the entity schema file, in json format
+
+    Returns:
+        dict[str, Any]: the entity schema
+    """
+    with open(schema_path, 'r', encoding='utf-8') as schema_file:
+        return json.load(schema_file)
+
+
+def has_template_field(path: str, template_fields: dict[str, Optional[dict]]) -> bool:
+    """Check if a field, separated by dots if nested, is present in the template fields.
+
+    Args:
+        path (str): path of the field
+        template_fields (dict[str, Optional[dict]]): fields of the log template
+
+    Returns:
+        bool: True if the field is in the template
+    """
+    fields: Optional[dict] = template_fields
+    for field in path.split('.'):
+        if fields is None or field not in fields:
+            return False
+        fields = fields[field]
+    return True
+
+
+def validate_entity_schema(
+    schema: dict[str, Any],
+    template_fields: dict[str, Optional[dict]] = LOG_TEMPLATE_FIELDS
+) -> None:
+    """Check an entity schema against the log template and the reference records.
+
+    Args:
+        schema (dict[str, Any]): entity schema, in the format of ENTITY_SCHEMA
+        template_fields (dict[str, Optional[dict]], optional): fields of the log template. Defaults
+        to LOG_TEMPLATE_FIELDS.
+
+    Raises:
+        ValueError: if the schema has unknown fields, entity types, references or parents, or if
+        the first level has a parent
+    """
+    paths = [schema['request_id']]
+    entity_types: Set[str] = set()
+    for index, level in enumerate(schema['levels']):
+        entity_type = level['entity_type']
+        if entity_type not in EntityType.__members__:
+            raise ValueError('Unknown entity type "{}".'.format(entity_type))
+        if level['reference'] not in REFERENCE_TYPES:
+            raise ValueError('Unknown reference "{}" of level "{}".'.format(
+                level['reference'], entity_type))
+        parent = level.get('parent')
+        if (index == 0) != (parent is None) or (parent is not None and
+                                                parent not in entity_types):
+            raise ValueError('Level "{}" must have a parent among the previous levels, except '
+                             'the first level.'.format(entity_type))
+        reference_fields = REFERENCE_TYPES[level['reference']].__slots__
+        for attribute in level['fields']:
+            if attribute not in reference_fields or attribute == 'request_id':
+                raise ValueError('Unknown field "{}" of reference "{}".'.format(
+                    attribute, level['reference']))
+        entity_types.add(entity_type)
+        paths.append(level['name'])
+        paths.extend(level['fields'].values())
+
+    for path in paths:
+        if not has_template_field(path, template_fields):
+            raise ValueError('Field "{}" is not in the log template.'.format(path))
+
+
+class EntityExtractor:
+    """Extractor of the entities of a log, compiled from an entity schema.
+    The schema is translated into the source of a single function, specialized for its levels and
+    fields, which builds the entities of a decoded log without looking up the schema again.
+    Reproduces build_entity with the default schema.
+    A lazy extractor builds lazy references instead, pointing to the line of the log in its file.
+    It only reads the fields of the names, the request id and the fields that tell whether the log
+    is an error log (see sfldebug.retention.is_error_reference), and is called with the log and
+    the source, offset and length of its line.
+
+    Args:
+        schema (dict[str, Any]): entity schema, in the format of ENTITY_SCHEMA
+        (default ENTITY_SCHEMA)
+        lazy (bool): if True, the entities are built with lazy references (default False)
+
+    Raises:
+        ValueError: if the schema is not valid
+    """
+
+    def __init__(self, schema: dict[str, Any] = ENTITY_SCHEMA, lazy: bool = False) -> None:
+        validate_entity_schema(schema)
+        self.schema = schema
+        self.lazy = lazy
+        self.source = self.generate_source()
+        namespace: dict[str, Any] = {'Entity': Entity, 'EntityType': EntityType,
+                                     'LazyReference': LazyReference,
+                                     'is_error_log_level': is_error_log_level,
+                                     'is_error_http_code': is_error_http_code,
+                                     'symbols': symbols, 'logger': sfl_logger.logger}
+        namespace.update({reference_type.__name__: reference_type
+                          for reference_type in REFERENCE_TYPES.values()})
+        exec(compile(self.source, '<entity extractor>', 'exec'),  # pylint: disable=exec-used
+             namespace)
+        self.extract: Callable[..., Set[Entity]] = namespace['extract_entities']
+
+    def __call__(self, log_data: Any, *location: Any) -> Set[Entity]:
+        return self.extract(log_data, *location)
+
+    def generate_source(self) -> str:
+        """Generate the source of the extractor function from the schema.
+
+        Returns:
+            str: source of the 'extract_entities' function
+        """
+        levels = self.schema['levels']
+        lines = ['def extract_entities(log_data, source, offset, length):' if self.lazy else
+                 'def extract_entities(log_data):',
+                 '    get = log_data.get',
+                 '    request_id = get({!r})'.format(self.schema['request_id']),
+                 '    if request_id is None:',
+                 '        request_id = "default"',
+                 '    request_key = symbols.canonical(request_id)',
+                 '    entities = []']
+        # fields checked by is_error_reference, the only fields of the references read when lazy
+        error_checks = {'log_level': 'is_error_log_level', 'http_code': 'is_error_http_code'}
+
+        def reference_paths(level: dict[str, Any]) -> List[str]:
+            return [path for attribute, path in level['fields'].items()
+                    if not self.lazy or attribute in error_checks]
+
+        # nested objects of the log are read once
+        objects = sorted({path.split('.')[0] for level in levels
+                          for path in [level['name'], *reference_paths(level)] if '.' in path})
+        for index, field in enumerate(objects):
+            lines.append('    object_{} = get({!r})'.format(index, field))
+            lines.append('    if not isinstance(object_{0}, dict):'.format(index))
+            lines.append('        object_{} = None'.format(index))
+
+        def value_source(path: str) -> str:
+            if '.' not in path:
+                return 'get({!r})'.format(path)
+            field, nested_field = path.split('.', 1)
+            object_name = 'object_{}'.format(objects.index(field))
+            return '({0}.get({1!r}) if {0} is not None else None)'.format(object_name,
+                                                                           nested_field)
+
+        def reference_source(level: dict[str, Any]) -> str:
+            if self.lazy:
+                error = ' or '.join('{}({})'.format(check, value_source(level['fields'][attribute]))
+                                    for attribute, check in error_checks.items()
+                                    if attribute in level['fields'])
+                return 'LazyReference(source, offset, length, EntityType.{}, {})'.format(
+                    level['entity_type'], error or 'False')
+            reference_type = REFERENCE_TYPES[level['reference']]
+            arguments = ['request_id=request_id'] + [
+                '{}={}'.format(attribute, value_source(level['fields'][attribute])
+                               if attribute in level['fields'] else 'None')
+                for attribute in reference_type.__slots__ if attribute != 'request_id']
+            return '{}({})'.format(reference_type.__name__, ', '.join(arguments))
+
+        def level_source(index: int, indent: str) -> List[str]:
+            level = levels[index]
+            entity_type = level['entity_type']
+            entity = 'entity_{}'.format(index)
+            level_lines = [
+                '{}{} = Entity(name_{}, {{request_key: [{}]}}, EntityType.{})'.format(
+                    indent, entity, index, reference_source(level), entity_type)]
+            parent = level.get('parent')
+            if parent is not None:
+                parent_entity = 'entity_{}'.format(
+                    [other['entity_type'] for other in levels].index(parent))
+                level_lines.append('{}{}.parent_name = {}.name'.format(indent, entity,
+                                                                      parent_entity))
+                if level.get('child', False):
+                    level_lines.append('{}{}.children_names.add({}.name)'.format(
+                        indent, parent_entity, entity))
+            level_lines.append('{}entities.append({})'.format(indent, entity))
+            for child_index, child in enumerate(levels):
+                if child.get('parent') == entity_type:
+                    level_lines.extend(child_source(child_index, indent))
+            return level_lines
+
+        def child_source(index: int, indent: str) -> List[str]:
+            level = levels[index]
+            name_path = level['name']
+            child_lines = ['{}name_{} = {}'.format(indent, index, value_source(name_path))]
+            if '.' in name_path:
+                # the level is logged if its object is, a missing name is reported
+                object_name = 'object_{}'.format(objects.index(name_path.split('.')[0]))
+                child_lines.extend([
+                    '{}if {} is not None and name_{} is None:'.format(indent, object_name, index),
+                    '{}    logger.warning("Missing {} in request \\"%s\\". Skipping {} entity '
+                    'creation.", request_id)'.format(indent, name_path, level['entity_type'])])
+            child_lines.append('{}if name_{} is not None:'.format(indent, index))
+            child_lines.extend(level_source(index, indent + '    '))
+            return child_lines
+
+        root = levels[0]
+        lines.extend([
+            '    name_0 = {}'.format(value_source(root['name'])),
+            '    if name_0 is None:',
+            '        logger.warning("Required {} is missing. Skipping {} entity creation.")'.format(
+                root['name'], root['entity_type']),
+            '        return set()'])
+        lines.extend(level_source(0, '    '))
+        lines.append('    return set(entities)')
+        return '\n'.join(lines) + '\n'
+
+
+def with_entity_levels(
+    schema: dict[str, Any],
+    extra_levels: List[dict[str, Any]]
+) -> dict[str, Any]:
+    """Get a copy of an entity schema with extra entity levels.
+
+    Args:
+        schema (dict[str, Any]): entity schema, in the format of ENTITY_SCHEMA
+        extra_levels (List[dict[str, Any]]): levels to be added, e.g. ENDPOINT_LEVEL
+
+    Returns:
+        dict[str, Any]: the entity schema with the extra levels
+    """
+    return dict(schema, levels=[*schema['levels'], *extra_levels])
+
+
+def reference_from_entities(entities: Set[Entity], entity_type: EntityType) -> Reference:
+    """Get the reference of the entity of a type, from the entities of a log.
+
+    Args:
+        entities (Set[Entity]): entities extracted from a log
+        entity_type (EntityType): type of the entity
+
+    Raises:
+        ValueError: if there is no entity of the type
+
+    Returns:
+        Reference: the reference of the entity
+    """
+    for entity in entities:
+        if entity.entity_type == entity_type:
+            return next(iter(entity.references.values()))[0]
+    raise ValueError('No {} entity in the log.'.format(entity_type.value))
+
+
+# extractors used by the parser, compiled from the default schema
+entity_extractor = EntityExtractor()
+lazy_entity_extractor = EntityExtractor(lazy=True)
@@ -1,64 +1,108 @@
-from functools import cmp_to_key
-from typing import List
+from typing import List, Optional, Tuple
 
-from sfldebug.tools.ranking_metrics import RankingMetrics, normalize_rankings
+import numpy as np
+
+from sfldebug.tools.ranking_metrics import RankingMetrics, get_metrics_rankings, \
+    get_spectra_array, get_unique_spectra, rank_spectra
 from sfldebug.tools.ranking_merge import RankMergeOperator
+from sfldebug.tools.instrumentation import instrumented
 import sfldebug.tools.logger as sfl_logger
-from sfldebug.tools.object import cmp_entities
 
+# number of most suspicious entities returned and written by a run, the ones looked into when
+# debugging
+DEFAULT_TOP_K = 50
 
-def rank_entities(
-    entities_analytics: List[dict],
-    ranking_metrics: List[RankingMetrics],
-    ranking_merge_op: RankMergeOperator
-) -> List[dict]:
-    """Ranks entities using the metrics passed as arguments.
-    For each metric, the rankings are calculated and then normalized, if needed.
-    For each entity, the rankings are merged according to the operator passed as argument.
-    Return a list of entities final rankings and its properties.
+
+def unpack_entities_analytics(
+    entities_analytics: dict[int, dict]
+) -> Tuple[List[dict], np.ndarray, np.ndarray]:
+    """Unpack the analytics of the entities into a list, with the array of their keys and their
+    spectra array, in the same order.
 
     Args:
-        entities_analytics (List[dict]): list of analytics and properties for each entity
-        ranking_metrics (List[RankingMetrics]): list of ranking metric to rank each entity
-        ranking_merge_op (RankMergeOperator): operator to merge the rankings of each entity
+        entities_analytics (dict[int, dict]): analytics of each entity, indexed by the entity key
 
     Returns:
-        List[dict]: list of final rankings for each entity and its properties
+        Tuple[List[dict], np.ndarray, np.ndarray]: analytics of each entity, key of each entity
+        and counters of each entity (rows), in the order of SPECTRA_FIELDS
     """
-    metrics_rankings = dict(
-        zip(ranking_metrics, [[] for i in ranking_metrics]))
-    for metric in ranking_metrics:
-
-        metric_rankings = [metric(entity)
-                           for entity in entities_analytics]
-
-        metric_rankings = normalize_rankings(metric_rankings, metric)
-
-        metrics_rankings[metric] = metric_rankings
+    entities_analytics_unpacked = list(entities_analytics.values())
+    entities_keys = np.fromiter(entities_analytics.keys(), dtype=np.uint64,
+                                count=len(entities_analytics))
+    return (entities_analytics_unpacked, entities_keys,
+            get_spectra_array(entities_analytics_unpacked))
+
+
+def select_top_rankings(
+    entities_ranks: np.ndarray,
+    entities_keys: np.ndarray,
+    top_k: Optional[int] = None
+) -> np.ndarray:
+    """Select the entities with the highest rankings, in descending order of ranking.
+    Entities with the same ranking are ordered by their key, so the order does not depend on the
+    order the entities were received in, and the top-k is always the start of the full ranking.
+    With top-k, only the entities ranked at least as the k-th highest ranking are sorted, selected
+    with a partition of the rankings instead of sorting all of them.
 
-    sfl_logger.logger.debug('Merging ranking using operator: "%s".',
-                            ranking_merge_op.name)
-    entities_rankings = []
-    for index, entity_analytics in enumerate(entities_analytics):
+    Args:
+        entities_ranks (np.ndarray): final ranking of each entity
+        entities_keys (np.ndarray): key of each entity
+        top_k (Optional[int], optional): number of entities to be selected. Defaults to None, all
+        the entities are selected.
 
-        entity_rankings = [rank_list[index]
-                           for rank_list in metrics_rankings.values()]
+    Returns:
+        np.ndarray: indexes of the selected entities, from the most to the least suspicious
+    """
+    n_entities = len(entities_ranks)
+    if top_k is not None and top_k <= 0:
+        return np.empty(0, dtype=np.intp)
+
+    if top_k is not None and top_k < n_entities:
+        kth_rank = np.partition(entities_ranks, n_entities - top_k)[n_entities - top_k]
+        candidates = np.flatnonzero(entities_ranks >= kth_rank)
+    else:
+        candidates = np.arange(n_entities)
+    order = np.lexsort((entities_keys[candidates], -entities_ranks[candidates]))
+    return candidates[order[:top_k]]
+
+
+def get_entities_ranking(
+    entities_ranks: np.ndarray,
+    entities_keys: np.ndarray,
+    entities_analytics: List[dict],
+    top_k: Optional[int] = None
+) -> List[dict]:
+    """Build the ranking of the entities with the highest rankings, in descending order, with
+    their properties.
 
-        entities_rankings.append(
-            {'entity_rank': ranking_merge_op(entity_rankings),
-             'properties': entity_analytics['properties']})
+    Args:
+        entities_ranks (np.ndarray): final ranking of each entity
+        entities_keys (np.ndarray): key of each entity
+        entities_analytics (List[dict]): list of analytics and properties for each entity
+        top_k (Optional[int], optional): number of entities in the ranking. Defaults to None, all
+        the entities are ranked.
 
-    return entities_rankings
+    Returns:
+        List[dict]: list of entities ranked by fault location probability, in descending order
+    """
+    top_entities = select_top_rankings(entities_ranks, entities_keys, top_k)
+    return [{'entity_rank': entity_rank, 'properties': entities_analytics[index]['properties']}
+            for entity_rank, index in zip(entities_ranks[top_entities].tolist(),
+                                          top_entities.tolist())]
 
 
+@instrumented('rank')
 def rank(
-    entities_analytics: dict[str, dict],
+    entities_analytics: dict[int, dict],
     ranking_metrics: List[RankingMetrics],
-    ranking_merge_op: RankMergeOperator = RankMergeOperator.AVG
+    ranking_merge_op: RankMergeOperator = RankMergeOperator.AVG,
+    top_k: Optional[int] = None
 ) -> List[dict]:
     """Ranks all the entities, according to the analytics and the ranking metrics provided.
     Requires also a ranking merge operator to merge the results of different metrics.
     Returns a list of dict, each containing the entity id (key) and resulting ranking.
+    Entities with the same ranking are ordered by their key. With top-k, only the k most
+    suspicious entities are returned.
 
     Args:
         entities_analytics (dict): analytics of a entity, containing count of good and faulty
@@ -67,6 +111,8 @@ def rank(
         analytics
         ranking_merge_op (RankMergeOperator, optional): ranking merge operator to aggregate the
         metrics' rankings. Defaults to RankMergeOperator.AVG.
+        top_k (Optional[int], optional): number of most suspicious entities to be returned.
+        Defaults to None, all the entities are returned.
 
     Returns:
         List[dict]: list of entities ranked by fault location probability, in descending order
@@ -74,13 +120,61 @@ def rank(
     sfl_logger.logger.info('Ranking entities using ranking metrics: %s.',
                            [metric.name for metric in ranking_metrics])
 
-    # unpack the values of each entity analytics into a list
-    entities_analytics_unpacked = list(entities_analytics.values())
-
-    entities_ranking = rank_entities(
-        entities_analytics_unpacked, ranking_metrics, ranking_merge_op)
+    entities_analytics_unpacked, entities_keys, spectra = unpack_entities_analytics(
+        entities_analytics)
+    sfl_logger.logger.debug('Merging ranking using operator: "%s".',
+                            ranking_merge_op.name)
+    entities_ranks = rank_spectra(spectra, ranking_metrics, ranking_merge_op)
 
-    cmp_entity_rank = cmp_to_key(cmp_entities)
-    entities_ranking.sort(key=cmp_entity_rank)
-    sfl_logger.logger.info('Entities ranking and sorting complete.')
+    entities_ranking = get_entities_ranking(entities_ranks, entities_keys,
+                                            entities_analytics_unpacked, top_k)
+    sfl_logger.logger.info('Entities ranking and sorting complete. Ranked %d of %d entities.',
+                           len(entities_ranking), len(entities_analytics_unpacked))
     return entities_ranking
+
+
+@instrumented('rank')
+def rank_configurations(
+    entities_analytics: dict[int, dict],
+    configurations: List[Tuple[List[RankingMetrics], RankMergeOperator]],
+    top_k: Optional[int] = None
+) -> List[List[dict]]:
+    """Ranks all the entities with several configurations of ranking metrics and merge operator,
+    from the same analytics, e.g. to compare the configurations.
+    The spectra array is built and reduced to its unique rows once, each metric used by any of the
+    configurations ranks the unique rows once, and each configuration only merges the rankings of
+    its metrics.
+
+    Args:
+        entities_analytics (dict): analytics of a entity, containing count of good and faulty
+        executions and non-executions
+        configurations (List[Tuple[List[RankingMetrics], RankMergeOperator]]): ranking metrics and
+        ranking merge operator of each configuration
+        top_k (Optional[int], optional): number of most suspicious entities to be returned for each
+        configuration. Defaults to None, all the entities are returned.
+
+    Returns:
+        List[List[dict]]: list of entities ranked by fault location probability, in descending
+        order, for each configuration
+    """
+    ranking_metrics = list(dict.fromkeys(metric for configuration_metrics, _ in configurations
+                                         for metric in configuration_metrics))
+    sfl_logger.logger.info('Ranking entities in %d configurations using ranking metrics: %s.',
+                           len(configurations), [metric.name for metric in ranking_metrics])
+
+    entities_analytics_unpacked, entities_keys, spectra = unpack_entities_analytics(
+        entities_analytics)
+    unique_spectra, spectra_index = get_unique_spectra(spectra)
+    metrics_rankings = get_metrics_rankings(unique_spectra, ranking_metrics)
+    metrics_rows = {metric: row for row, metric in enumerate(ranking_metrics)}
+
+    configurations_rankings = []
+    for configuration_metrics, ranking_merge_op in configurations:
+        entities_ranks = ranking_merge_op.batch(
+            metrics_rankings[[metrics_rows[metric] for metric in configuration_metrics]]
+        )[spectra_index]
+        configurations_rankings.append(get_entities_ranking(
+            entities_ranks, entities_keys, entities_analytics_unpacked, top_k))
+    sfl_logger.logger.info('Entities ranking and sorting complete for %d configurations.',
+                           len(configurations))
+    return configurations_rankings
@@ -0,0 +1,134 @@
+import json
+import sys
+from typing import Iterable, List, Optional, Set
+
+from sfldebug.entity import Entity
+import sfldebug.messages.parse_message as pm
+from sfldebug.spectra import EntitySpectra
+import sfldebug.tools.logger as sfl_logger
+
+# version of the format of the shard files, checked when they are read
+SHARD_FORMAT_VERSION = 1
+
+# sides of the executions kept in each shard
+SHARD_SIDES = ('good', 'faulty')
+
+
+def build_shard(
+    received: dict,
+    good_entities_id: str,
+    faulty_entities_id: str,
+    execution_id: Optional[str] = None
+) -> dict[str, EntitySpectra]:
+    """Build a shard from the entities received in a node, e.g. by receive_file or receive_mq.
+    The entities of each side are summarized, if they are not summaries already. With an
+    execution id, their references are written to a reference store of the shard, in the results
+    of the execution.
+
+    Args:
+        received (dict): entities received, indexed by the good and faulty entities id
+        good_entities_id (str): id of the good entities in 'received'
+        faulty_entities_id (str): id of the faulty entities in 'received'
+        execution_id (Optional[str], optional): id of the execution the entities were received
+        in. Defaults to None, the references are not kept.
+
+    Returns:
+        dict[str, EntitySpectra]: summary of the entities of each side
+    """
+    shard: dict[str, EntitySpectra] = {}
+    for side, entities_id in zip(SHARD_SIDES, (good_entities_id, faulty_entities_id)):
+        entities: Set[Entity] | EntitySpectra = received[entities_id]
+        if isinstance(entities, EntitySpectra):
+            shard[side] = entities
+            continue
+        references_path = None
+        if execution_id is not None:
+            references_path = pm.write_entities_records(entities, side + '-shard', execution_id)
+        shard[side] = EntitySpectra.from_entities(entities, references_path)
+    return shard
+
+
+def write_shard(shard: dict[str, EntitySpectra], shard_path: str) -> None:
+    """Write a shard to file, in json format.
+    The references are not written, the shard keeps the paths of their reference stores.
+
+    Args:
+        shard (dict[str, EntitySpectra]): summary of the entities of each side
+        shard_path (str): path of the shard file
+    """
+    shard_json = {'version': SHARD_FORMAT_VERSION}
+    for side in SHARD_SIDES:
+        shard_json[side] = shard[side].to_dict()
+    with open(shard_path, 'w', encoding='utf-8') as shard_file:
+        json.dump(shard_json, shard_file)
+    sfl_logger.logger.info('Shard wrote to: %s.', shard_path)
+
+
+def read_shard(shard_path: str) -> dict[str, EntitySpectra]:
+    """Read a shard from file.
+
+    Args:
+        shard_path (str): path of the shard file
+
+    Raises:
+        ValueError: if the shard file has another format version
+
+    Returns:
+        dict[str, EntitySpectra]: summary of the entities of each side
+    """
+    with open(shard_path, 'r', encoding='utf-8') as shard_file:
+        shard_json = json.load(shard_file)
+    if shard_json.get('version') != SHARD_FORMAT_VERSION:
+        raise ValueError('Shard "{}" has format version {}, expected {}.'.format(
+            shard_path, shard_json.get('version'), SHARD_FORMAT_VERSION))
+    return {side: EntitySpectra.from_dict(shard_json[side]) for side in SHARD_SIDES}
+
+
+def merge_shards(shards: Iterable[dict[str, EntitySpectra]]) -> dict[str, EntitySpectra]:
+    """Merge shards into a single shard. The merge is associative, so shards can be merged in any
+    grouping, e.g. by intermediate coordinators, with the same result.
+
+    Args:
+        shards (Iterable[dict[str, EntitySpectra]]): shards to be merged
+
+    Returns:
+        dict[str, EntitySpectra]: the merged shard
+    """
+    merged_shard = {side: EntitySpectra() for side in SHARD_SIDES}
+    for shard in shards:
+        for side in SHARD_SIDES:
+            merged_shard[side].merge(shard[side])
+    return merged_shard
+
+
+def receive_shards(
+    good_entities_id: str,
+    faulty_entities_id: str,
+    execution_id: str,
+    shard_paths: List[str]
+) -> dict:
+    """Receives the entities from shard files, merged into the summaries of each side.
+    Can be used as the receiver method of run, fixing the shard paths, so the shards of several
+    nodes are analyzed and ranked as a single execution.
+
+    Args:
+        good_entities_id (str): id of the good entities in the returned dict
+        faulty_entities_id (str): id of the faulty entities in the returned dict
+        execution_id (str): id of the current execution (ignored)
+        shard_paths (List[str]): paths of the shard files
+
+    Returns:
+        dict: summary of the 'good' and 'faulty' entities
+    """
+    del execution_id  # the shards are already parsed
+    merged_shard = merge_shards(read_shard(shard_path) for shard_path in shard_paths)
+    sfl_logger.logger.info('Merged %d shards.', len(shard_paths))
+    return {good_entities_id: merged_shard['good'], faulty_entities_id: merged_shard['faulty']}
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print('Usage: python -m sfldebug.shards <merged shard path> <shard path>...')
+        sys.exit(1)
+    write_shard(merge_shards(read_shard(shard_path) for shard_path in sys.argv[2:]),
+                sys.argv[1])
@@ -0,0 +1,170 @@
+import json
+import os
+from typing import Iterable, List, Optional, Tuple
+
+from sfldebug.aggregator import EntityAggregator
+from sfldebug.entity import Entity, EntityType
+import sfldebug.tools.logger as sfl_logger
+
+
+class EntitySpectra:
+    """Compact and mergeable summary of the executions of a set of entities.
+    Keeps, for each unique entity, only what is needed to analyze its executions: identification,
+    children names, the request ids it is executed in, the number of executions without request id
+    and the number of references. The references themselves can be kept in reference stores, files
+    in the entities records format, and loaded only when needed (see load_stored_references).
+    Much cheaper to transfer between processes than the set of entities.
+
+    Params:
+        entities (dict[Tuple[str, EntityType, str], dict]): summary of each unique entity, indexed
+        by its aggregation key
+        references_paths (List[str]): paths of the reference stores of the entities
+    """
+
+    def __init__(self) -> None:
+        self.entities: dict[Tuple[str, EntityType, str], dict] = {}
+        self.references_paths: List[str] = []
+
+    def __len__(self) -> int:
+        return len(self.entities)
+
+    @classmethod
+    def from_entities(
+        cls,
+        entities: Iterable[Entity],
+        references_path: Optional[str] = None
+    ) -> 'EntitySpectra':
+        """Summarize a set of entities.
+
+        Args:
+            entities (Iterable[Entity]): entities to be summarized
+            references_path (Optional[str], optional): path of the reference store with the
+            references of the entities. Defaults to None.
+
+        Returns:
+            EntitySpectra: the summary of the entities
+        """
+        spectra = cls()
+        for entity in entities:
+            spectra.add_entity(entity)
+        if references_path is not None:
+            spectra.references_paths.append(references_path)
+        return spectra
+
+    def add_entity(self, entity: Entity) -> None:
+        """Add the executions of an entity to the summary.
+
+        Args:
+            entity (Entity): entity to be added
+        """
+        request_ids = entity.references.keys() - {'default'}
+        self.add_summary(EntityAggregator.aggregation_key(entity), {
+            'name': entity.name,
+            'entity_type': entity.entity_type,
+            'parent_name': entity.parent_name,
+            'children_names': set(entity.children_names),
+            'request_ids': set(request_ids),
+            'detached_executions': entity.get_detached_executions(),
+            'ref_count': entity.get_ref_count()
+        })
+
+    def add_summary(
+        self,
+        key: Tuple[str, EntityType, str],
+        summary: dict
+    ) -> None:
+        """Merge the summary of an entity into the summary of the same unique entity.
+
+        Args:
+            key (Tuple[str, EntityType, str]): aggregation key of the entity
+            summary (dict): summary of the entity executions
+        """
+        stored_summary = self.entities.get(key)
+        if stored_summary is None:
+            self.entities[key] = summary
+            return
+        stored_summary['children_names'].update(summary['children_names'])
+        stored_summary['request_ids'].update(summary['request_ids'])
+        stored_summary['detached_executions'] += summary['detached_executions']
+        stored_summary['ref_count'] += summary['ref_count']
+
+    def merge(self, other: 'EntitySpectra') -> None:
+        """Merge the summary of another set of entities into this one.
+        The merge is associative and commutative, except for the order of the reference stores,
+        and the other summary is left unchanged.
+
+        Args:
+            other (EntitySpectra): summary to be merged
+        """
+        for key, summary in other.entities.items():
+            if key not in self.entities:
+                summary = dict(summary, children_names=set(summary['children_names']),
+                               request_ids=set(summary['request_ids']))
+            self.add_summary(key, summary)
+        self.references_paths.extend(other.references_paths)
+
+    def to_dict(self) -> dict:
+        """Convert the summary into a dict that can be written in json format.
+
+        Returns:
+            dict: the summary of each entity and the paths of the reference stores
+        """
+        return {
+            'entities': [dict(summary, children_names=sorted(summary['children_names']),
+                              request_ids=sorted(summary['request_ids']))
+                         for summary in self.entities.values()],
+            'references_paths': list(self.references_paths)
+        }
+
+    @classmethod
+    def from_dict(cls, spectra_dict: dict) -> 'EntitySpectra':
+        """Build a summary from its dict, as converted by to_dict.
+
+        Args:
+            spectra_dict (dict): the summary of each entity and the paths of the reference stores
+
+        Returns:
+            EntitySpectra: the summary of the entities
+        """
+        spectra = cls()
+        for summary in spectra_dict['entities']:
+            entity_type = EntityType(summary['entity_type'])
+            spectra.add_summary((summary['name'], entity_type, summary['parent_name']),
+                                dict(summary, entity_type=entity_type,
+                                     children_names=set(summary['children_names']),
+                                     request_ids=set(summary['request_ids'])))
+        spectra.references_paths.extend(spectra_dict['references_paths'])
+        return spectra
+
+
+def load_stored_references(entities_properties: Iterable[dict]) -> None:
+    """Load the references of analyzed entities from the reference stores of their summaries,
+    listed in their 'references_paths' property, into their 'references' property. Meant for the
+    entities written in the results only: each reference store is read once, and only the
+    references of the given entities are kept. The reference stores not available, e.g. left in
+    the node a shard was parsed in, are skipped. Modifies the properties in place.
+
+    Args:
+        entities_properties (Iterable[dict]): properties of the analyzed entities
+    """
+    stores: dict[str, dict[Tuple[str, EntityType, str], List[dict]]] = {}
+    for properties in entities_properties:
+        references_paths = properties.pop('references_paths', None)
+        if not references_paths:
+            continue
+        key = (properties['name'], EntityType(properties['entity_type']),
+               properties['parent_name'])
+        for references_path in references_paths:
+            stores.setdefault(references_path, {}).setdefault(key, []).append(properties)
+
+    for references_path, entities in stores.items():
+        if not os.path.isfile(references_path):
+            sfl_logger.logger.warning('Reference store "%s" is not available. Skipping its '
+                                      'references.', references_path)
+            continue
+        with open(references_path, 'r', encoding='utf-8') as references_file:
+            records = json.load(references_file)
+        for record in records['entities']:
+            key = (record['name'], EntityType(record['entity_type']), record['parent_name'])
+            for properties in entities.get(key, ()):
+                Entity.merge_references(properties['references'], record['references'])
@@ -0,0 +1,94 @@
+from contextlib import contextmanager
+from typing import Iterator, List, Optional
+
+
+class SymbolTable:
+    """Table interning strings as dense integer ids (symbols).
+    Each distinct string is stored once, and is given the next id when first interned. The ids are
+    only valid in the process that interned them, so anything leaving the process (files, results,
+    pickled objects sent to other processes) must be resolved back into strings.
+    """
+
+    def __init__(self) -> None:
+        self.ids: dict[str, int] = {}
+        self.values: List[str] = []
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def __contains__(self, value: object) -> bool:
+        return value in self.ids
+
+    def intern(self, value: Optional[str]) -> Optional[int]:
+        """Get the id of a string, adding it to the table if not interned yet.
+
+        Args:
+            value (Optional[str]): string to be interned
+
+        Returns:
+            Optional[int]: the id of the string, or None if no string is given
+        """
+        if value is None:
+            return None
+        symbol = self.ids.get(value)
+        if symbol is None:
+            symbol = len(self.values)
+            self.ids[value] = symbol
+            self.values.append(value)
+        return symbol
+
+    def lookup(self, symbol: Optional[int]) -> Optional[str]:
+        """Get the string of an id.
+
+        Args:
+            symbol (Optional[int]): id of an interned string
+
+        Returns:
+            Optional[str]: the interned string, or None if no id is given
+        """
+        if symbol is None:
+            return None
+        return self.values[symbol]
+
+    def canonical(self, value: Optional[str]) -> Optional[str]:
+        """Get the interned string equal to the given one, so equal strings share the same object.
+
+        Args:
+            value (Optional[str]): string to be interned
+
+        Returns:
+            Optional[str]: the interned string, or None if no string is given
+        """
+        return self.lookup(self.intern(value))
+
+    def clear(self) -> None:
+        """Remove all the strings from the table. The ids given before are no longer valid."""
+        self.ids.clear()
+        self.values.clear()
+
+    def truncate(self, size: int) -> None:
+        """Remove the strings interned after the table had the given size. The ids given before
+        remain valid.
+
+        Args:
+            size (int): number of strings kept
+        """
+        for value in self.values[size:]:
+            del self.ids[value]
+        del self.values[size:]
+
+    @contextmanager
+    def scope(self) -> Iterator[None]:
+        """Context manager removing the strings interned inside it when it exits, e.g. for the
+        strings of a batch of messages that is not kept. The ids given before remain valid, but
+        the ids given inside must not be used after it exits.
+        """
+        size = len(self.values)
+        try:
+            yield
+        finally:
+            self.truncate(size)
+
+
+# table shared by the parser, entity and analytics modules
+symbols = SymbolTable()
@@ -0,0 +1,246 @@
+from contextlib import contextmanager
+import functools
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import sys
+import threading
+import time
+from typing import Any, Callable, Iterator, Optional, Tuple
+
+try:
+    import resource
+except ImportError:  # not available on Windows, the peak RSS is not recorded
+    resource = None
+
+import sfldebug.tools.logger as sfl_logger
+
+# port of the local endpoint exposing the metrics in Prometheus text format
+DEFAULT_METRICS_PORT = 9464
+
+# prefix of the names of the metrics exposed in Prometheus text format
+PROMETHEUS_PREFIX = 'sfldebug'
+
+
+def get_peak_rss() -> dict[str, int]:
+    """Get the peak resident set size of the process and of its finished child processes (e.g.
+    the receiving processes and the parsing workers), in bytes.
+
+    Returns:
+        dict[str, int]: peak RSS of the process ('self') and of its children ('children'), empty
+        if it cannot be measured
+    """
+    if resource is None:
+        return {}
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    unit = 1 if sys.platform == 'darwin' else 1024
+    return {'self': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit,
+            'children': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * unit}
+
+
+class StageMetrics:
+    """Performance metrics of the stages of the tool: receiving, parsing, analysis, ranking and
+    writing of the results.
+    Each stage records its calls, wall and CPU time, and counters of what it processed (e.g.
+    messages, entities, references). The throughput of the stages that count messages is derived
+    from their wall time.
+    The CPU time is the CPU time of the process, so it does not include the child processes. The
+    stages recorded in worker processes are merged with their own times (see
+    call_recording_metrics), summed over the workers.
+
+    Params:
+        stages (dict[str, dict[str, Any]]): metrics of each stage, indexed by the stage name
+    """
+
+    def __init__(self) -> None:
+        self.stages: dict[str, dict[str, Any]] = {}
+        self.lock = threading.Lock()
+
+    def get_stage(self, name: str) -> dict[str, Any]:
+        """Get the metrics of a stage, created empty if not recorded yet."""
+        stage = self.stages.get(name)
+        if stage is None:
+            stage = {'calls': 0, 'wall_time': 0.0, 'cpu_time': 0.0, 'counters': {}}
+            self.stages[name] = stage
+        return stage
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Context manager recording the wall and CPU time of a stage.
+        Nested stages are recorded in full, so the time of a stage can include the time of others.
+
+        Args:
+            name (str): name of the stage
+        """
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield
+        finally:
+            wall_time = time.perf_counter() - wall_start
+            cpu_time = time.process_time() - cpu_start
+            with self.lock:
+                stage = self.get_stage(name)
+                stage['calls'] += 1
+                stage['wall_time'] += wall_time
+                stage['cpu_time'] += cpu_time
+
+    def count(self, name: str, counter: str, value: int) -> None:
+        """Add to a counter of a stage.
+
+        Args:
+            name (str): name of the stage
+            counter (str): name of the counter, e.g. 'messages', 'entities' or 'references'
+            value (int): value to be added
+        """
+        with self.lock:
+            counters = self.get_stage(name)['counters']
+            counters[counter] = counters.get(counter, 0) + value
+
+    def merge(self, stages: dict[str, dict[str, Any]]) -> None:
+        """Add the metrics of stages recorded elsewhere, e.g. in a worker process, to the metrics
+        of the same stages.
+
+        Args:
+            stages (dict[str, dict[str, Any]]): metrics of each stage, indexed by the stage name
+        """
+        with self.lock:
+            for name, other_stage in stages.items():
+                stage = self.get_stage(name)
+                for field in ('calls', 'wall_time', 'cpu_time'):
+                    stage[field] += other_stage[field]
+                counters = stage['counters']
+                for counter, value in other_stage['counters'].items():
+                    counters[counter] = counters.get(counter, 0) + value
+
+    def clear(self) -> None:
+        """Clear the metrics of all the stages. Useful when running multiple scenarios in a row."""
+        with self.lock:
+            self.stages.clear()
+
+    def to_dict(self) -> dict[str, Any]:
+        """Get the metrics of all the stages, with the throughput of the stages counting messages,
+        and the peak RSS.
+
+        Returns:
+            dict[str, Any]: metrics of each stage and peak RSS, in bytes
+        """
+        with self.lock:
+            stages = {name: dict(stage, counters=dict(stage['counters']))
+                      for name, stage in self.stages.items()}
+        for stage in stages.values():
+            if 'messages' in stage['counters'] and stage['wall_time'] > 0:
+                stage['messages_per_second'] = stage['counters']['messages'] / stage['wall_time']
+        return {'stages': stages, 'peak_rss': get_peak_rss()}
+
+    def to_prometheus(self) -> str:
+        """Get the metrics of all the stages in Prometheus text exposition format.
+
+        Returns:
+            str: the metrics, one sample per line
+        """
+        metrics = self.to_dict()
+        lines = []
+        samples = [('stage_calls_total', 'counter', 'calls'),
+                   ('stage_wall_seconds_total', 'counter', 'wall_time'),
+                   ('stage_cpu_seconds_total', 'counter', 'cpu_time')]
+        for metric, metric_type, field in samples:
+            lines.append('# TYPE {}_{} {}'.format(PROMETHEUS_PREFIX, metric, metric_type))
+            for name, stage in metrics['stages'].items():
+                lines.append('{}_{}{{stage="{}"}} {}'.format(PROMETHEUS_PREFIX, metric, name,
+                                                           stage[field]))
+        lines.append('# TYPE {}_stage_processed_total counter'.format(PROMETHEUS_PREFIX))
+        for name, stage in metrics['stages'].items():
+            for counter, value in stage['counters'].items():
+                lines.append('{}_stage_processed_total{{stage="{}",counter="{}"}} {}'.format(
+                    PROMETHEUS_PREFIX, name, counter, value))
+        lines.append('# TYPE {}_peak_rss_bytes gauge'.format(PROMETHEUS_PREFIX))
+        for process, peak_rss in metrics['peak_rss'].items():
+            lines.append('{}_peak_rss_bytes{{process="{}"}} {}'.format(PROMETHEUS_PREFIX,
+                                                                       process, peak_rss))
+        return '\n'.join(lines) + '\n'
+
+
+# metrics of the stages, shared by the whole tool
+metrics = StageMetrics()
+
+
+def instrumented(name: str) -> Callable[[Callable], Callable]:
+    """Decorator recording the wall and CPU time of each call of a function as a stage.
+
+    Args:
+        name (str): name of the stage
+
+    Returns:
+        Callable[[Callable], Callable]: the decorator
+    """
+    def decorator(function: Callable) -> Callable:
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with metrics.stage(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def call_recording_metrics(
+    function: Callable,
+    *args: Any,
+    **kwargs: Any
+) -> Tuple[Any, dict[str, dict[str, Any]]]:
+    """Call a function in a worker process, and return its result with the metrics of the stages
+    it recorded, so they can be merged into the metrics of the parent process with
+    StageMetrics.merge. The metrics of the worker are cleared before the call, so each call
+    returns only its own.
+
+    Args:
+        function (Callable): function to be called, must be picklable
+        *args (Any): positional arguments of the function
+        **kwargs (Any): keyword arguments of the function
+
+    Returns:
+        Tuple[Any, dict[str, dict[str, Any]]]: the result of the function and the metrics of each
+        stage recorded by the call
+    """
+    metrics.clear()
+    result = function(*args, **kwargs)
+    return result, metrics.stages
+
+
+def start_metrics_server(port: int = DEFAULT_METRICS_PORT) -> ThreadingHTTPServer:
+    """Start a local HTTP endpoint exposing the metrics in Prometheus text format, served by a
+    daemon thread. Useful to follow long MQ runs.
+
+    Args:
+        port (int, optional): port of the endpoint, on localhost. Defaults to DEFAULT_METRICS_PORT.
+
+    Returns:
+        ThreadingHTTPServer: the server, to be shutdown with shutdown()
+    """
+    class MetricsHandler(BaseHTTPRequestHandler):
+        """Handler answering every GET request with the current metrics."""
+
+        def do_GET(self) -> None:  # pylint: disable=invalid-name
+            body = metrics.to_prometheus().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format: str, *args: Any) -> None:  # pylint: disable=redefined-builtin
+            del format, args  # the scrapes are not logged
+
+    server = ThreadingHTTPServer(('localhost', port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    sfl_logger.logger.info('Serving metrics on http://localhost:%d/metrics.', port)
+    return server
+
+
+def stop_metrics_server(server: Optional[ThreadingHTTPServer]) -> None:
+    """Stop a metrics endpoint started with start_metrics_server, if any.
+
+    Args:
+        server (Optional[ThreadingHTTPServer]): the server
+    """
+    if server is not None:
+        server.shutdown()
+        server.server_close()
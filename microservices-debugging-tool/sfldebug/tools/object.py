@@ -39,28 +39,6 @@ def extract_field(
     return None
 
 
-def merge_lists(
-    new_list: List[Any],
-    old_list: List[Any]
-) -> List[Any]:
-    """Merge lists without type checking the lists contents.
-
-    Args:
-        new_list (List[Any]): new list to be merged
-        old_list (List[Any]): old list to be merged
-
-    Returns:
-        List[Any]: merged list of list
-    """
-    if new_list is None:
-        return old_list
-    if old_list is None:
-        return new_list
-
-    merged_list = old_list + new_list
-    return merged_list
-
-
 def make_list(obj: Any) -> List[Any]:
     """Simple converter of a obj to obj list.
     If the obj is already list, returns itself.
@@ -81,24 +59,23 @@ def make_list(obj: Any) -> List[Any]:
     return [obj]
 
 
-def merge_into_list(
-    obj1: Any,
-    obj2: Any
+def extend_into_list(
+    target_list: List[Any],
+    obj: Any
 ) -> List[Any]:
-    """Merge two objects into a single list.
-    First convert each obj into a list and then merge them.
+    """Extend a list in place with an object.
+    First convert the obj into a list and then append its elements to the target list, in amortized
+    O(1) per element, instead of copying both lists into a new one.
 
     Args:
-        obj1 (Any): first object to be merged into list
-        obj2 (Any): second object to be merged into list
+        target_list (List[Any]): list to be extended
+        obj (Any): object to be appended to the list
 
     Returns:
-        List[Any]: list of the merged object lists
+        List[Any]: the extended target list
     """
-    obj1_list = make_list(obj1)
-    obj2_list = make_list(obj2)
-
-    return merge_lists(obj1_list, obj2_list)
+    target_list.extend(make_list(obj))
+    return target_list
 
 
 def cmp_entities(
@@ -1,6 +1,8 @@
 from enum import Enum
 from statistics import fmean, median
 
+import numpy as np
+
 
 class RankMergeOperator(Enum):
     """Enum for the ranking merge operators
@@ -17,5 +19,21 @@ class RankMergeOperator(Enum):
         'MEDIAN': median
     }
 
+    __BATCH_MERGE_OPS__ = {
+        'AVG': np.mean,
+        'MEDIAN': np.median
+    }
+
     def __call__(self, *args):
         return self.__MERGE_OPS__[self.value](*args)
+
+    def batch(self, rankings: np.ndarray) -> np.ndarray:
+        """Merge the rankings of all the entities at once.
+
+        Args:
+            rankings (np.ndarray): rankings of each metric (rows) for each entity (columns)
+
+        Returns:
+            np.ndarray: merged ranking of each entity
+        """
+        return self.__BATCH_MERGE_OPS__[self.value](rankings, axis=0)
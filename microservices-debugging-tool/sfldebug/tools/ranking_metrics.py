@@ -2,9 +2,15 @@ from enum import Enum
 import math
 from typing import List, Tuple
 
+import numpy as np
+
 from sfldebug.tools.object import extract_field
+from sfldebug.tools.ranking_merge import RankMergeOperator
 import sfldebug.tools.logger as sfl_logger
 
+# counters of the entity analytics, in the order of the columns of the spectra arrays
+SPECTRA_FIELDS = ['good_executed', 'good_passed', 'faulty_executed', 'faulty_passed']
+
 
 def __break_entity_analytics(entity_analytics: dict) -> Tuple[int, int, int, int]:
     """Breaks known dict values and returns them in a tuple shape.
@@ -251,6 +257,8 @@ def mccon(entity_analytics: dict) -> float:
 def dstar(entity_analytics: dict) -> float:
     """Dstar (D*) ranking metric.
     Manipulate 'star_factor' to increase suspiciouness weight on executions in faulty cases.
+    An entity executed in every faulty case and in no good case is the ideal fault, and is ranked
+    infinite (see normalize_rankings).
 
     W. E. Wong, V. Debroy, Y. Li and R. Gao. "Software Fault Localization Using DStar (D*)."
     2012 IEEE Sixth International Conference on Software Security and Reliability, 2012, pp. 21-30.
@@ -270,6 +278,8 @@ def dstar(entity_analytics: dict) -> float:
     numerator = star_factor * faulty_e
     denominator = faulty_p + good_e
 
+    if denominator == 0 and numerator > 0:
+        return math.inf
     return numerator / denominator
 
 
@@ -305,6 +315,120 @@ def minus(entity_analytics: dict) -> float:
     return first_part - second_part
 
 
+def __divide(numerator: np.ndarray, denominator: np.ndarray) -> np.ndarray:
+    """Element-wise division of arrays. Where the denominator is 0, the result is 0. In the
+    metrics divided with it, the numerator is 0 too where the denominator is 0 (e.g. Ochiai of an
+    entity never executed in faulty cases), and the entity is ranked with 0. D* handles its zero
+    denominators on its own.
+
+    Args:
+        numerator (np.ndarray): numerators of the division
+        denominator (np.ndarray): denominators of the division
+
+    Returns:
+        np.ndarray: resultant fractions
+    """
+    numerator, denominator = np.broadcast_arrays(np.asarray(numerator, dtype=np.float64),
+                                                 np.asarray(denominator, dtype=np.float64))
+    result = np.zeros(numerator.shape, dtype=np.float64)
+    np.divide(numerator, denominator, out=result, where=denominator != 0)
+    return result
+
+
+# Batch versions of the ranking metrics, computed over the arrays of the counters of all the
+# entities at once. Each takes the arrays of good executed, good passed, faulty executed and faulty
+# passed counters, and follows the operations of the metric above, so the rankings are equal.
+
+def tarantula_batch(good_e: np.ndarray, good_p: np.ndarray, faulty_e: np.ndarray,
+                    faulty_p: np.ndarray) -> np.ndarray:
+    """Tarantula ranking metric, over arrays (see tarantula)."""
+    faulty_fraction = __divide(faulty_e, faulty_e + faulty_p)
+    good_fraction = __divide(good_e, good_e + good_p)
+    return __divide(faulty_fraction, faulty_fraction + good_fraction)
+
+
+def jaccard_batch(good_e: np.ndarray, good_p: np.ndarray, faulty_e: np.ndarray,
+                  faulty_p: np.ndarray) -> np.ndarray:
+    """Jaccard ranking metric, over arrays (see jaccard)."""
+    del good_p
+    return __divide(faulty_e, faulty_e + faulty_p + good_e)
+
+
+def ochiai_batch(good_e: np.ndarray, good_p: np.ndarray, faulty_e: np.ndarray,
+                 faulty_p: np.ndarray) -> np.ndarray:
+    """Ochiai ranking metric, over arrays (see ochiai)."""
+    del good_p
+    return __divide(faulty_e, np.sqrt((faulty_e + faulty_p) * (faulty_e + good_e)))
+
+
+def zoltar_batch(good_e: np.ndarray, good_p: np.ndarray, faulty_e: np.ndarray,
+                 faulty_p: np.ndarray) -> np.ndarray:
+    """Zoltar ranking metric, over arrays (see zoltar)."""
+    del good_p
+    exoneration_factor = 10000
+    execution_factor = __divide(faulty_p*good_e, faulty_e)
+    return __divide(faulty_e,
+                    faulty_e + faulty_p + good_e + exoneration_factor*execution_factor)
+
+
+def op_metric_batch(good_e: np.ndarray, good_p: np.ndarray, faulty_e: np.ndarray,
+                    faulty_p: np.ndarray) -> np.ndarray:
+    """O^p ranking metric, over arrays (see op_metric)."""
+    del faulty_p
+    return faulty_e - __divide(faulty_e, good_e + good_p + 1)
+
+
+def o_metric_batch(good_e: np.ndarray, good_p: np.ndarray, faulty_e: np.ndarray,
+                   faulty_p: np.ndarray) -> np.ndarray:
+    """O ranking metric, over arrays (see o_metric)."""
+    del good_e, faulty_e
+    return np.where(faulty_p > 0, -1, good_p).astype(np.float64)
+
+
+def kulczynksi2_batch(good_e: np.ndarray, good_p: np.ndarray, faulty_e: np.ndarray,
+                      faulty_p: np.ndarray) -> np.ndarray:
+    """Kulczynski2 ranking metric, over arrays (see kulczynksi2)."""
+    del good_p
+    return 0.5 * (__divide(faulty_e, faulty_e + faulty_p) + __divide(faulty_e, faulty_e + good_e))
+
+
+def mccon_batch(good_e: np.ndarray, good_p: np.ndarray, faulty_e: np.ndarray,
+                faulty_p: np.ndarray) -> np.ndarray:
+    """Mccon ranking metric, over arrays (see mccon)."""
+    del good_p
+    return __divide(np.square(faulty_e) - faulty_p*good_e,
+                    (faulty_e + faulty_p) * (faulty_e + good_e))
+
+
+def dstar_batch(good_e: np.ndarray, good_p: np.ndarray, faulty_e: np.ndarray,
+                faulty_p: np.ndarray) -> np.ndarray:
+    """Dstar (D*) ranking metric, over arrays (see dstar)."""
+    del good_p
+    star_factor = 2
+    numerator = star_factor * faulty_e
+    denominator = faulty_p + good_e
+    # the ideal faults are ranked infinite, the entities never executed in faulty cases with 0
+    return np.where((denominator == 0) & (numerator > 0), np.inf,
+                    __divide(numerator, denominator))
+
+
+def minus_batch(good_e: np.ndarray, good_p: np.ndarray, faulty_e: np.ndarray,
+                faulty_p: np.ndarray) -> np.ndarray:
+    """Minus ranking metric, over arrays (see minus)."""
+    faulty_fraction = __divide(faulty_e, faulty_e + faulty_p)
+    good_fraction = __divide(good_e, good_e + good_p)
+
+    comp_faulty_fraction = 1 - faulty_fraction
+    comp_good_fraction = 1 - good_fraction
+
+    ranking = __divide(faulty_fraction, faulty_fraction + good_fraction) - \
+        __divide(comp_faulty_fraction, comp_faulty_fraction + comp_good_fraction)
+    # the second part is not 0 when the first cannot be computed, so the ranking is set to 0
+    computable = (faulty_e + faulty_p != 0) & (good_e + good_p != 0) & \
+        (faulty_fraction + good_fraction != 0) & (comp_faulty_fraction + comp_good_fraction != 0)
+    return np.where(computable, ranking, 0)
+
+
 class RankingMetrics(str, Enum):
     """Ranking metrics enum to easily access and add more ranking metrics.
     Each element refers to the ranking metric function.
@@ -333,16 +457,42 @@ class RankingMetrics(str, Enum):
         'MINUS': minus
     }
 
+    __BATCH_METRICS__ = {
+        'TARANTULA': tarantula_batch,
+        'JACCARD': jaccard_batch,
+        'OCHIAI': ochiai_batch,
+        'ZOLTAR': zoltar_batch,
+        'OP': op_metric_batch,
+        'O': o_metric_batch,
+        'KULCZYNSKI2': kulczynksi2_batch,
+        'MCCON': mccon_batch,
+        'DSTAR': dstar_batch,
+        'MINUS': minus_batch
+    }
+
     def __call__(self, *args):
         ranking = self.__METRICS__[self.value](*args)
         sfl_logger.logger.info('Calculated ranking using metric "%s" is: %f.',
                                 self.value, ranking)
         return ranking
 
+    def batch(self, spectra: np.ndarray) -> np.ndarray:
+        """Rank all the entities at once, from their spectra array.
+
+        Args:
+            spectra (np.ndarray): counters of each entity (rows), in the order of SPECTRA_FIELDS
+
+        Returns:
+            np.ndarray: ranking of each entity
+        """
+        return self.__BATCH_METRICS__[self.value](*spectra.T)
+
 
 def normalize_rankings(rankings: List[float], metric: RankingMetrics) -> List[float]:
     """Normalize a list of rankings of known metrics into a common probabilistic range, [0, 1].
     If the metric is already in that range, returns the rankings.
+    Infinite rankings, the ideal faults of D*, are ranked as twice the maximum finite ranking
+    before normalizing, so they are normalized to 1 and rank above every other entity.
 
     Args:
         rankings (List[float]): list of rankings to be normalized
@@ -357,6 +507,121 @@ def normalize_rankings(rankings: List[float], metric: RankingMetrics) -> List[fl
 
     # range is {-1} ^ [0, +N[ OR [-1, +N[ OR [0, +N[
     if metric in [RankingMetrics.O, RankingMetrics.OP, RankingMetrics.DSTAR]:
-        max_ranking = max(rankings)
+        max_ranking = max((rank for rank in rankings if rank != math.inf), default=0)
+        if math.inf in rankings:
+            max_ranking = 2*max_ranking if max_ranking > 0 else 1
+            rankings = [max_ranking if rank == math.inf else rank for rank in rankings]
         return [rank/max_ranking if rank != -1 else 0 for rank in rankings]
     return rankings
+
+
+def normalize_rankings_batch(rankings: np.ndarray, metric: RankingMetrics) -> np.ndarray:
+    """Normalize an array of rankings of known metrics into a common probabilistic range, [0, 1],
+    as normalize_rankings. If the maximum ranking is 0, the rankings are normalized to 0.
+    Infinite rankings, the ideal faults of D*, are ranked as twice the maximum finite ranking
+    before normalizing, as in normalize_rankings.
+
+    Args:
+        rankings (np.ndarray): array of rankings to be normalized
+        metric (RankingMetrics): type of metric the ranking is evaluated
+
+    Returns:
+        np.ndarray: the rankings normalized into the range [0, 1]
+    """
+    # range is [-1, 1]
+    if metric in [RankingMetrics.MCCON, RankingMetrics.MINUS]:
+        return (rankings + 1)/2
+
+    # range is {-1} ^ [0, +N[ OR [-1, +N[ OR [0, +N[
+    if metric in [RankingMetrics.O, RankingMetrics.OP, RankingMetrics.DSTAR] and \
+            len(rankings) > 0:
+        finite = np.isfinite(rankings)
+        max_ranking = rankings.max(where=finite, initial=0)
+        if not finite.all():
+            max_ranking = 2*max_ranking if max_ranking > 0 else 1
+            rankings = np.where(finite, rankings, max_ranking)
+        return np.where(rankings != -1, __divide(rankings, max_ranking), 0)
+    return rankings
+
+
+def get_spectra_array(entities_analytics: List[dict]) -> np.ndarray:
+    """Gather the counters of the entities analytics into a contiguous spectra array.
+
+    Args:
+        entities_analytics (List[dict]): list of analytics and properties for each entity
+
+    Returns:
+        np.ndarray: counters of each entity (rows), in the order of SPECTRA_FIELDS
+    """
+    return np.array([[entity_analytics[field] for field in SPECTRA_FIELDS]
+                     for entity_analytics in entities_analytics],
+                    dtype=np.float64).reshape(len(entities_analytics), len(SPECTRA_FIELDS))
+
+
+def get_unique_spectra(spectra: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Reduce a spectra array to its unique rows. The rows are sorted with np.lexsort, faster than
+    np.unique over the rows, and the equal neighbour rows are collapsed.
+
+    Args:
+        spectra (np.ndarray): counters of each entity (rows), in the order of SPECTRA_FIELDS
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: the unique rows, in ascending order, and the index of the
+        unique row of each entity
+    """
+    if len(spectra) == 0:
+        return spectra, np.empty(0, dtype=np.intp)
+    order = np.lexsort(spectra.T[::-1])
+    sorted_spectra = spectra[order]
+    first_rows = np.empty(len(spectra), dtype=bool)
+    first_rows[0] = True
+    np.any(sorted_spectra[1:] != sorted_spectra[:-1], axis=1, out=first_rows[1:])
+    spectra_index = np.empty(len(spectra), dtype=np.intp)
+    spectra_index[order] = np.cumsum(first_rows) - 1
+    return sorted_spectra[first_rows], spectra_index
+
+
+def get_metrics_rankings(
+    spectra: np.ndarray,
+    ranking_metrics: List[RankingMetrics]
+) -> np.ndarray:
+    """Rank all the entities of a spectra array with every metric, and normalize the rankings.
+
+    Args:
+        spectra (np.ndarray): counters of each entity (rows), in the order of SPECTRA_FIELDS
+        ranking_metrics (List[RankingMetrics]): list of ranking metrics to rank each entity
+
+    Returns:
+        np.ndarray: normalized rankings of each metric (rows) for each entity (columns)
+    """
+    metrics_rankings = np.empty((len(ranking_metrics), len(spectra)), dtype=np.float64)
+    for index, metric in enumerate(ranking_metrics):
+        metrics_rankings[index] = normalize_rankings_batch(metric.batch(spectra), metric)
+    return metrics_rankings
+
+
+def rank_spectra(
+    spectra: np.ndarray,
+    ranking_metrics: List[RankingMetrics],
+    ranking_merge_op: RankMergeOperator
+) -> np.ndarray:
+    """Rank all the entities of a spectra array with every metric, normalize the rankings and merge
+    them, as array operations.
+    Entities with the same counters have the same rankings (e.g. methods always called together),
+    so the counters are reduced to their unique rows first, ranked once per unique row, and the
+    rankings are scattered back to the entities. The normalization only depends on the maximum
+    ranking, the same over the unique rows.
+
+    Args:
+        spectra (np.ndarray): counters of each entity (rows), in the order of SPECTRA_FIELDS
+        ranking_metrics (List[RankingMetrics]): list of ranking metrics to rank each entity
+        ranking_merge_op (RankMergeOperator): operator to merge the rankings of each entity
+
+    Returns:
+        np.ndarray: final ranking of each entity
+    """
+    unique_spectra, spectra_index = get_unique_spectra(spectra)
+    sfl_logger.logger.debug('Ranking %d unique spectra of %d entities.',
+                            len(unique_spectra), len(spectra))
+    metrics_rankings = get_metrics_rankings(unique_spectra, ranking_metrics)
+    return ranking_merge_op.batch(metrics_rankings)[spectra_index]
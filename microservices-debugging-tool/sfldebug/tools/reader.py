@@ -0,0 +1,98 @@
+from enum import Enum
+import gzip
+import io
+import os
+from typing import BinaryIO, Optional
+
+try:
+    import zstandard
+except ImportError:  # optional, only required to read zstd compressed files
+    zstandard = None
+
+# size of the blocks read from compressed files, decompressed in a stream
+DECOMPRESSION_BLOCK_SIZE = 1 << 20
+
+
+class Compression(str, Enum):
+    """Enum for the compression formats of the log files.
+    Each format is detected by the file extension or by the magic bytes at the start of the file.
+
+    Formats:
+        GZIP: gzip compressed files ('.gz')
+        ZSTD: zstandard compressed files ('.zst'), requires the zstandard package
+    """
+    GZIP = 'GZIP'
+    ZSTD = 'ZSTD'
+
+    __EXTENSIONS__ = {
+        'GZIP': ('.gz', '.gzip'),
+        'ZSTD': ('.zst', '.zstd')
+    }
+
+    __MAGIC_BYTES__ = {
+        'GZIP': b'\x1f\x8b',
+        'ZSTD': b'\x28\xb5\x2f\xfd'
+    }
+
+    def has_extension(self, filepath: str) -> bool:
+        """Check if the file path has an extension of the compression format."""
+        return filepath.lower().endswith(self.__EXTENSIONS__[self.value])
+
+    def has_magic_bytes(self, header: bytes) -> bool:
+        """Check if the header of a file starts with the magic bytes of the compression format."""
+        return header.startswith(self.__MAGIC_BYTES__[self.value])
+
+
+def detect_compression(filepath: str) -> Optional[Compression]:
+    """Detect the compression format of a file, by its extension or by its magic bytes.
+
+    Args:
+        filepath (str): path of the file
+
+    Returns:
+        Optional[Compression]: the compression format of the file, or None if not compressed
+    """
+    for compression in Compression:
+        if compression.has_extension(filepath):
+            return compression
+
+    with open(filepath, 'rb') as file:
+        header = file.read(4)
+    for compression in Compression:
+        if compression.has_magic_bytes(header):
+            return compression
+    return None
+
+
+def open_log_file(
+    filepath: str,
+    block_size: int = DECOMPRESSION_BLOCK_SIZE
+) -> BinaryIO:
+    """Open a log file for reading in binary mode, decompressing it in a stream if compressed.
+    Compressed files are read and decompressed in large blocks, without temporary files.
+
+    Args:
+        filepath (str): path of the log file, plain or compressed
+        block_size (int, optional): size of the blocks read from compressed files. Defaults to
+        DECOMPRESSION_BLOCK_SIZE.
+
+    Raises:
+        ImportError: if the file is zstd compressed and zstandard is not installed
+
+    Returns:
+        BinaryIO: the file object, to be read by lines
+    """
+    compression = detect_compression(filepath)
+    if compression is None:
+        return open(filepath, 'rb')
+
+    if compression == Compression.GZIP:
+        return io.BufferedReader(gzip.GzipFile(filepath, 'rb'),  # type: ignore
+                                 buffer_size=block_size)
+
+    if zstandard is None:
+        raise ImportError(
+            'Reading "{}" requires the zstandard package.'.format(os.path.basename(filepath)))
+    stream_reader = zstandard.ZstdDecompressor().stream_reader(
+        open(filepath, 'rb'), read_size=block_size, read_across_frames=True, closefd=True)
+    return io.BufferedReader(stream_reader, buffer_size=block_size)  # type: ignore
@@ -0,0 +1,229 @@
+from datetime import datetime, timezone
+from typing import Any, List, Optional
+import warnings
+
+import numpy as np
+
+from sfldebug.analytics import analyze_entities
+from sfldebug.entity import Entity
+from sfldebug.sfl import rank
+from sfldebug.spectra import EntitySpectra
+from sfldebug.tools.ranking_metrics import RankingMetrics
+from sfldebug.tools.ranking_merge import RankMergeOperator
+import sfldebug.tools.logger as sfl_logger
+from sfldebug.tools.writer import write_results_to_file
+
+# size of each tumbling window, in seconds
+DEFAULT_WINDOW_SIZE = 60
+# number of most recent windows kept in memory
+DEFAULT_MAX_WINDOWS = 10
+
+MISSING_TIMESTAMP = np.iinfo(np.int64).min
+
+
+def parse_timestamps(timestamps: List[Optional[str]]) -> np.ndarray:
+    """Parse a list of ISO8601 timestamps, in UTC, into milliseconds since the epoch.
+    The timestamps are parsed at once as numpy datetimes. If any of them has a timezone offset or
+    another format numpy does not parse, they are parsed one by one instead, so only the invalid
+    ones are lost. Missing or invalid timestamps are set to MISSING_TIMESTAMP.
+
+    Args:
+        timestamps (List[Optional[str]]): timestamps to be parsed
+
+    Returns:
+        np.ndarray: array of int64 milliseconds since the epoch
+    """
+    timestamps_array = np.array(['NaT' if timestamp is None else timestamp
+                                 for timestamp in timestamps], dtype=str)
+    try:
+        with warnings.catch_warnings():
+            # numpy warns about timezone offsets before failing to parse them
+            warnings.simplefilter('ignore', UserWarning)
+            # timestamps are in UTC, the 'Z' designator can be dropped
+            parsed = np.char.rstrip(timestamps_array, 'Z').astype('datetime64[ms]')
+        return parsed.astype(np.int64)
+    except ValueError:
+        pass
+
+    parsed_timestamps = np.empty(len(timestamps), dtype=np.int64)
+    for index, timestamp in enumerate(timestamps):
+        try:
+            timestamp = str(timestamp)
+            # datetime parses the 'Z' designator only from Python 3.11
+            if timestamp.endswith('Z'):
+                timestamp = timestamp[:-1] + '+00:00'
+            parsed_datetime = datetime.fromisoformat(timestamp)
+            if parsed_datetime.tzinfo is None:
+                parsed_datetime = parsed_datetime.replace(tzinfo=timezone.utc)
+            parsed_timestamps[index] = int(parsed_datetime.timestamp() * 1000)
+        except ValueError:
+            parsed_timestamps[index] = MISSING_TIMESTAMP
+    return parsed_timestamps
+
+
+class WindowedSpectra:
+    """Entity spectra bucketed into fixed, tumbling, time windows.
+    Each entity is assigned to the window of the timestamp of its log, and each window keeps the
+    compact spectra of its good and faulty entities, so each window can be analyzed and ranked on
+    its own.
+    Only the most recent windows are kept. Older windows are evicted, and ranked before if an
+    execution id is set, so the memory used stays constant on always-on log streams. Entities of
+    evicted windows arriving late, or without timestamp, are dropped.
+
+    Args:
+        window_size (int): size of each window, in seconds (default DEFAULT_WINDOW_SIZE)
+        max_windows (int): number of most recent windows kept (default DEFAULT_MAX_WINDOWS)
+        ranking_metrics (List[RankingMetrics]): list of ranking metrics to rank the entities of
+        each window (default [RankingMetrics.OCHIAI])
+        ranking_merge_op (RankMergeOperator): operator to merge the rankings of each entity
+        (default RankMergeOperator.AVG)
+        execution_id (Optional[str]): if set, the ranking of each evicted window is written to
+        file with this execution id (default None)
+    """
+
+    def __init__(
+        self,
+        window_size: int = DEFAULT_WINDOW_SIZE,
+        max_windows: int = DEFAULT_MAX_WINDOWS,
+        ranking_metrics: Optional[List[RankingMetrics]] = None,
+        ranking_merge_op: RankMergeOperator = RankMergeOperator.AVG,
+        execution_id: Optional[str] = None
+    ) -> None:
+        self.window_size_ms = window_size * 1000
+        self.max_windows = max_windows
+        self.ranking_metrics = ranking_metrics or [RankingMetrics.OCHIAI]
+        self.ranking_merge_op = ranking_merge_op
+        self.execution_id = execution_id
+
+        # spectra of the good and faulty entities of each window, indexed by the window index
+        self.windows: dict[int, dict[str, EntitySpectra]] = {}
+        self.latest_window: Optional[int] = None
+        self.dropped_entities: int = 0
+
+    def get_window_start(self, window: int) -> str:
+        """Get the start of a window, in ISO8601 format.
+
+        Args:
+            window (int): index of the window
+
+        Returns:
+            str: timestamp of the start of the window, in UTC
+        """
+        return str(np.datetime64(window * self.window_size_ms, 'ms')) + 'Z'
+
+    def add_entities(
+        self,
+        entities: List[Entity],
+        execution_key: str
+    ) -> None:
+        """Assign each entity to the window of its timestamp, parsing the timestamps at once.
+        Entities built from the logs have a single reference, with the timestamp of the log.
+
+        Args:
+            entities (List[Entity]): entities parsed from a batch of messages of the same side
+            execution_key (str): side the messages came from, 'good_executed' or 'faulty_executed'
+        """
+        if len(entities) == 0:
+            return
+        timestamps = [next(iter(entity.references.values()))[0].get('timestamp')
+                      for entity in entities]
+        parsed_timestamps = parse_timestamps(timestamps)
+        entities_windows = parsed_timestamps // self.window_size_ms
+
+        valid_timestamps = parsed_timestamps != MISSING_TIMESTAMP
+        if valid_timestamps.any():
+            batch_latest_window = int(entities_windows[valid_timestamps].max())
+            if self.latest_window is None or batch_latest_window > self.latest_window:
+                self.latest_window = batch_latest_window
+                self.evict_expired_windows()
+        oldest_window = self.get_oldest_window()
+
+        for entity, window, valid_timestamp in zip(entities, entities_windows.tolist(),
+                                                   valid_timestamps.tolist()):
+            if not valid_timestamp or window < oldest_window:
+                self.dropped_entities += 1
+                continue
+            window_spectra = self.windows.get(window)
+            if window_spectra is None:
+                window_spectra = {'good_executed': EntitySpectra(),
+                                  'faulty_executed': EntitySpectra()}
+                self.windows[window] = window_spectra
+            window_spectra[execution_key].add_entity(entity)
+
+    def get_oldest_window(self) -> int:
+        """Get the index of the oldest window kept.
+
+        Returns:
+            int: index of the oldest window kept
+        """
+        if self.latest_window is None:
+            return MISSING_TIMESTAMP
+        return self.latest_window - self.max_windows + 1
+
+    def evict_expired_windows(self) -> None:
+        """Remove the windows older than the most recent windows kept. If the execution id is set,
+        the evicted windows are ranked and written to file before being removed."""
+        oldest_window = self.get_oldest_window()
+        for window in sorted(self.windows.keys()):
+            if window >= oldest_window:
+                break
+            if self.execution_id is not None:
+                self.write_window_ranking(window)
+            del self.windows[window]
+            sfl_logger.logger.debug('Evicted window starting at %s.',
+                                    self.get_window_start(window))
+
+    def analyze_window(self, window: int) -> dict[int, dict[str, Any]]:
+        """Analyze the executions of the entities of a window.
+
+        Args:
+            window (int): index of the window
+
+        Returns:
+            dict[int, dict[str, Any]]: the analytics of each entity in the window
+        """
+        window_spectra = self.windows[window]
+        return analyze_entities(window_spectra['good_executed'],
+                                window_spectra['faulty_executed'])
+
+    def rank_window(self, window: int) -> Optional[List[dict]]:
+        """Rank the entities of a window. Windows without executions in both sides cannot be
+        ranked.
+
+        Args:
+            window (int): index of the window
+
+        Returns:
+            Optional[List[dict]]: the ranked entities of the window, or None if it cannot be ranked
+        """
+        try:
+            return rank(self.analyze_window(window), self.ranking_metrics, self.ranking_merge_op)
+        except (RuntimeError, ZeroDivisionError) as err:
+            sfl_logger.logger.warning('Window starting at %s cannot be ranked: %s.',
+                                      self.get_window_start(window), err)
+            return None
+
+    def rank_windows(self) -> dict[str, Optional[List[dict]]]:
+        """Rank the entities of each window kept.
+
+        Returns:
+            dict[str, Optional[List[dict]]]: the ranking of each window, indexed by its start
+        """
+        return {self.get_window_start(window): self.rank_window(window)
+                for window in sorted(self.windows.keys())}
+
+    def write_window_ranking(self, window: int) -> None:
+        """Rank a window and write the ranking to file, named after the window start.
+
+        Args:
+            window (int): index of the window
+        """
+        window_ranking = self.rank_window(window)
+        if window_ranking is None:
+            return
+        window_start = self.get_window_start(window)
+        write_results_to_file({'window_start': window_start,
+                               'window_size': self.window_size_ms // 1000,
+                               'ranking': window_ranking},
+                              'entities-ranking-window-' + window_start.replace(':', '-'),
+                              self.execution_id)  # type: ignore
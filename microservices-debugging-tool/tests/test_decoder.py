@@ -0,0 +1,13 @@
+import os
+
+import pytest
+
+from sfldebug.messages.decoder import (LOG_TEMPLATE_FIELDS, LOG_TEMPLATE_PATH,
+                                       load_log_template_fields)
+
+
+@pytest.mark.skipif(not os.path.isfile(LOG_TEMPLATE_PATH),
+                    reason='the log processor project is not checked out next to the tool')
+def test_log_template_fields_match_template():
+    """The fields of the log template kept in the tool are the fields of the template file."""
+    assert LOG_TEMPLATE_FIELDS == load_log_template_fields(LOG_TEMPLATE_PATH)
@@ -0,0 +1,30 @@
+import multiprocessing as mp
+
+from sfldebug.tools.instrumentation import call_recording_metrics, instrumented, metrics
+
+# number of messages counted by each worker
+N_MESSAGES = 100
+
+
+@instrumented('parse')
+def count_messages(n_messages: int) -> int:
+    """Record the messages received as a receiver in a worker process does."""
+    metrics.count('receive', 'messages', n_messages)
+    return n_messages
+
+
+def test_worker_metrics_are_merged_into_parent():
+    """The stages recorded in worker processes reach the metrics of the parent process."""
+    metrics.clear()
+    with mp.Pool(2) as pool:
+        workers = [pool.apply_async(call_recording_metrics, (count_messages, N_MESSAGES))
+                   for _ in range(4)]
+        for worker in workers:
+            result, stages = worker.get()
+            assert result == N_MESSAGES
+            metrics.merge(stages)
+
+    stages = metrics.to_dict()['stages']
+    assert stages['receive']['counters'] == {'messages': 4 * N_MESSAGES}
+    assert stages['parse']['calls'] == 4
+    metrics.clear()
@@ -0,0 +1,50 @@
+import json
+
+from sfldebug.lazy import LazyReference, materialize_references
+from sfldebug.messages.decoder import decode_log_message
+from sfldebug.retention import is_error_reference
+import sfldebug.schema as sfl_schema
+
+# logs of a service and its methods, with and without request id and errors
+LOGS = [
+    {'microserviceName': 'svc-1', 'correlationID': 'request-1', 'httpCode': 200,
+     'endpoint': '/e1', 'timestamp': '2022-05-01T10:00:00.000Z'},
+    {'microserviceName': 'svc-1', 'correlationID': 'request-1', 'httpCode': 503,
+     'timestamp': '2022-05-01T10:00:01.000Z'},
+    {'microserviceName': 'svc-1', 'correlationID': 'request-2', 'logLevel': 'error',
+     'message': 'failed', 'timestamp': '2022-05-01T10:00:02.000Z',
+     'methodInvocation': {'methodName': 'm1', 'className': 'C', 'line': 1}},
+    {'microserviceName': 'svc-1', 'logLevel': 'INFO', 'timestamp': '2022-05-01T10:00:03.000Z',
+     'methodInvocation': {'methodName': 'm2', 'className': 'C', 'line': 2}}
+]
+
+
+def test_lazy_extractor_matches_extractor(tmp_path):
+    """The lazy extractor builds the entities of the extractor, with lazy references flagged as
+    error references as the references of the extractor, which read the same fields once
+    materialized."""
+    logs_path = str(tmp_path / 'logs.log')
+    lines = [json.dumps(log).encode('utf-8') + b'\n' for log in LOGS]
+    with open(logs_path, 'wb') as logs_file:
+        logs_file.writelines(lines)
+
+    offset = 0
+    for line in lines:
+        log_data = decode_log_message(line)
+        entities = {entity.get_key(): entity for entity in sfl_schema.entity_extractor(log_data)}
+        lazy_entities = sfl_schema.lazy_entity_extractor(log_data, logs_path, offset, len(line))
+        offset += len(line)
+
+        assert {entity.get_key() for entity in lazy_entities} == set(entities)
+        for lazy_entity in lazy_entities:
+            entity = entities[lazy_entity.get_key()]
+            assert lazy_entity.children_names == entity.children_names
+            assert lazy_entity.references.keys() == entity.references.keys()
+            request_id = next(iter(entity.references))
+            lazy_reference, = lazy_entity.references[request_id]
+            reference, = entity.references[request_id]
+            assert isinstance(lazy_reference, LazyReference)
+            assert lazy_reference.error == is_error_reference(reference)
+
+            materialize_references(lazy_entity.references)
+            assert lazy_entity.references == entity.references
@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+from sfldebug.tools.ranking_merge import RankMergeOperator
+from sfldebug.tools.ranking_metrics import (SPECTRA_FIELDS, RankingMetrics, normalize_rankings,
+                                            normalize_rankings_batch, rank_spectra)
+
+# number of random spectra compared between the batch and per-entity metrics
+N_SPECTRA = 2000
+
+
+@pytest.fixture(name='spectra')
+def fixture_spectra() -> np.ndarray:
+    """Random spectra with small counters, so many of them have zero denominators."""
+    return np.random.default_rng(0).integers(0, 4, size=(N_SPECTRA, len(SPECTRA_FIELDS))) \
+        .astype(np.float64)
+
+
+def rank_per_entity(spectra: np.ndarray, metric: RankingMetrics) -> np.ndarray:
+    """Rank each entity with the per-entity metric, NaN where the metric cannot be computed."""
+    rankings = []
+    for row in spectra:
+        entity_analytics = dict(zip(SPECTRA_FIELDS, (int(counter) for counter in row)),
+                                properties={'name': 'method', 'parent_name': 'service'})
+        try:
+            rankings.append(metric(entity_analytics))
+        except ZeroDivisionError:
+            rankings.append(np.nan)
+    return np.array(rankings, dtype=np.float64)
+
+
+@pytest.mark.parametrize('metric', list(RankingMetrics))
+def test_batch_metric_equals_per_entity_metric(spectra, metric):
+    """Each batch metric ranks the entities as the per-entity metric, where it is defined."""
+    per_entity = rank_per_entity(spectra, metric)
+    defined = ~np.isnan(per_entity)
+    assert defined.any()
+    np.testing.assert_allclose(metric.batch(spectra)[defined], per_entity[defined])
+
+    defined_spectra = spectra[defined]
+    np.testing.assert_allclose(
+        normalize_rankings_batch(metric.batch(defined_spectra), metric),
+        normalize_rankings(list(per_entity[defined]), metric))
+
+
+def test_dstar_ranks_ideal_fault_first():
+    """An entity executed in every faulty execution and in no good one ranks above every other
+    entity with D*, alone or merged with other metrics, and the never executed entity ranks 0."""
+    spectra = np.array([[0, 10, 10, 0], [5, 5, 3, 7], [0, 10, 0, 10]], dtype=np.float64)
+
+    assert RankingMetrics.DSTAR.batch(spectra)[0] == np.inf
+    for ranking_metrics in ([RankingMetrics.DSTAR], [RankingMetrics.OCHIAI, RankingMetrics.DSTAR]):
+        rankings = rank_spectra(spectra, ranking_metrics, RankMergeOperator.AVG)
+        assert rankings[0] == 1
+        assert 0 < rankings[1] < 1
+        assert rankings[2] == 0
+
+
+def test_ochiai_ranks_entity_not_executed_in_faulty_cases_with_zero():
+    """Ochiai ranks the entities never executed in faulty executions with 0, also when its
+    denominator is 0."""
+    spectra = np.array([[0, 10, 0, 10], [5, 5, 0, 10], [0, 0, 0, 0]], dtype=np.float64)
+
+    np.testing.assert_array_equal(RankingMetrics.OCHIAI.batch(spectra), [0, 0, 0])
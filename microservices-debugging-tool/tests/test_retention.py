@@ -0,0 +1,35 @@
+from sfldebug.aggregator import EntityAggregator
+from sfldebug.entity import Entity
+from sfldebug.retention import ReferenceRetention, RetentionPolicy
+
+# number of references parsed by each partial aggregation
+N_REFERENCES = 10000
+
+# maximum number of references kept per entity
+MAX_REFERENCES = 100
+
+
+def aggregate_chunk(chunk: str, retention: ReferenceRetention) -> EntityAggregator:
+    """Aggregate the references of a single entity in a chunk, one request per reference, with
+    the request ids prefixed by the chunk name."""
+    aggregator = EntityAggregator(retention)
+    for index in range(N_REFERENCES):
+        request_id = '{}-{}'.format(chunk, index)
+        aggregator.update([Entity('service', {request_id: [{'request_id': request_id}]})])
+    return aggregator
+
+
+def test_merged_reservoirs_sample_both_chunks():
+    """Merging the reservoirs of two chunks of the same size keeps references of both chunks,
+    about half of each, and keeps counting every reference and execution."""
+    retention = ReferenceRetention(RetentionPolicy.RESERVOIR, MAX_REFERENCES, seed=0)
+    merged = aggregate_chunk('a', retention)
+    merged.merge(aggregate_chunk('b', retention))
+
+    entity, = merged.get_entities()
+    chunks = [request_id.split('-')[0] for request_id, references in entity.references.items()
+              for _ in references]
+    assert len(chunks) == len(entity.retained_references) == MAX_REFERENCES
+    assert 30 <= chunks.count('a') <= 70 and 30 <= chunks.count('b') <= 70
+    assert entity.get_ref_count() == 2 * N_REFERENCES
+    assert entity.get_number_unique_exec() == 2 * N_REFERENCES
@@ -0,0 +1,121 @@
+import json
+import random
+from functools import partial
+from typing import List
+
+import pytest
+
+from main import run
+from sfldebug.messages.receive import receive_file
+from sfldebug.shards import build_shard, merge_shards, read_shard, receive_shards, write_shard
+from sfldebug.tools.ranking_merge import RankMergeOperator
+from sfldebug.tools.ranking_metrics import RankingMetrics
+
+# number of log lines of each side of the synthetic execution
+N_LOGS = 3000
+
+# number of nodes the logs are split into, one shard each
+N_SHARDS = 3
+
+RANKING_METRICS = [RankingMetrics.OCHIAI, RankingMetrics.JACCARD]
+
+
+def generate_logs(logs_path: str, faulty: bool, seed: int) -> List[str]:
+    """Write a synthetic log file in the format of the log template, with a faulty method in the
+    faulty logs.
+
+    Args:
+        logs_path (str): path of the log file
+        faulty (bool): if True, the logs of the faulty method are written too
+        seed (int): seed of the random logs
+
+    Returns:
+        List[str]: the lines of the log file
+    """
+    rng = random.Random(seed)
+    services = {'svc-{}'.format(i): ['m{}_{}'.format(i, j) for j in range(5)] for i in range(6)}
+    request_ids = ['request-{}-{}'.format(seed, i) for i in range(N_LOGS // 10)]
+    lines = []
+    for index in range(N_LOGS):
+        service = rng.choice(list(services))
+        log = {'microserviceName': service,
+               'timestamp': '2022-05-01T10:{:02d}:{:02d}.000Z'.format(index // 60 % 60,
+                                                                     index % 60),
+               'endpoint': '/e{}'.format(rng.randint(0, 2)), 'httpCode': 200}
+        if rng.random() < 0.9:
+            log['correlationID'] = rng.choice(request_ids)
+        if rng.random() < 0.7:
+            method = rng.choice(services[service])
+            if faulty and service == 'svc-3' and rng.random() < 0.5:
+                method = 'm3_bad'
+            log['methodInvocation'] = {'methodName': method, 'className': 'C', 'line': 1}
+            log['logLevel'] = rng.choice(['INFO', 'ERROR'])
+        lines.append(json.dumps(log) + '\n')
+    with open(logs_path, 'w', encoding='utf-8') as logs_file:
+        logs_file.writelines(lines)
+    return lines
+
+
+def get_ranking(entities_ranked: List[dict]) -> List[tuple]:
+    """Get the entities of a ranking, in order, with their ranking and number of references."""
+    return [(entity['properties']['parent_name'], entity['properties']['name'],
+             pytest.approx(entity['entity_rank']), entity['properties']['ref_count'])
+            for entity in entities_ranked]
+
+
+@pytest.fixture(name='shard_paths')
+def fixture_shard_paths(tmp_path, monkeypatch) -> List[str]:
+    """Write the synthetic logs, split the lines of each side into N_SHARDS nodes, and write the
+    shard of each node. The results are written in the temporary directory."""
+    monkeypatch.chdir(tmp_path)
+    good_lines = generate_logs('good.log', False, 1)
+    faulty_lines = generate_logs('faulty.log', True, 2)
+
+    shard_paths = []
+    for node in range(N_SHARDS):
+        good_path, faulty_path = 'good-{}.log'.format(node), 'faulty-{}.log'.format(node)
+        with open(good_path, 'w', encoding='utf-8') as good_file:
+            good_file.writelines(good_lines[node::N_SHARDS])
+        with open(faulty_path, 'w', encoding='utf-8') as faulty_file:
+            faulty_file.writelines(faulty_lines[node::N_SHARDS])
+        node_id = 'node-{}'.format(node)
+        received = receive_file(good_path, faulty_path, node_id)
+        shard_path = 'shard-{}.json'.format(node)
+        write_shard(build_shard(received, good_path, faulty_path, node_id), shard_path)
+        shard_paths.append(shard_path)
+    return shard_paths
+
+
+def test_merged_shards_rank_as_single_node(shard_paths):
+    """The merged shards are ranked as the unsplit logs parsed in a single node."""
+    single_node = run('single-node', 'good.log', 'faulty.log', receive_file, RANKING_METRICS,
+                      RankMergeOperator.AVG, top_k=None)
+    merged = run('merged', 'good', 'faulty', partial(receive_shards, shard_paths=shard_paths),
+                 RANKING_METRICS, RankMergeOperator.AVG, top_k=None)
+
+    assert single_node is not None and merged is not None
+    assert get_ranking(merged) == get_ranking(single_node)
+    assert single_node[0]['properties']['name'] == 'm3_bad'
+
+
+def test_shards_merge_associatively(shard_paths):
+    """Merging the shards in different groupings gives the same shard and the same ranking."""
+    shards = [read_shard(shard_path) for shard_path in shard_paths]
+    merged_left = merge_shards([merge_shards(shards[:2]), shards[2]])
+    merged_right = merge_shards([shards[0], merge_shards(shards[1:])])
+
+    for side in ('good', 'faulty'):
+        left, right = merged_left[side].to_dict(), merged_right[side].to_dict()
+        assert left['references_paths'] == right['references_paths']
+        assert sorted(left['entities'], key=json.dumps) == \
+            sorted(right['entities'], key=json.dumps)
+
+    write_shard(merged_left, 'merged-left.json')
+    write_shard(merged_right, 'merged-right.json')
+    rankings = [run(execution_id, 'good', 'faulty',
+                    partial(receive_shards, shard_paths=[merged_path]), RANKING_METRICS,
+                    RankMergeOperator.AVG, top_k=None)
+                for execution_id, merged_path in (('left', 'merged-left.json'),
+                                                  ('right', 'merged-right.json'))]
+    assert rankings[0] is not None and rankings[1] is not None
+    assert get_ranking(rankings[0]) == get_ranking(rankings[1])
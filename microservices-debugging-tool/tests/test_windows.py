@@ -0,0 +1,11 @@
+from sfldebug.windows import MISSING_TIMESTAMP, parse_timestamps
+
+
+def test_parse_timestamps_keeps_valid_timestamps_of_invalid_batch():
+    """An invalid timestamp does not set the valid timestamps of its batch as missing."""
+    valid = ['2022-05-01T10:00:00.000Z', '2022-05-01T10:00:01.500Z']
+    expected = list(parse_timestamps(valid))
+
+    parsed = parse_timestamps(valid + ['not a timestamp', None, '2022-05-01T12:00:01.500+02:00'])
+
+    assert list(parsed) == expected + [MISSING_TIMESTAMP, MISSING_TIMESTAMP, expected[1]]